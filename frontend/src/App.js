@@ -244,7 +244,14 @@ const api = {
   async addTableTextMaterial(sessionId, pageIndex, tableText, description = '') { const formData = new FormData(); formData.append('session_id', sessionId); formData.append('page_index', pageIndex); formData.append('table_text', tableText); formData.append('description', description); const res = await fetch(`${API_BASE_URL}/page-material/add-table-text`, { method: 'POST', body: formData }); return res.json(); },
   async removePageMaterial(sessionId, pageIndex, materialIndex) { const res = await fetch(`${API_BASE_URL}/page-material/remove?session_id=${sessionId}&page_index=${pageIndex}&material_index=${materialIndex}`, { method: 'DELETE' }); return res.json(); },
   async listPageMaterials(sessionId) { const res = await fetch(`${API_BASE_URL}/page-material/list/${sessionId}`); return res.json(); },
-  getImageUrl(filename, timestamp) { return timestamp ? `${API_BASE_URL}/image/${encodeURIComponent(filename)}?t=${timestamp}` : `${API_BASE_URL}/image/${encodeURIComponent(filename)}`; },
+  getImageUrl(filename, timestamp, version, width) {
+    // 带版本号（图片内容哈希）的地址可被浏览器长期缓存；width 取缩小后的 WebP
+    const params = new URLSearchParams();
+    if (version) params.set('v', version); else if (timestamp) params.set('t', timestamp);
+    if (width) { params.set('w', width); params.set('fmt', 'webp'); }
+    const query = params.toString();
+    return `${API_BASE_URL}/image/${encodeURIComponent(filename)}${query ? `?${query}` : ''}`;
+  },
   getDownloadUrl(sessionId) { return `${API_BASE_URL}/download/${sessionId}`; },
   getPdfDownloadUrl(sessionId) { return `${API_BASE_URL}/download/${sessionId}/pdf`; },
 };
@@ -920,7 +927,7 @@ function SlideBotApp({ onLogout, isDark, onThemeToggle }) {
       try { 
         const result = await api.generateImage(sessionId, i); 
         if (result.success) { 
-          setPptImages(prev => { const u = [...prev]; u[i] = { page: i + 1, filename: result.filename }; return u; }); 
+          setPptImages(prev => { const u = [...prev]; u[i] = { page: i + 1, filename: result.filename, version: result.image_version }; return u; }); 
           success++; 
           // 每页生成成功后提示
           addMessage('assistant', `✓ 第 ${i + 1}/${total} 页生成完成`);
@@ -954,7 +961,7 @@ function SlideBotApp({ onLogout, isDark, onThemeToggle }) {
     try { 
       const result = await api.refinePageAndRegenerate(sessionId, pageIndex, feedback); 
       if (result.success) { 
-        setPptImages(prev => { const u = [...prev]; u[pageIndex] = { page: pageIndex + 1, filename: result.image_filename, timestamp: Date.now() }; return u; }); 
+        setPptImages(prev => { const u = [...prev]; u[pageIndex] = { page: pageIndex + 1, filename: result.image_filename, version: result.image_version, timestamp: Date.now() }; return u; }); 
         addMessage('assistant', '✓ 第 ' + (pageIndex + 1) + ' 页已更新'); 
       } 
     }
@@ -1316,7 +1323,7 @@ function SlideBotApp({ onLogout, isDark, onThemeToggle }) {
       return (
         <div style={{ position: 'relative', width: '100%', height: '100%', display: 'flex', alignItems: 'center', justifyContent: 'center' }}>
           <img 
-            src={api.getImageUrl(currentImage.filename, currentImage.timestamp)} 
+            src={api.getImageUrl(currentImage.filename, currentImage.timestamp, currentImage.version, 1920)} 
             alt="" 
             style={{ maxWidth: '100%', maxHeight: '100%', objectFit: 'contain', borderRadius: '8px', opacity: isCurrentPageRegenerating ? 0.3 : 1, transition: 'opacity 0.3s ease' }} 
             onError={(e) => { 
@@ -1518,7 +1525,7 @@ function SlideBotApp({ onLogout, isDark, onThemeToggle }) {
                 </div>
               )}
               <div style={{ aspectRatio: '16/9', background: theme.bgTertiary, borderRadius: '6px', display: 'flex', alignItems: 'center', justifyContent: 'center', overflow: 'hidden', marginBottom: '6px' }}>
-                {hasImage ? <img src={api.getImageUrl(img.filename, img.timestamp)} alt="" style={{ width: '100%', height: '100%', objectFit: 'cover' }} /> : <span style={{ fontSize: '16px', color: theme.textMuted, fontWeight: 600 }}>{i + 1}</span>}
+                {hasImage ? <img src={api.getImageUrl(img.filename, img.timestamp, img.version, 320)} alt="" loading="lazy" style={{ width: '100%', height: '100%', objectFit: 'cover' }} /> : <span style={{ fontSize: '16px', color: theme.textMuted, fontWeight: 600 }}>{i + 1}</span>}
               </div>
               <div style={{ fontSize: '10px', color: theme.textSecondary, textAlign: 'center', overflow: 'hidden', textOverflow: 'ellipsis', whiteSpace: 'nowrap', fontWeight: 500 }}>{page.theme || page.title || ('P' + (i + 1))}</div>
             </div>
@@ -5,10 +5,28 @@ SlideBot 模块包
 - config: 配置常量
 - prompts: 提示词模板
 - models: Pydantic数据模型
+- retry: 接口调用重试策略
+- rate_limit: 按模型的令牌桶限流
+- concurrency: 按模型的自适应并发上限（AIMD）
+- circuit_breaker: 按模型的接口熔断
+- hedging: 图片生成长尾请求的对冲
+- single_flight: 相同生成请求的合并
 - asr: 科大讯飞ASR语音转写
 - invite_codes: 邀请码管理
 - session: 会话管理
+- events: 会话变更推送
+- http_client: 共享异步HTTP连接池
+- image_cache: 图片base64编码缓存
+- text_cache: 文本生成结果缓存
+- render_cache: 渲染结果（PPT图片）缓存
+- image_decode: 图片生成响应的流式解码与内存统计
+- postprocess: 图片后处理进程池（原图JPEG、预览与缩略图）
+- image_variants: 图片接口按需缩放与结果缓存
+- image_index: 输出图片的文件名索引
 - gemini_api: Gemini API调用
+- template_analysis: 母版后台分析与结果缓存
+- render: 页面并发渲染调度与按会话取消
+- jobs: 一键生成后台任务
 - visit_counter: 访问计数
 - doc_extract: 文档文本抽取
 """
@@ -16,6 +34,26 @@ SlideBot 模块包
 from .config import *
 from .prompts import *
 from .models import *
+from .retry import (
+    RetryPolicy,
+    RetryCall,
+    TEXT_RETRY_POLICY,
+    IMAGE_RETRY_POLICY,
+    TEMPLATE_ANALYSIS_RETRY_POLICY,
+    ASR_RETRY_POLICY,
+    is_retryable_status,
+    parse_retry_after,
+    retry_stats
+)
+from .rate_limit import TokenBucket, SqliteTokenBucket, acquire_rate_limit, rate_limit_stats
+from .concurrency import AdaptiveLimiter, get_limiter, concurrency_stats
+from .circuit_breaker import CircuitState, CircuitOpenError, CircuitBreaker, get_breaker, circuit_breaker_stats
+from .hedging import HedgeBudget, hedge_stats
+from .single_flight import flight_key, single_flight, single_flight_stats
+from .postprocess import RENDITIONS, page_renditions, image_version, run_postprocess, postprocess_stats
+from .image_variants import IMAGE_FORMATS, get_image_variant, image_variant_stats
+from .image_index import build_image_index, register_image, lookup_image, image_index_stats
+from .image_decode import InlineImageDecoder, save_decoded_image, image_decode_stats
 from .asr import XfyunASR, parse_xfyun_result, format_dialogue_as_text
 from .invite_codes import (
     load_invite_codes, 
@@ -24,15 +62,49 @@ from .invite_codes import (
     record_login, 
     get_login_records_from_csv
 )
-from .session import SessionStage, sessions, get_session, add_message
+from .session import (
+    SessionStage,
+    SessionConflictError,
+    SessionStore,
+    MemorySessionStore,
+    SqliteSessionStore,
+    sessions,
+    get_session,
+    save_session,
+    update_session,
+    add_message,
+    get_session_async,
+    update_session_async,
+    add_message_async,
+    list_messages,
+    session_stats,
+    next_version,
+    mark_changed,
+    session_delta,
+    session_event
+)
+from .events import subscribe, unsubscribe, publish, subscriber_stats
+from .http_client import init_http_client, get_http_client, close_http_client
+from .image_cache import get_cached_base64, image_cache_stats, clear_image_cache
+from .text_cache import get_cached_text, set_cached_text, discard_cached_text, text_cache_stats
+from .render_cache import render_cache_key, load_rendered_image, store_rendered_image, render_cache_stats
 from .gemini_api import (
     get_image_base64,
     get_image_mime_type,
     parse_json_from_text,
     generate_text,
+    discard_generated_text,
     generate_ppt_image,
     analyze_template_design
 )
+from .template_analysis import (
+    AnalysisStatus,
+    start_template_analysis,
+    wait_template_analysis,
+    template_analysis_status
+)
+from .render import RENDER_MODES, RenderCancelled, render_slot, render_page, render_deck, finish_deck, track_render, cancel_renders
+from .jobs import JobStatus, PageStatus, jobs, get_job, create_job, find_or_create_job, start_job, cancel_job, recover_jobs
 from .visit_counter import get_visit_count, increment_visit_count
 from .doc_extract import (
     extract_text_from_document,
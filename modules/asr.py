@@ -10,9 +10,62 @@ import hmac
 import time
 import urllib
 import requests
+from urllib3.exceptions import NewConnectionError
 from typing import Optional, List
 
-from .config import XFYUN_APPID, XFYUN_SECRET_KEY, LFASR_HOST
+from .config import XFYUN_APPID, XFYUN_SECRET_KEY, LFASR_HOST, ASR_REQUEST_TIMEOUT
+from .retry import ASR_RETRY_POLICY, is_retryable_status, parse_retry_after
+
+
+# 非幂等请求（上传）只在这些状态码且带 Retry-After 时重试：服务端明确表示未处理、稍后再试
+_NOT_PROCESSED_STATUS_CODES = {429, 503}
+
+
+def _is_connect_error(e: Exception) -> bool:
+    """请求是否没有发出（建立连接失败或连接超时）"""
+    if isinstance(e, requests.ConnectTimeout):
+        return True
+    if not isinstance(e, requests.ConnectionError) or not e.args:
+        return False
+    return isinstance(getattr(e.args[0], "reason", None), NewConnectionError)
+
+
+def _post_with_retry(url: str, idempotent: bool = True, **kwargs) -> dict:
+    """
+    调用讯飞接口（按 ASR_RETRY_POLICY 重试临时错误），返回解析后的JSON
+
+    idempotent=False 用于上传：重复提交会创建重复的转写订单，只在请求确定没有被处理时重试
+    （建立连接失败，或返回 429/503 且带 Retry-After）
+    """
+    call = ASR_RETRY_POLICY.begin()
+    last_error = None
+    for attempt in call.attempts():
+        retryable, retry_after = True, None
+        try:
+            response = requests.post(url, timeout=ASR_REQUEST_TIMEOUT, **kwargs)
+            call.record_status(response.status_code)
+            if response.status_code == 200:
+                result = json.loads(response.text)
+                call.succeed()
+                return result
+            last_error = f"HTTP {response.status_code}"
+            retryable = is_retryable_status(response.status_code)
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            if not idempotent:
+                retryable = response.status_code in _NOT_PROCESSED_STATUS_CODES and retry_after is not None
+        except (requests.RequestException, ValueError) as e:
+            last_error = str(e)
+            if not idempotent:
+                retryable = _is_connect_error(e)
+
+        delay = call.retry_delay(retryable, retry_after)
+        if delay is None:
+            break
+        print(f"讯飞接口第{attempt}次调用失败（{last_error}），{delay:.1f}秒后重试")
+        time.sleep(delay)
+
+    call.fail()
+    raise RuntimeError(f"讯飞接口调用失败（共尝试{call.attempt}次）: {last_error}")
 
 
 class XfyunASR:
@@ -59,12 +112,12 @@ class XfyunASR:
         print(f"上传参数: {param_dict}")
 
         data = open(self.upload_file_path, 'rb').read(file_len)
-        response = requests.post(
+        result = _post_with_retry(
             url=LFASR_HOST + '/upload?' + urllib.parse.urlencode(param_dict),
+            idempotent=False,
             headers={"Content-type": "application/json"},
             data=data
         )
-        result = json.loads(response.text)
         print(f"上传响应: {result}")
         return result
 
@@ -91,11 +144,10 @@ class XfyunASR:
 
         # 轮询等待结果
         while status == 3:
-            response = requests.post(
+            result = _post_with_retry(
                 url=LFASR_HOST + '/getResult?' + urllib.parse.urlencode(param_dict),
                 headers={"Content-type": "application/json"}
             )
-            result = json.loads(response.text)
             status = result.get('content', {}).get('orderInfo', {}).get('status', 0)
             print(f"状态: {status}")
 
@@ -0,0 +1,141 @@
+"""
+熔断模块 - 按模型的 Gemini 接口熔断器
+
+模型接口大面积故障时，每页每次都要等满超时再重试，请求和连接会堆积。熔断器按模型统计最近的调用结果：
+- closed（正常）: 统计窗口内调用次数达到 CIRCUIT_MIN_CALLS 且失败率达到 CIRCUIT_FAILURE_RATE 时熔断
+- open（熔断）: 直接抛出 CircuitOpenError，不再发送请求；CIRCUIT_OPEN_SECONDS 后进入半开
+- half_open（半开）: 只放行一个探测请求，成功则恢复正常，失败则重新熔断
+
+只有超时、网络错误和5xx算作失败；429（限流）和其他4xx说明服务本身可用，不计入失败率。
+"""
+
+import time
+from collections import deque
+from typing import Deque, Dict, Optional
+
+from .config import (
+    TEXT_MODEL,
+    IMAGE_MODEL,
+    CIRCUIT_FAILURE_RATE,
+    CIRCUIT_MIN_CALLS,
+    CIRCUIT_WINDOW_SECONDS,
+    CIRCUIT_OPEN_SECONDS
+)
+
+
+class CircuitState:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """熔断中，调用被直接拒绝"""
+
+    def __init__(self, name: str, retry_in: float):
+        self.name = name
+        self.retry_in = retry_in
+        super().__init__(f"{name} 接口近期失败率过高，已暂停调用，约{max(1, round(retry_in))}秒后恢复尝试")
+
+
+class CircuitBreaker:
+    """单个模型接口的熔断器"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = CircuitState.CLOSED
+        # 统计窗口内的调用结果 (时间, 是否成功)
+        self.results: Deque[tuple] = deque()
+        self.opened_at = 0.0
+        self.probing = False  # 半开状态下是否已有探测请求在进行
+        self.stats = {"rejected": 0, "opened": 0, "closed": 0}
+
+    def _prune(self, now: float):
+        while self.results and now - self.results[0][0] > CIRCUIT_WINDOW_SECONDS:
+            self.results.popleft()
+
+    def failure_rate(self) -> Optional[float]:
+        self._prune(time.monotonic())
+        if not self.results:
+            return None
+        return sum(1 for _, ok in self.results if not ok) / len(self.results)
+
+    def _open(self, reason: str):
+        self.state = CircuitState.OPEN
+        self.opened_at = time.monotonic()
+        self.probing = False
+        self.stats["opened"] += 1
+        print(f"[熔断] {self.name} {reason}，暂停调用 {CIRCUIT_OPEN_SECONDS} 秒")
+
+    def before_call(self):
+        """发送请求前调用：熔断中抛出 CircuitOpenError"""
+        if self.state == CircuitState.OPEN:
+            retry_in = CIRCUIT_OPEN_SECONDS - (time.monotonic() - self.opened_at)
+            if retry_in > 0:
+                self.stats["rejected"] += 1
+                raise CircuitOpenError(self.name, retry_in)
+            self.state = CircuitState.HALF_OPEN
+            print(f"[熔断] {self.name} 进入半开状态，发送探测请求")
+
+        if self.state == CircuitState.HALF_OPEN:
+            if self.probing:
+                self.stats["rejected"] += 1
+                raise CircuitOpenError(self.name, CIRCUIT_OPEN_SECONDS)
+            self.probing = True
+
+    def record(self, ok: Optional[bool]):
+        """
+        请求结束后调用
+
+        ok: True 成功，False 失败（超时/网络错误/5xx），None 不计入统计（请求被取消或客户端错误）
+        """
+        if self.state == CircuitState.HALF_OPEN:
+            if ok is None:
+                self.probing = False  # 探测被取消，允许下一个请求继续探测
+            elif ok:
+                self.state = CircuitState.CLOSED
+                self.probing = False
+                self.results.clear()
+                self.stats["closed"] += 1
+                print(f"[熔断] {self.name} 探测成功，恢复正常调用")
+            else:
+                self._open("探测请求失败")
+            return
+
+        if ok is None or self.state != CircuitState.CLOSED:
+            return
+        now = time.monotonic()
+        self.results.append((now, ok))
+        self._prune(now)
+        if not ok and len(self.results) >= CIRCUIT_MIN_CALLS:
+            failure_rate = self.failure_rate()
+            if failure_rate >= CIRCUIT_FAILURE_RATE:
+                self._open(f"最近{len(self.results)}次调用失败率{failure_rate:.0%}")
+
+    def snapshot(self) -> dict:
+        failure_rate = self.failure_rate()
+        snapshot = {
+            "state": self.state,
+            "failure_rate": round(failure_rate, 3) if failure_rate is not None else None,
+            "calls": len(self.results),
+            **self.stats
+        }
+        if self.state == CircuitState.OPEN:
+            snapshot["retry_in"] = round(max(0.0, CIRCUIT_OPEN_SECONDS - (time.monotonic() - self.opened_at)), 1)
+        return snapshot
+
+
+_breakers: Dict[str, CircuitBreaker] = {model: CircuitBreaker(model) for model in (TEXT_MODEL, IMAGE_MODEL)}
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    """获取模型接口的熔断器"""
+    breaker = _breakers.get(name)
+    if breaker is None:
+        breaker = _breakers[name] = CircuitBreaker(name)
+    return breaker
+
+
+def circuit_breaker_stats() -> dict:
+    """各模型接口的熔断状态"""
+    return {name: breaker.snapshot() for name, breaker in _breakers.items()}
@@ -0,0 +1,191 @@
+"""
+自适应并发模块 - 按模型的 AIMD 并发上限
+
+每个模型一个并发上限，所有 Gemini 请求都要先占一个名额：
+- 加性增：名额被用满、最近一段时间的 p95 延迟不超过目标且错误率正常时，每成功一次上限增加 1/上限
+  （约等于每轮满载成功后 +1）
+- 乘性减：遇到超时、429、5xx 或 p95 延迟超过目标时，上限乘以 ADAPTIVE_DECREASE_FACTOR
+  （冷却时间内只减一次，避免同一波失败把上限一下降到底）
+"""
+
+import time
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, Optional
+
+from .config import (
+    ADAPTIVE_CONCURRENCY,
+    ADAPTIVE_WINDOW,
+    ADAPTIVE_MIN_SAMPLES,
+    ADAPTIVE_MAX_ERROR_RATE,
+    ADAPTIVE_DECREASE_FACTOR,
+    ADAPTIVE_DECREASE_COOLDOWN
+)
+
+
+class RequestSample:
+    """一次请求的结果，由调用方在请求结束前标记"""
+
+    def __init__(self, saturated: bool):
+        self.saturated = saturated  # 占用名额时是否已满载
+        self.overloaded = False  # 超时/429/5xx：服务端过载的信号
+        self.failed = False  # 其他失败（计入错误率）
+
+    def mark_overloaded(self):
+        self.overloaded = True
+        self.failed = True
+
+    def mark_failed(self):
+        self.failed = True
+
+
+def _percentile(values: list, percent: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[int(round(percent / 100 * (len(ordered) - 1)))]
+
+
+class AdaptiveLimiter:
+    """单个模型的自适应并发上限"""
+
+    def __init__(self, name: str, initial: float, min_limit: float, max_limit: float, latency_target: float):
+        self.name = name
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self.in_flight = 0
+        self.waiters: Deque[asyncio.Future] = deque()
+        # 最近的请求 (延迟秒数, 是否失败)
+        self.samples: Deque[tuple] = deque(maxlen=ADAPTIVE_WINDOW)
+        self.last_decrease = 0.0
+        self.stats = {"increases": 0, "decreases": 0}
+
+    # ============ 名额 ============
+
+    def _wake(self):
+        """上限允许时唤醒排队的请求（名额直接转交给被唤醒者）"""
+        while self.waiters and self.in_flight < int(self.limit):
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    async def _acquire(self):
+        if self.in_flight < int(self.limit) and not self.waiters:
+            self.in_flight += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # 已分到名额但调用方被取消：归还名额
+                self._release()
+            else:
+                self.waiters.remove(waiter)
+            raise
+
+    def _release(self):
+        self.in_flight -= 1
+        self._wake()
+
+    @asynccontextmanager
+    async def slot(self):
+        """占用一个并发名额，结束时按请求结果调整上限；请求被取消时不计入统计"""
+        await self._acquire()
+        sample = RequestSample(saturated=self.in_flight >= int(self.limit))
+        started = time.monotonic()
+        cancelled = False
+        try:
+            yield sample
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        except Exception:
+            sample.mark_failed()
+            raise
+        finally:
+            self._release()
+            if not cancelled:
+                self._record(time.monotonic() - started, sample)
+
+    # ============ AIMD ============
+
+    def _decrease(self, reason: str):
+        now = time.monotonic()
+        if self.limit <= self.min_limit or now - self.last_decrease < ADAPTIVE_DECREASE_COOLDOWN:
+            return
+        self.last_decrease = now
+        old_limit = self.limit
+        self.limit = max(self.min_limit, self.limit * ADAPTIVE_DECREASE_FACTOR)
+        self.stats["decreases"] += 1
+        print(f"[自适应并发] {self.name} {reason}，并发上限 {old_limit:.1f} -> {self.limit:.1f}")
+
+    def _record(self, latency: float, sample: RequestSample):
+        self.samples.append((latency, sample.failed))
+        if sample.overloaded:
+            self._decrease("接口过载")
+            return
+        if len(self.samples) < ADAPTIVE_MIN_SAMPLES:
+            return
+
+        p95 = self.p95_latency()
+        if p95 is not None and p95 > self.latency_target:
+            self._decrease(f"p95延迟{p95:.1f}秒超过目标{self.latency_target:g}秒")
+        elif not sample.failed and sample.saturated and self.error_rate() <= ADAPTIVE_MAX_ERROR_RATE and self.limit < self.max_limit:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self.stats["increases"] += 1
+            self._wake()
+
+    def latency_percentile(self, percent: float) -> Optional[float]:
+        """最近成功请求延迟的分位数"""
+        return _percentile([latency for latency, failed in self.samples if not failed], percent)
+
+    def p95_latency(self) -> Optional[float]:
+        return self.latency_percentile(95)
+
+    def success_count(self) -> int:
+        return sum(1 for _, failed in self.samples if not failed)
+
+    def error_rate(self) -> float:
+        if not self.samples:
+            return 0.0
+        return sum(1 for _, failed in self.samples if failed) / len(self.samples)
+
+    def snapshot(self) -> dict:
+        p95 = self.p95_latency()
+        return {
+            "limit": round(self.limit, 2),
+            "min_limit": self.min_limit,
+            "max_limit": self.max_limit,
+            "in_flight": self.in_flight,
+            "waiting": len(self.waiters),
+            "p95_latency": round(p95, 2) if p95 is not None else None,
+            "latency_target": self.latency_target,
+            "error_rate": round(self.error_rate(), 3),
+            "samples": len(self.samples),
+            **self.stats
+        }
+
+
+_limiters: Dict[str, AdaptiveLimiter] = {
+    model: AdaptiveLimiter(model, options["initial"], options["min"], options["max"], options["latency_target"])
+    for model, options in ADAPTIVE_CONCURRENCY.items()
+}
+
+
+def get_limiter(model: str) -> AdaptiveLimiter:
+    """获取模型的并发控制器（未配置的模型使用默认参数）"""
+    limiter = _limiters.get(model)
+    if limiter is None:
+        limiter = _limiters[model] = AdaptiveLimiter(model, 4, 1, 16, 120)
+    return limiter
+
+
+def concurrency_stats() -> dict:
+    """各模型当前的并发上限与延迟、错误率"""
+    return {model: limiter.snapshot() for model, limiter in _limiters.items()}
@@ -14,6 +14,8 @@ load_dotenv()
 # Gemini API 配置
 GEMINI_API_BASE = os.environ.get("GEMINI_API_BASE", "https://generativelanguage.googleapis.com/v1beta/models")
 GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY", "")  # 必需：用户进行提供
+TEXT_MODEL = "gemini-3-pro-preview"  # 文本生成/母版分析
+IMAGE_MODEL = "gemini-3-pro-image-preview"  # PPT图片生成
 
 # 科大讯飞ASR配置（可选：用于语音转写功能）
 XFYUN_APPID = os.environ.get("IFLYTEK_APP_ID", "")
@@ -58,6 +60,24 @@ FRONTEND_BUILD_DIR = Path("./frontend/build")
 # 访问计数文件
 VISIT_COUNT_FILE = RECORDS_DIR / "visit_count.txt"
 
+# ============ 会话存储配置 ============
+
+# 会话存储后端：memory（进程内，默认）/ sqlite（本地文件，多个worker共享、重启不丢失）
+# 使用多个 uvicorn worker 时必须设置为 sqlite
+SESSION_BACKEND = os.environ.get("SESSION_BACKEND", "memory")
+SESSION_DB_FILE = RECORDS_DIR / "sessions.db"
+SESSION_UPDATE_RETRIES = 5  # 并发写入冲突时的重试次数
+SESSION_IDLE_TTL = float(os.environ.get("SESSION_IDLE_TTL", str(24 * 3600)))  # 会话空闲多久后被清理（秒）
+SESSION_MAX_COUNT = int(os.environ.get("SESSION_MAX_COUNT", "1000"))  # 最多保留的会话数，超出时清理最久未使用的
+SESSION_EVICT_INTERVAL = 300  # 后台定期清理空闲会话的间隔（秒）
+
+# 消息历史：只保留最近的消息；超长内容（大纲/方案全文）单独存放，消息中只保留摘要和引用
+MESSAGE_HISTORY_LIMIT = int(os.environ.get("MESSAGE_HISTORY_LIMIT", "200"))  # 每个会话最多保留的消息数
+MESSAGE_INLINE_MAX_CHARS = 1000  # 超过该长度的消息内容按引用存放
+MESSAGE_PREVIEW_CHARS = 200  # 按引用存放的消息保留的摘要长度
+MESSAGE_PAYLOAD_LIMIT = 20  # 每个会话最多保留的长内容数，超出时丢弃最早的（消息仍保留摘要）
+MESSAGE_PAGE_SIZE = 50  # 消息分页默认每页条数
+
 # ============ 默认配色方案 ============
 
 COLORS = {
@@ -69,7 +89,122 @@ COLORS = {
     "white": "#FFFFFF",
 }
 
+# ============ HTTP连接池配置 ============
+
+# Gemini 异步客户端（在应用启动时创建，全进程共享一个连接池）
+HTTP_MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", "50"))  # 最大并发连接数
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))  # 保持复用的空闲连接数
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("HTTP_KEEPALIVE_EXPIRY", "60"))  # 空闲连接保留时间（秒）
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", "10"))  # 建立连接超时（秒）
+
+# 各类调用的读取超时（秒）
+TEXT_REQUEST_TIMEOUT = float(os.environ.get("TEXT_REQUEST_TIMEOUT", "120"))
+IMAGE_REQUEST_TIMEOUT = float(os.environ.get("IMAGE_REQUEST_TIMEOUT", "180"))
+TEMPLATE_ANALYSIS_TIMEOUT = float(os.environ.get("TEMPLATE_ANALYSIS_TIMEOUT", "3600"))
+TEMPLATE_ANALYSIS_WAIT_TIMEOUT = float(os.environ.get("TEMPLATE_ANALYSIS_WAIT_TIMEOUT", "30"))  # 生成图片前最多等待母版分析的秒数，超时后不带分析结果生成
+TEMPLATE_ANALYSIS_CACHE_DIR = RECORDS_DIR / "template_analysis"  # 母版分析结果缓存（按图片内容哈希）
+
+# ============ 并发渲染配置 ============
+
+# 一键生成时的页面渲染并发上限
+RENDER_CONCURRENCY_PER_SESSION = int(os.environ.get("RENDER_CONCURRENCY_PER_SESSION", "4"))  # 单个会话同时渲染的页数
+# 全进程同时发出的图片请求数由 ADAPTIVE_CONCURRENCY 中图片模型的上限（IMAGE_MODEL_MAX_CONCURRENCY）控制
+
+# 图片后处理：在独立进程池中输出原尺寸JPEG、预览WebP和缩略图WebP
+POSTPROCESS_WORKERS = int(os.environ.get("POSTPROCESS_WORKERS", str(min(4, os.cpu_count() or 1))))  # 后处理进程数
+PREVIEW_WIDTH = 1280  # 预览图宽度
+PREVIEW_QUALITY = 80
+THUMBNAIL_WIDTH = 320  # 缩略图宽度
+THUMBNAIL_QUALITY = 70
+
+# 渲染结果缓存：生成输入完全相同时复用上次的图片
+RENDER_CACHE_DIR = OUTPUT_DIR / "cache"
+RENDER_CACHE_MAX_BYTES = int(os.environ.get("RENDER_CACHE_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))  # 缓存总大小上限（字节）
+
+# 图片接口按需缩放（/api/image/{filename}?w=480&fmt=webp）的结果缓存
+IMAGE_VARIANT_DIR = OUTPUT_DIR / "variants"
+IMAGE_VARIANT_MAX_BYTES = int(os.environ.get("IMAGE_VARIANT_MAX_BYTES", str(512 * 1024 * 1024)))  # 缓存总大小上限（字节）
+IMAGE_VARIANT_WIDTHS = (160, 320, 480, 640, 960, 1280, 1920)  # 请求的宽度向上取到其中最近的一档，避免缓存被任意宽度撑满
+IMAGE_VARIANT_QUALITY = 80
+IMAGE_CACHE_MAX_AGE = 365 * 24 * 3600  # 带版本号（?v=）的图片地址的浏览器缓存时间（秒）
+# Nginx 反向代理部署时可设置为 OUTPUT_DIR 对应的 internal location（如 /internal-outputs/），
+# 图片接口只返回 X-Accel-Redirect 头，由 Nginx 用 sendfile 直接发送文件（含 Range 请求）
+IMAGE_ACCEL_REDIRECT_PREFIX = os.environ.get("IMAGE_ACCEL_REDIRECT_PREFIX", "")
+
+# 后台生成任务
+JOB_DB_FILE = RECORDS_DIR / "jobs.db"  # 任务队列及每页状态（重启后续跑）
+JOB_HISTORY_LIMIT = int(os.environ.get("JOB_HISTORY_LIMIT", "200"))  # 保留的已结束任务数量
+JOB_HEARTBEAT_INTERVAL = float(os.environ.get("JOB_HEARTBEAT_INTERVAL", "15"))  # 任务租约心跳间隔（秒）
+JOB_LEASE_TIMEOUT = float(os.environ.get("JOB_LEASE_TIMEOUT", "60"))  # 租约超时（秒），超时未续约的任务由其他进程接管
+
+# 流式进度推送的心跳间隔（秒），避免代理/负载均衡因空闲断开长连接
+SSE_HEARTBEAT_INTERVAL = float(os.environ.get("SSE_HEARTBEAT_INTERVAL", "15"))
+
+# 图片base64编码缓存的容量上限（字节）
+IMAGE_CACHE_MAX_BYTES = int(os.environ.get("IMAGE_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+# 文本生成缓存（默认关闭）：相同模型+提示词+思考等级直接复用上次结果
+TEXT_CACHE_ENABLED = os.environ.get("TEXT_CACHE_ENABLED", "").lower() in ("1", "true", "yes")
+TEXT_CACHE_DB_FILE = RECORDS_DIR / "text_cache.db"
+TEXT_CACHE_TTL = float(os.environ.get("TEXT_CACHE_TTL", str(7 * 24 * 3600)))  # 缓存有效期（秒）
+TEXT_CACHE_MAX_BYTES = int(os.environ.get("TEXT_CACHE_MAX_BYTES", str(100 * 1024 * 1024)))  # 缓存总大小上限（字节）
+
+# WebSocket 推送：事件队列长度；轮询会话版本的间隔（秒），用于补齐其他进程写入的变更
+EVENT_QUEUE_SIZE = 100
+WS_POLL_INTERVAL = float(os.environ.get("WS_POLL_INTERVAL", "2"))
+
+# 响应压缩：超过该大小（字节）的响应使用gzip压缩
+GZIP_MINIMUM_SIZE = 1000
+
 # ============ 重试配置 ============
 
-MAX_RETRIES = 3
-RETRY_DELAY = 5  # 秒
+MAX_RETRIES = int(os.environ.get("MAX_RETRIES", "3"))  # 每次调用最多尝试次数
+# 指数退避：第n次失败后在 [0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY*2^(n-1))] 内随机等待
+RETRY_BASE_DELAY = float(os.environ.get("RETRY_BASE_DELAY", "2"))  # 秒
+RETRY_MAX_DELAY = float(os.environ.get("RETRY_MAX_DELAY", "30"))  # 秒
+RETRY_AFTER_MAX = 120  # 服务端 Retry-After 的等待上限（秒）
+# 每次调用的总时长预算（含所有尝试和等待，秒），超出后不再重试
+TEXT_RETRY_DEADLINE = float(os.environ.get("TEXT_RETRY_DEADLINE", "400"))
+IMAGE_RETRY_DEADLINE = float(os.environ.get("IMAGE_RETRY_DEADLINE", "600"))
+ASR_RETRY_DEADLINE = float(os.environ.get("ASR_RETRY_DEADLINE", "120"))
+ASR_REQUEST_TIMEOUT = 60  # 讯飞接口单次请求超时（秒）
+
+# ============ 限流配置 ============
+
+# 按模型的令牌桶：{模型: (每分钟请求数, 突发容量)}，每分钟请求数为0表示不限流
+RATE_LIMITS = {
+    TEXT_MODEL: (float(os.environ.get("TEXT_MODEL_RPM", "60")), float(os.environ.get("TEXT_MODEL_BURST", "10"))),
+    IMAGE_MODEL: (float(os.environ.get("IMAGE_MODEL_RPM", "20")), float(os.environ.get("IMAGE_MODEL_BURST", "5"))),
+}
+# 限流后端：memory（进程内）/ sqlite（同一台机器上的多个worker共享配额）
+RATE_LIMIT_BACKEND = os.environ.get("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_DB_FILE = RECORDS_DIR / "rate_limit.db"
+
+# ============ 自适应并发配置 ============
+
+# 按模型的 AIMD 并发上限：initial 初始值，min/max 上下限，latency_target p95延迟目标（秒）
+ADAPTIVE_CONCURRENCY = {
+    TEXT_MODEL: {"initial": 8, "min": 1, "max": int(os.environ.get("TEXT_MODEL_MAX_CONCURRENCY", "32")), "latency_target": 90},
+    IMAGE_MODEL: {"initial": 6, "min": 1, "max": int(os.environ.get("IMAGE_MODEL_MAX_CONCURRENCY", "16")), "latency_target": 120},
+}
+ADAPTIVE_WINDOW = 50  # 统计最近多少次请求的延迟和错误率
+ADAPTIVE_MIN_SAMPLES = 10  # 样本数达到后才按延迟和错误率调整
+ADAPTIVE_MAX_ERROR_RATE = 0.1  # 错误率超过该值时不再增加上限
+ADAPTIVE_DECREASE_FACTOR = 0.7  # 过载时上限乘以该系数
+ADAPTIVE_DECREASE_COOLDOWN = 5  # 两次降低上限的最小间隔（秒）
+
+# ============ 对冲请求配置 ============
+
+# 图片请求超过最近延迟的分位数仍未返回时，再发一个相同请求，先返回的生效（默认关闭）
+HEDGE_ENABLED = os.environ.get("HEDGE_ENABLED", "").lower() in ("1", "true", "yes")
+HEDGE_PERCENTILE = int(os.environ.get("HEDGE_PERCENTILE", "90"))  # 按最近成功请求延迟的该分位数发起对冲
+HEDGE_MIN_SAMPLES = 10  # 成功样本数达到后才开始对冲
+HEDGE_MIN_DELAY = 15  # 发起对冲前至少等待的秒数
+HEDGE_BUDGET_RATIO = float(os.environ.get("HEDGE_BUDGET_RATIO", "0.1"))  # 每套PPT对冲请求数上限占页数的比例（至少1次）
+
+# ============ 熔断配置 ============
+
+CIRCUIT_FAILURE_RATE = float(os.environ.get("CIRCUIT_FAILURE_RATE", "0.5"))  # 失败率达到该值时熔断
+CIRCUIT_MIN_CALLS = int(os.environ.get("CIRCUIT_MIN_CALLS", "5"))  # 统计窗口内至少多少次调用才判断失败率
+CIRCUIT_WINDOW_SECONDS = 120  # 失败率统计窗口（秒）
+CIRCUIT_OPEN_SECONDS = int(os.environ.get("CIRCUIT_OPEN_SECONDS", "30"))  # 熔断后多久进入半开状态探测恢复
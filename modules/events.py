@@ -0,0 +1,66 @@
+"""
+事件推送模块 - 会话变更的进程内发布/订阅
+
+每次 update_session 写入成功后，把本次写入的增量（与 session_delta 格式一致）
+推送给订阅了该会话的 WebSocket 连接。只在本进程内推送：其他进程写入的变更
+由 WebSocket 端点轮询会话版本号补齐。
+"""
+
+import asyncio
+from typing import Dict
+
+from .config import EVENT_QUEUE_SIZE
+
+
+# {session_id: {queue: 所属事件循环}}
+_subscribers: Dict[str, Dict[asyncio.Queue, asyncio.AbstractEventLoop]] = {}
+
+
+def subscribe(session_id: str) -> asyncio.Queue:
+    """订阅会话事件（需在事件循环中调用），返回接收事件的队列"""
+    queue = asyncio.Queue(maxsize=EVENT_QUEUE_SIZE)
+    _subscribers.setdefault(session_id, {})[queue] = asyncio.get_running_loop()
+    return queue
+
+
+def unsubscribe(session_id: str, queue: asyncio.Queue):
+    """取消订阅"""
+    queues = _subscribers.get(session_id)
+    if queues is None:
+        return
+    queues.pop(queue, None)
+    if not queues:
+        _subscribers.pop(session_id, None)
+
+
+def has_subscribers(session_id: str) -> bool:
+    return bool(_subscribers.get(session_id))
+
+
+def _put(queue: asyncio.Queue, event: dict):
+    # 队列满时丢弃事件：订阅方发现版本号不连续时会重新拉取增量
+    try:
+        queue.put_nowait(event)
+    except asyncio.QueueFull:
+        pass
+
+
+def publish(session_id: str, event: dict):
+    """向会话的所有订阅者推送事件（可在任意线程调用）"""
+    try:
+        current_loop = asyncio.get_running_loop()
+    except RuntimeError:
+        current_loop = None
+    for queue, loop in list(_subscribers.get(session_id, {}).items()):
+        if loop is current_loop:
+            _put(queue, event)
+        elif not loop.is_closed():
+            loop.call_soon_threadsafe(_put, queue, event)
+
+
+def subscriber_stats() -> dict:
+    """订阅统计"""
+    return {
+        "sessions": len(_subscribers),
+        "connections": sum(len(queues) for queues in _subscribers.values())
+    }
@@ -3,26 +3,41 @@ Gemini API模块 - 封装所有Gemini API调用
 """
 
 import os
-import io
 import json
-import base64
 import time
 import asyncio
-import requests
+import httpx
 from pathlib import Path
-from typing import Optional, List
-from PIL import Image
-
-from .config import GEMINI_API_BASE, GEMINI_API_KEY, MAX_RETRIES, RETRY_DELAY
+from typing import Optional, List, Callable
+
+from .config import (
+    GEMINI_API_BASE,
+    GEMINI_API_KEY,
+    TEXT_MODEL,
+    IMAGE_MODEL,
+    TEXT_REQUEST_TIMEOUT,
+    IMAGE_REQUEST_TIMEOUT,
+    TEMPLATE_ANALYSIS_TIMEOUT
+)
+from .http_client import get_http_client, request_timeout
+from .image_cache import get_cached_base64
+from .text_cache import get_cached_text, set_cached_text, discard_cached_text
+from .render_cache import render_cache_key, load_rendered_image, store_rendered_image
+from .rate_limit import acquire_rate_limit
+from .concurrency import get_limiter
+from .circuit_breaker import CircuitOpenError, get_breaker
+from .hedging import HedgeBudget, hedged_post
+from .image_decode import InlineImageDecoder, save_decoded_image
+from .postprocess import run_postprocess, encode_previews
+from .image_index import register_image
+from .retry import RetryCall, TEXT_RETRY_POLICY, IMAGE_RETRY_POLICY, TEMPLATE_ANALYSIS_RETRY_POLICY, is_retryable_status, parse_retry_after
 
 
 # ============ 工具函数 ============
 
 def get_image_base64(image_path: str) -> str:
-    """将图片转换为base64编码"""
-    with open(image_path, "rb") as image_file:
-        encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
-    return encoded_string
+    """将图片转换为base64编码（结果按文件内容缓存）"""
+    return get_cached_base64(image_path)
 
 
 def get_image_mime_type(image_path: str) -> str:
@@ -61,18 +76,95 @@ def parse_json_from_text(text: str) -> Optional[dict]:
     return None
 
 
+def _gemini_headers() -> dict:
+    """Gemini 请求头"""
+    return {
+        "Content-Type": "application/json",
+        "x-goog-api-key": GEMINI_API_KEY,
+    }
+
+
+async def _send(url: str, payload: dict, timeout: httpx.Timeout, decoder: Optional[InlineImageDecoder]) -> httpx.Response:
+    client = get_http_client()
+    if decoder is None:
+        return await client.post(url, json=payload, headers=_gemini_headers(), timeout=timeout)
+
+    request = client.build_request("POST", url, json=payload, headers=_gemini_headers(), timeout=timeout)
+    response = await client.send(request, stream=True)
+    try:
+        if response.status_code == 200:
+            async for chunk in response.aiter_bytes():
+                decoder.feed(chunk)
+        else:
+            await response.aread()
+    finally:
+        await response.aclose()
+    return response
+
+
+async def _post_gemini(model: str, payload: dict, call: RetryCall, read_timeout: float, decoder: Optional[InlineImageDecoder] = None,
+                       sent: Optional[asyncio.Event] = None) -> httpx.Response:
+    """
+    单次调用 Gemini generateContent 接口
+
+    模型接口熔断中时直接抛出 CircuitOpenError；否则先按模型限流排队取令牌，
+    再占用自适应并发名额后发送请求（超时/429/5xx 会降低并发上限）；
+    读取超时不超过本次调用剩余的时长预算
+
+    decoder: 传入时以流式接收响应，成功响应的内容直接交给 decoder 解析（不保留响应原文，
+             返回的 response 不能再读取 content）；失败响应仍完整读取以便查看错误信息
+    sent: 取到令牌和并发名额、请求即将发出时 set（对冲请求从这时开始计时）
+    """
+    breaker = get_breaker(model)
+    breaker.before_call()
+    url = f"{GEMINI_API_BASE}/{model}:generateContent"
+    try:
+        await acquire_rate_limit(model)
+        async with get_limiter(model).slot() as sample:
+            if sent is not None:
+                sent.set()
+            try:
+                response = await _send(url, payload, request_timeout(call.remaining(read_timeout)), decoder)
+            except httpx.TimeoutException:
+                sample.mark_overloaded()
+                raise
+            if response.status_code == 429 or response.status_code >= 500:
+                sample.mark_overloaded()
+            elif response.status_code != 200:
+                sample.mark_failed()
+    except httpx.TransportError:
+        breaker.record(False)
+        raise
+    except BaseException:
+        breaker.record(None)
+        raise
+
+    if response.status_code >= 500:
+        breaker.record(False)
+    else:
+        breaker.record(True if response.status_code == 200 else None)
+    return response
+
+
 # ============ 文本生成 ============
 
-def _generate_text_sync(prompt: str, thinking_level: str = "high") -> tuple[str, str]:
+async def generate_text(prompt: str, thinking_level: str = "high", use_cache: bool = True) -> tuple[str, str]:
     """
-    同步版本的文本生成（内部函数，会在线程池中执行）
-    
-    返回: (生成的文本, 重试信息提示)
+    异步文本生成（复用共享连接池，不占用线程池）
+
+    use_cache: 是否使用文本生成缓存（需开启 TEXT_CACHE_ENABLED）；为False时跳过缓存读取，新结果仍会写入缓存
+    返回: (生成的文本, 重试信息提示)；命中缓存时提示信息中会注明
     """
-    url = f"{GEMINI_API_BASE}/gemini-3-pro-preview:generateContent"
+    if use_cache:
+        cached = await asyncio.to_thread(get_cached_text, TEXT_MODEL, prompt, thinking_level)
+        if cached:
+            text, created_at = cached
+            minutes = int((time.time() - created_at) // 60)
+            print(f"[文本生成] 命中缓存（{minutes}分钟前生成）")
+            return text, f"♻️ 输入与之前相同，已复用{minutes}分钟前的生成结果；如需重新生成，请选择重新生成"
 
     payload = {
-        "model": "gemini-3-pro-preview",
+        "model": TEXT_MODEL,
         "contents": [
             {
                 "parts": [
@@ -87,19 +179,17 @@ def _generate_text_sync(prompt: str, thinking_level: str = "high") -> tuple[str,
         }
     }
 
-    headers = {
-        "Content-Type": "application/json",
-        "x-goog-api-key": GEMINI_API_KEY,
-    }
-
     retry_info = ""
     last_error = None
+    call = TEXT_RETRY_POLICY.begin()
 
-    for attempt in range(1, MAX_RETRIES + 1):
+    for attempt in call.attempts():
+        retryable, retry_after = True, None
         try:
             print(f"[文本生成] 第{attempt}次尝试...")
-            response = requests.post(url, json=payload, headers=headers, timeout=120)
+            response = await _post_gemini(TEXT_MODEL, payload, call, TEXT_REQUEST_TIMEOUT)
             print(f"文本生成 Status Code: {response.status_code}")
+            call.record_status(response.status_code)
 
             if response.status_code == 200:
                 result = response.json()
@@ -111,53 +201,60 @@ def _generate_text_sync(prompt: str, thinking_level: str = "high") -> tuple[str,
                             if "text" in part:
                                 if attempt > 1:
                                     retry_info = f"⚠️ 接口不稳定，已在第{attempt}次重试后成功"
+                                call.succeed()
+                                await asyncio.to_thread(set_cached_text, TEXT_MODEL, prompt, thinking_level, part["text"])
                                 return part["text"], retry_info
                 print(f"响应格式异常: {result}")
                 last_error = "响应格式异常"
             else:
                 print(f"文本生成失败: {response.text}")
                 last_error = f"API返回错误: {response.status_code}"
+                retryable = is_retryable_status(response.status_code)
+                retry_after = parse_retry_after(response.headers.get("retry-after"))
 
-        except requests.exceptions.Timeout:
+        except CircuitOpenError as e:
+            # 熔断中不再重试，直接返回
+            last_error = str(e)
+            retryable = False
+            print(f"[文本生成] {e}")
+        except httpx.TimeoutException:
             last_error = "请求超时"
             print(f"[文本生成] 第{attempt}次尝试超时")
-        except requests.exceptions.ConnectionError:
+        except httpx.TransportError:
             last_error = "网络连接错误"
             print(f"[文本生成] 第{attempt}次尝试连接错误")
         except Exception as e:
             last_error = str(e)
             print(f"[文本生成] 第{attempt}次尝试错误: {e}")
 
-        # 如果不是最后一次尝试，等待后重试
-        if attempt < MAX_RETRIES:
-            print(f"[文本生成] 等待{RETRY_DELAY}秒后重试...")
-            time.sleep(RETRY_DELAY)
+        # 可重试且未超出次数和时长预算时，退避后重试
+        delay = call.retry_delay(retryable, retry_after)
+        if delay is None:
+            break
+        print(f"[文本生成] 等待{delay:.1f}秒后重试...")
+        await asyncio.sleep(delay)
 
     # 所有重试都失败
-    retry_info = f"❌ 接口调用失败（已重试{MAX_RETRIES}次）: {last_error}"
+    call.fail()
+    retry_info = f"❌ 接口调用失败（共尝试{call.attempt}次）: {last_error}"
     return "", retry_info
 
 
-async def generate_text(prompt: str, thinking_level: str = "high") -> tuple[str, str]:
-    """
-    异步版本的文本生成（使用线程池避免阻塞事件循环）
-    
-    返回: (生成的文本, 重试信息提示)
-    """
-    # 在线程池中执行同步的HTTP请求，避免阻塞事件循环
-    return await asyncio.to_thread(_generate_text_sync, prompt, thinking_level)
+async def discard_generated_text(prompt: str, thinking_level: str = "high"):
+    """丢弃某个提示词的缓存结果（生成的文本无法解析时调用，避免下次继续命中）"""
+    await asyncio.to_thread(discard_cached_text, TEXT_MODEL, prompt, thinking_level)
 
 
 # ============ 图片生成 ============
 
-def _generate_ppt_image_sync(prompt: str, output_path: Path, reference_image_path: Optional[str] = None, custom_logo_path: Optional[str] = None, reference_type: str = "reference", template_analysis: Optional[dict] = None, page_materials: Optional[List[dict]] = None) -> tuple[bool, str]:
+def _build_image_parts(prompt: str, reference_image_path: Optional[str] = None, custom_logo_path: Optional[str] = None, reference_type: str = "reference", template_analysis: Optional[dict] = None, page_materials: Optional[List[dict]] = None) -> list:
     """
-    同步版本的PPT图片生成（内部函数，会在线程池中执行）
+    构建图片生成请求的parts（prompt文本 + logo/参考图/素材附件）
+    
+    涉及读取文件和base64编码，会在线程池中执行；每次生成只构建一次，重试时复用。
     
     参数:
         page_materials: 页面素材列表 [{type, path, filename, description}, ...]
-    
-    返回: (是否成功, 重试信息提示)
     """
     # Logo图片路径 - 只有用户上传了自定义logo才处理
     LOGO_PATH = None
@@ -166,46 +263,37 @@ def _generate_ppt_image_sync(prompt: str, output_path: Path, reference_image_pat
         print(f"使用自定义Logo: {LOGO_PATH}")
     else:
         print("未上传Logo，跳过Logo处理")
-    
-    url = f"{GEMINI_API_BASE}/gemini-3-pro-image-preview:generateContent"
 
-    retry_info = ""
-    last_error = None
+    # 检查有哪些图片
+    has_logo = LOGO_PATH is not None and LOGO_PATH.exists()
+    has_reference = reference_image_path and os.path.exists(reference_image_path)
 
-    for attempt in range(1, MAX_RETRIES + 1):
-        try:
-            print(f"[图片生成] 第{attempt}次尝试...")
+    # 构建完整的prompt，包含所有图片说明
+    full_prompt = prompt
 
-            # 检查有哪些图片
-            has_logo = LOGO_PATH is not None and LOGO_PATH.exists()
-            has_reference = reference_image_path and os.path.exists(reference_image_path)
-
-            # 构建完整的prompt，包含所有图片说明
-            full_prompt = prompt
-
-            if has_logo:
-                full_prompt += """
+    if has_logo:
+        full_prompt += """
 
 【请注意】附件的图片中包含用户上传的公司logo，请将该logo放在生成的图片的右上角，保持logo的清晰和完整。"""
 
-            if has_reference:
-                if reference_type == "template":
-                    # 母版模式：严格遵循
-                    full_prompt += """
+    if has_reference:
+        if reference_type == "template":
+            # 母版模式：严格遵循
+            full_prompt += """
 
 【最高优先级 - PPT母版设计规范】
 附件中包含用户上传的PPT母版图片，这是必须严格遵循的设计模板。
 生成的PPT页面必须完全按照母版的视觉风格，忽略其他任何配色或字体设置。"""
-                    
-                    # 如果有分析结果，添加具体参数
-                    if template_analysis:
-                        colors = template_analysis.get("colors", {})
-                        fonts = template_analysis.get("fonts", {})
-                        layout = template_analysis.get("layout", {})
-                        background = template_analysis.get("background", {})
-                        style_summary = template_analysis.get("style_summary", "")
-                        
-                        full_prompt += f"""
+
+            # 如果有分析结果，添加具体参数
+            if template_analysis:
+                colors = template_analysis.get("colors", {})
+                fonts = template_analysis.get("fonts", {})
+                layout = template_analysis.get("layout", {})
+                background = template_analysis.get("background", {})
+                style_summary = template_analysis.get("style_summary", "")
+
+                full_prompt += f"""
 
 【母版分析结果 - 必须严格执行】
 
@@ -237,8 +325,8 @@ def _generate_ppt_image_sync(prompt: str, output_path: Path, reference_image_pat
 请严格按照以上规范生成，确保生成的图片看起来像是同一套PPT模板的不同页面。
 
 【特别强调】如果母版中存在背景图片、背景图案或装饰性元素，请务必在生成时保留并复刻这些背景设计，确保每一页都有与母版一致的背景效果。"""
-                    else:
-                        full_prompt += """
+            else:
+                full_prompt += """
 
 请仔细观察母版图片中的：
 1. 精确的配色方案（背景色、标题色、正文色、强调色的具体色值）
@@ -250,9 +338,9 @@ def _generate_ppt_image_sync(prompt: str, output_path: Path, reference_image_pat
 生成的图片必须在视觉上与母版保持高度一致，像是同一套模板的不同页面。
 
 【特别强调】如果母版中存在背景图片、背景图案或装饰性元素，请务必在生成时保留并复刻这些背景设计，确保每一页都有与母版一致的背景效果。"""
-                elif reference_type == "refine":
-                    # 微调模式：基于当前已生成的图片进行微调
-                    full_prompt += """
+        elif reference_type == "refine":
+            # 微调模式：基于当前已生成的图片进行微调
+            full_prompt += """
 
 【微调模式 - 最高优先级】
 附件中包含当前已生成的PPT页面图片，这是微调的基准。
@@ -266,88 +354,88 @@ def _generate_ppt_image_sync(prompt: str, output_path: Path, reference_image_pat
 5. 用户没有明确要求修改的部分，必须保持原样
 
 请基于参考图片，仅做用户要求的微调，确保生成的图片与原图在视觉上保持高度一致性。"""
-                else:
-                    # 普通参考模式
-                    full_prompt += """
+        else:
+            # 普通参考模式
+            full_prompt += """
 
 【同时】附件中包含一张参考图，该参考图是用户上传的，生成结果图的时候，请尽量参考这个参考图的配色、字体和风格等。"""
 
-            # 构建parts列表
-            parts = [{"text": full_prompt}]
-
-            # 添加logo图片（仅当用户上传了自定义logo时）
-            if has_logo:
-                logo_base64 = get_image_base64(str(LOGO_PATH))
-                logo_mime = get_image_mime_type(str(LOGO_PATH))
-                parts.append({
-                    "inline_data": {
-                        "mime_type": logo_mime,
-                        "data": logo_base64
-                    }
-                })
-                print(f"已加载logo图片: {LOGO_PATH}")
-
-            # 添加额外的参考图
-            if has_reference:
-                ref_base64 = get_image_base64(reference_image_path)
-                ref_mime = get_image_mime_type(reference_image_path)
-                parts.append({
-                    "inline_data": {
-                        "mime_type": ref_mime,
-                        "data": ref_base64
-                    }
-                })
-                print(f"已加载参考图: {reference_image_path}, 类型: {reference_type}")
-
-            # 新增：添加页面素材
-            if page_materials:
-                images_added = 0
-                image_descriptions = []
-                table_texts = []
-                
-                for i, material in enumerate(page_materials):
-                    material_type = material.get("type", "image")
-                    material_desc = material.get("description", "")
-                    
-                    if material_type == "image":
-                        # 图片素材：添加到inline_data
-                        material_path = material.get("path")
-                        if material_path and os.path.exists(material_path):
-                            try:
-                                material_base64 = get_image_base64(material_path)
-                                material_mime = get_image_mime_type(material_path)
-                                parts.append({
-                                    "inline_data": {
-                                        "mime_type": material_mime,
-                                        "data": material_base64
-                                    }
-                                })
-                                images_added += 1
-                                # 收集图片描述
-                                if material_desc:
-                                    image_descriptions.append(f"图片{images_added}: {material_desc}")
-                                print(f"已加载图片素材 {i+1}: {material.get('filename')} - {material_desc or '无描述'}")
-                            except Exception as e:
-                                print(f"加载图片素材失败 {material.get('filename')}: {e}")
-                    
-                    elif material_type in ["table", "table_text"]:
-                        # 表格素材：添加到prompt文本
-                        table_text = material.get("table_text", "")
-                        if table_text:
-                            table_header = f"【表格: {material.get('filename')}】"
-                            if material_desc:
-                                table_header += f"\n说明: {material_desc}"
-                            table_texts.append(f"{table_header}\n{table_text}")
-                            print(f"已加载表格素材 {i+1}: {material.get('filename')} - {material_desc or '无描述'}")
-                
-                # 构建素材说明
-                material_prompts = []
-                
-                if images_added > 0:
-                    image_desc_text = ""
-                    if image_descriptions:
-                        image_desc_text = "\n用户对图片的说明：\n" + "\n".join(image_descriptions)
-                    material_prompts.append(f"""
+    # 构建parts列表
+    parts = [{"text": full_prompt}]
+
+    # 添加logo图片（仅当用户上传了自定义logo时）
+    if has_logo:
+        logo_base64 = get_image_base64(str(LOGO_PATH))
+        logo_mime = get_image_mime_type(str(LOGO_PATH))
+        parts.append({
+            "inline_data": {
+                "mime_type": logo_mime,
+                "data": logo_base64
+            }
+        })
+        print(f"已加载logo图片: {LOGO_PATH}")
+
+    # 添加额外的参考图
+    if has_reference:
+        ref_base64 = get_image_base64(reference_image_path)
+        ref_mime = get_image_mime_type(reference_image_path)
+        parts.append({
+            "inline_data": {
+                "mime_type": ref_mime,
+                "data": ref_base64
+            }
+        })
+        print(f"已加载参考图: {reference_image_path}, 类型: {reference_type}")
+
+    # 新增：添加页面素材
+    if page_materials:
+        images_added = 0
+        image_descriptions = []
+        table_texts = []
+
+        for i, material in enumerate(page_materials):
+            material_type = material.get("type", "image")
+            material_desc = material.get("description", "")
+
+            if material_type == "image":
+                # 图片素材：添加到inline_data
+                material_path = material.get("path")
+                if material_path and os.path.exists(material_path):
+                    try:
+                        material_base64 = get_image_base64(material_path)
+                        material_mime = get_image_mime_type(material_path)
+                        parts.append({
+                            "inline_data": {
+                                "mime_type": material_mime,
+                                "data": material_base64
+                            }
+                        })
+                        images_added += 1
+                        # 收集图片描述
+                        if material_desc:
+                            image_descriptions.append(f"图片{images_added}: {material_desc}")
+                        print(f"已加载图片素材 {i+1}: {material.get('filename')} - {material_desc or '无描述'}")
+                    except Exception as e:
+                        print(f"加载图片素材失败 {material.get('filename')}: {e}")
+
+            elif material_type in ["table", "table_text"]:
+                # 表格素材：添加到prompt文本
+                table_text = material.get("table_text", "")
+                if table_text:
+                    table_header = f"【表格: {material.get('filename')}】"
+                    if material_desc:
+                        table_header += f"\n说明: {material_desc}"
+                    table_texts.append(f"{table_header}\n{table_text}")
+                    print(f"已加载表格素材 {i+1}: {material.get('filename')} - {material_desc or '无描述'}")
+
+        # 构建素材说明
+        material_prompts = []
+
+        if images_added > 0:
+            image_desc_text = ""
+            if image_descriptions:
+                image_desc_text = "\n用户对图片的说明：\n" + "\n".join(image_descriptions)
+            material_prompts.append(f"""
 【用户上传的图片素材 - 最高优先级】
 附件中包含用户上传的 {images_added} 个图片素材（可能是图表、截图等）。{image_desc_text}
 请务必：
@@ -356,14 +444,14 @@ def _generate_ppt_image_sync(prompt: str, output_path: Path, reference_image_pat
 3. 不要对图片素材进行总结、重新绘制或简化
 4. 图片素材应该作为该页面的核心内容元素，合理安排布局
 5. 根据用户的说明来理解图片的用途和含义""")
-                
-                if table_texts:
-                    # 合并表格文本，限制总长度
-                    combined_table_text = chr(10).join(table_texts)
-                    if len(combined_table_text) > 3000:
-                        combined_table_text = combined_table_text[:3000] + "\n...(表格数据过长，已截取前3000字)"
-                    
-                    material_prompts.append(f"""
+
+        if table_texts:
+            # 合并表格文本，限制总长度
+            combined_table_text = chr(10).join(table_texts)
+            if len(combined_table_text) > 3000:
+                combined_table_text = combined_table_text[:3000] + "\n...(表格数据过长，已截取前3000字)"
+
+            material_prompts.append(f"""
 【用户上传的表格数据 - 最高优先级】
 以下是用户指定要在此页显示的表格数据，请务必：
 1. 将表格数据完整、准确地呈现在PPT页面中
@@ -372,95 +460,130 @@ def _generate_ppt_image_sync(prompt: str, output_path: Path, reference_image_pat
 4. 根据表格内容和用户说明选择合适的可视化方式（表格、柱状图、饼图、折线图等）
 
 {combined_table_text}""")
-                
-                if material_prompts:
-                    full_prompt += "\n".join(material_prompts)
-                    # 更新parts中的prompt
-                    parts[0] = {"text": full_prompt}
-
-            print(f"最终prompt长度: {len(full_prompt)}, 附件数量: {len(parts) - 1}, 母版模式: {reference_type == 'template'}")
-
-            # 构建请求payload
-            payload = {
-                "model": "gemini-3-pro-image-preview",
-                "contents": [
-                    {
-                        "parts": parts
-                    }
-                ],
-                "generationConfig": {
-                    "responseModalities": ["TEXT", "IMAGE"],
-                    "imageConfig": {
-                        "aspectRatio": "16:9",
-                        "imageSize": "4K"
-                    }
-                }
-            }
 
-            headers = {
-                "Content-Type": "application/json",
-                "x-goog-api-key": GEMINI_API_KEY
+        if material_prompts:
+            full_prompt += "\n".join(material_prompts)
+            # 更新parts中的prompt
+            parts[0] = {"text": full_prompt}
+
+    print(f"最终prompt长度: {len(full_prompt)}, 附件数量: {len(parts) - 1}, 母版模式: {reference_type == 'template'}")
+    return parts
+
+
+async def generate_ppt_image(prompt: str, output_path: Path, reference_image_path: Optional[str] = None, custom_logo_path: Optional[str] = None, reference_type: str = "reference", template_analysis: Optional[dict] = None, page_materials: Optional[List[dict]] = None, on_progress: Optional[Callable[[dict], None]] = None, force_regenerate: bool = False, hedge_budget: Optional[HedgeBudget] = None) -> tuple[bool, str]:
+    """
+    异步PPT图片生成（网络请求走共享连接池，文件读写和图片压缩放到线程池）
+    
+    参数:
+        page_materials: 页面素材列表 [{type, path, filename, description}, ...]
+        on_progress: 进度回调，每次失败后准备重试时调用 {"type": "retry", "attempt", "error", "retry_info"}
+        force_regenerate: 跳过渲染结果缓存，强制调用图片模型（生成结果仍会写入缓存）
+        hedge_budget: 所属整套PPT的对冲请求限额；为None时不发对冲请求
+    
+    返回: (是否成功, 重试信息提示)
+    """
+    retry_info = ""
+    last_error = None
+
+    try:
+        parts = await asyncio.to_thread(
+            _build_image_parts,
+            prompt,
+            reference_image_path,
+            custom_logo_path,
+            reference_type,
+            template_analysis,
+            page_materials
+        )
+    except Exception as e:
+        print(f"[图片生成] 构建请求失败: {e}")
+        return False, f"❌ 图片生成失败: {e}"
+
+    # 构建请求payload
+    payload = {
+        "model": IMAGE_MODEL,
+        "contents": [
+            {
+                "parts": parts
             }
+        ],
+        "generationConfig": {
+            "responseModalities": ["TEXT", "IMAGE"],
+            "imageConfig": {
+                "aspectRatio": "16:9",
+                "imageSize": "4K"
+            }
+        }
+    }
+
+    # 请求体包含了所有生成输入（提示词、附件图片、图片参数），相同输入复用上次的图片（附件不在编码缓存中时需要解码计算哈希，放到线程中）
+    cache_key = await asyncio.to_thread(render_cache_key, payload)
+    if not force_regenerate and await asyncio.to_thread(load_rendered_image, cache_key, output_path):
+        print(f"[图片生成] 命中渲染缓存: {output_path}")
+        try:
+            await run_postprocess(encode_previews, str(output_path))
+        except Exception as e:
+            print(f"[图片生成] 生成预览图失败: {e}")
+        register_image(output_path)
+        return True, retry_info
+
+    call = IMAGE_RETRY_POLICY.begin()
+
+    async def send(sent: Optional[asyncio.Event]) -> tuple[httpx.Response, InlineImageDecoder]:
+        """发送一次图片请求，响应以流式解码（每个请求各用一个解码器，对冲请求之间互不影响）"""
+        decoder = InlineImageDecoder()
+        try:
+            response = await _post_gemini(IMAGE_MODEL, payload, call, IMAGE_REQUEST_TIMEOUT, decoder, sent)
+        except BaseException:
+            decoder.close()
+            raise
+        if response.status_code != 200 or not decoder.finished:
+            decoder.close()
+        return response, decoder
+
+    for attempt in call.attempts():
+        retryable, retry_after = True, None
+        try:
+            print(f"[图片生成] 第{attempt}次尝试...")
 
             # 发送请求
-            response = requests.post(url, json=payload, headers=headers, timeout=180)
+            response, decoder = await hedged_post(
+                IMAGE_MODEL, send, hedge_budget,
+                is_success=lambda result: result[0].status_code == 200 and result[1].finished,
+                discard=lambda result: result[1].close()
+            )
             print(f"图片生成 Status Code: {response.status_code}")
+            call.record_status(response.status_code)
 
             if response.status_code == 200:
-                result = response.json()
-
-                # 解析响应，提取图片
-                if "candidates" in result and len(result["candidates"]) > 0:
-                    candidate = result["candidates"][0]
-                    if "content" in candidate and "parts" in candidate["content"]:
-                        for part in candidate["content"]["parts"]:
-                            # 处理图片响应
-                            if "inlineData" in part:
-                                image_data = part["inlineData"]["data"]
-                                # 解码base64并保存图片
-                                image_bytes = base64.b64decode(image_data)
-                                
-                                # 压缩图片以加快前端加载速度
-                                try:
-                                    img = Image.open(io.BytesIO(image_bytes))
-                                    # 转换为RGB（如果是RGBA）
-                                    if img.mode == 'RGBA':
-                                        # 创建白色背景
-                                        background = Image.new('RGB', img.size, (255, 255, 255))
-                                        background.paste(img, mask=img.split()[3])
-                                        img = background
-                                    elif img.mode != 'RGB':
-                                        img = img.convert('RGB')
-                                    
-                                    # 保存为JPEG格式，质量85%，文件大小约500KB-1MB
-                                    output_path_jpg = str(output_path).replace('.png', '.jpg')
-                                    img.save(output_path_jpg, 'JPEG', quality=85, optimize=True)
-                                    print(f"图片已压缩保存: {output_path_jpg} (原始PNG -> JPEG)")
-                                    
-                                    # 更新输出路径为jpg
-                                    if attempt > 1:
-                                        retry_info = f"⚠️ 接口不稳定，已在第{attempt}次重试后成功"
-                                    return True, retry_info
-                                except Exception as compress_err:
-                                    print(f"图片压缩失败，使用原始格式: {compress_err}")
-                                    # 压缩失败则保存原始PNG
-                                    with open(output_path, "wb") as f:
-                                        f.write(image_bytes)
-                                    print(f"图片已保存: {output_path}")
-                                    if attempt > 1:
-                                        retry_info = f"⚠️ 接口不稳定，已在第{attempt}次重试后成功"
-                                    return True, retry_info
+                try:
+                    saved = await save_decoded_image(decoder, output_path)
+                finally:
+                    decoder.close()
+                if saved:
+                    await asyncio.to_thread(store_rendered_image, cache_key, output_path)
+                    if attempt > 1:
+                        retry_info = f"⚠️ 接口不稳定，已在第{attempt}次重试后成功"
+                    call.succeed()
+                    return True, retry_info
 
                 print(f"响应中未找到图片")
                 last_error = "响应中未找到图片"
             else:
                 print(f"图片生成失败: {response.status_code}")
                 last_error = f"API返回错误: {response.status_code}"
+                retryable = is_retryable_status(response.status_code)
+                retry_after = parse_retry_after(response.headers.get("retry-after"))
 
-        except requests.exceptions.Timeout:
+        except CircuitOpenError as e:
+            # 熔断中不再重试，直接返回
+            last_error = str(e)
+            retryable = False
+            print(f"[图片生成] {e}")
+        except httpx.TimeoutException:
             last_error = "请求超时"
             print(f"[图片生成] 第{attempt}次尝试超时")
-        except requests.exceptions.ConnectionError:
+        except httpx.TransportError:
             last_error = "网络连接错误"
             print(f"[图片生成] 第{attempt}次尝试连接错误")
         except Exception as e:
@@ -469,41 +592,27 @@ def _generate_ppt_image_sync(prompt: str, output_path: Path, reference_image_pat
             import traceback
             traceback.print_exc()
 
-        # 如果不是最后一次尝试，等待后重试
-        if attempt < MAX_RETRIES:
-            print(f"[图片生成] 等待{RETRY_DELAY}秒后重试...")
-            time.sleep(RETRY_DELAY)
+        # 可重试且未超出次数和时长预算时，退避后重试
+        delay = call.retry_delay(retryable, retry_after)
+        if delay is None:
+            break
+        print(f"[图片生成] 等待{delay:.1f}秒后重试...")
+        if on_progress:
+            on_progress({
+                "type": "retry", "attempt": attempt, "error": last_error, "delay": round(delay, 1),
+                "retry_info": f"⚠️ 第{attempt}次尝试失败（{last_error}），{delay:.0f}秒后重试"
+            })
+        await asyncio.sleep(delay)
 
     # 所有重试都失败
-    retry_info = f"❌ 图片生成失败（已重试{MAX_RETRIES}次）: {last_error}"
+    call.fail()
+    retry_info = f"❌ 图片生成失败（共尝试{call.attempt}次）: {last_error}"
     return False, retry_info
 
 
-async def generate_ppt_image(prompt: str, output_path: Path, reference_image_path: Optional[str] = None, custom_logo_path: Optional[str] = None, reference_type: str = "reference", template_analysis: Optional[dict] = None, page_materials: Optional[List[dict]] = None) -> tuple[bool, str]:
-    """
-    异步版本的PPT图片生成（使用线程池避免阻塞事件循环）
-    
-    参数:
-        page_materials: 页面素材列表 [{type, path, filename, description}, ...]
-    
-    返回: (是否成功, 重试信息提示)
-    """
-    # 在线程池中执行同步的HTTP请求，避免阻塞事件循环
-    return await asyncio.to_thread(
-        _generate_ppt_image_sync, 
-        prompt, 
-        output_path, 
-        reference_image_path, 
-        custom_logo_path, 
-        reference_type, 
-        template_analysis,
-        page_materials
-    )
-
-
 # ============ 母版分析 ============
 
-def analyze_template_design(image_path: str) -> dict:
+async def analyze_template_design(image_path: str) -> dict:
     """
     使用 AI 分析母版图片，提取设计规范
     返回：包含配色、字体、布局等参数的字典
@@ -512,7 +621,7 @@ def analyze_template_design(image_path: str) -> dict:
     
     try:
         # 获取图片数据
-        image_base64 = get_image_base64(image_path)
+        image_base64 = await asyncio.to_thread(get_image_base64, image_path)
         image_mime = get_image_mime_type(image_path)
         
         # 优化后的 Prompt：去掉了 JSON 内部的干扰描述，改为外部说明
@@ -555,11 +664,9 @@ def analyze_template_design(image_path: str) -> dict:
 1. 颜色必须是有效的 6 位十六进制 (#RRGGBB)。
 2. 必须使用中文回答。
 3. 严格遵循 JSON 格式。"""
-
-        url = f"{GEMINI_API_BASE}/gemini-3-pro-preview:generateContent"
         
         payload = {
-            "model": "gemini-3-pro-preview",
+            "model": TEXT_MODEL,
             "contents": [{
                 "parts": [
                     {"text": analysis_prompt},
@@ -577,14 +684,34 @@ def analyze_template_design(image_path: str) -> dict:
             }
         }
         
-        headers = {
-            "Content-Type": "application/json",
-            "x-goog-api-key": GEMINI_API_KEY
-        }
-        
-        response = requests.post(url, json=payload, headers=headers, timeout=3600)
-        
-        if response.status_code == 200:
+        call = TEMPLATE_ANALYSIS_RETRY_POLICY.begin()
+        response = None
+        for attempt in call.attempts():
+            retryable, retry_after = True, None
+            try:
+                response = await _post_gemini(TEXT_MODEL, payload, call, TEMPLATE_ANALYSIS_TIMEOUT)
+                call.record_status(response.status_code)
+                if response.status_code == 200:
+                    break
+                print(f"[母版分析] API 调用失败: {response.status_code}, {response.text}")
+                retryable = is_retryable_status(response.status_code)
+                retry_after = parse_retry_after(response.headers.get("retry-after"))
+            except CircuitOpenError as e:
+                response = None
+                retryable = False
+                print(f"[母版分析] {e}")
+            except (httpx.TimeoutException, httpx.TransportError) as e:
+                response = None
+                print(f"[母版分析] 第{attempt}次请求失败: {e!r}")
+
+            delay = call.retry_delay(retryable, retry_after)
+            if delay is None:
+                break
+            print(f"[母版分析] 等待{delay:.1f}秒后重试...")
+            await asyncio.sleep(delay)
+
+        if response is not None and response.status_code == 200:
+            call.succeed()
             result = response.json()
             # 提取文本内容 - 注意：parts[1]才是实际响应，parts[0]可能是thinking
             raw_text = result.get("candidates", [{}])[0].get("content", {}).get("parts", [{}])[1].get("text", "")
@@ -609,7 +736,7 @@ def analyze_template_design(image_path: str) -> dict:
             return analysis
         
         else:
-            print(f"[母版分析] API 调用失败: {response.status_code}, {response.text}")
+            call.fail()
             return None
             
     except Exception as e:
@@ -0,0 +1,132 @@
+"""
+对冲请求模块 - 图片生成长尾请求的对冲
+
+图片接口的延迟长尾明显：大部分页面30秒左右返回，个别要等到超时。开启 HEDGE_ENABLED 后，
+某次请求超过最近延迟的 HEDGE_PERCENTILE 分位仍未返回时，再发一个相同的请求，
+先成功返回的结果生效，另一个立即取消。计时从请求实际发出（取到限流令牌和并发名额）后开始，
+排队等待期间不会对冲。
+
+额外请求的数量按整套PPT限额（HedgeBudget）：每套最多 ceil(页数 × HEDGE_BUDGET_RATIO) 次，至少1次。
+"""
+
+import math
+import asyncio
+import threading
+from typing import Awaitable, Callable, Optional, TypeVar
+
+import httpx
+
+from .config import HEDGE_ENABLED, HEDGE_PERCENTILE, HEDGE_MIN_SAMPLES, HEDGE_MIN_DELAY, HEDGE_BUDGET_RATIO
+from .concurrency import get_limiter
+
+
+T = TypeVar("T")
+
+_lock = threading.Lock()
+_stats = {"hedged": 0, "hedge_wins": 0, "budget_exhausted": 0}
+
+
+def _count(key: str):
+    with _lock:
+        _stats[key] += 1
+
+
+class HedgeBudget:
+    """一套PPT的对冲请求限额"""
+
+    def __init__(self, pages: int):
+        self.limit = max(1, math.ceil(pages * HEDGE_BUDGET_RATIO))
+        self.used = 0
+
+    def take(self) -> bool:
+        if self.used >= self.limit:
+            return False
+        self.used += 1
+        return True
+
+
+def hedge_delay(model: str) -> Optional[float]:
+    """发起对冲请求前等待的秒数（最近成功请求延迟的 HEDGE_PERCENTILE 分位）；未开启或样本不足时返回None"""
+    if not HEDGE_ENABLED:
+        return None
+    limiter = get_limiter(model)
+    if limiter.success_count() < HEDGE_MIN_SAMPLES:
+        return None
+    return max(HEDGE_MIN_DELAY, limiter.latency_percentile(HEDGE_PERCENTILE))
+
+
+def _is_ok(response: httpx.Response) -> bool:
+    return response.status_code == 200
+
+
+async def hedged_post(model: str, send: Callable[[Optional[asyncio.Event]], Awaitable[T]], budget: Optional[HedgeBudget],
+                      is_success: Callable[[T], bool] = _is_ok, discard: Optional[Callable[[T], None]] = None) -> T:
+    """
+    发送请求，发出后超过对冲延迟仍未返回且限额未用完时再发一个相同请求，返回先成功的结果
+
+    send: 发送一次请求；参数为请求实际发出时需要 set 的事件（可能为None）
+    is_success: 判断结果是否成功（默认 HTTP 200）
+    discard: 释放未被采用的结果（例如两个请求同时成功时落选的那个）
+    两个请求都失败时返回后完成的那个的结果（或抛出其异常），由调用方按普通失败处理重试
+    """
+    delay = hedge_delay(model) if budget is not None else None
+    if delay is None:
+        return await send(None)
+
+    sent = asyncio.Event()
+    primary = asyncio.ensure_future(send(sent))
+    pending = {primary}
+    try:
+        # 主请求还在等限流令牌或并发名额时不计时
+        sent_waiter = asyncio.ensure_future(sent.wait())
+        try:
+            await asyncio.wait({primary, sent_waiter}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            sent_waiter.cancel()
+        if primary.done():
+            return primary.result()
+
+        done, _ = await asyncio.wait(pending, timeout=delay)
+        if done:
+            return primary.result()
+        if not budget.take():
+            _count("budget_exhausted")
+            return await primary
+
+        print(f"[对冲请求] {model} 请求超过{delay:.0f}秒未返回，发起对冲请求（本套已用 {budget.used}/{budget.limit}）")
+        _count("hedged")
+        hedge = asyncio.ensure_future(send(None))
+        pending.add(hedge)
+        finished = []
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            finished.extend(done)
+            if any(task.exception() is None and is_success(task.result()) for task in done):
+                break
+
+        winner = next((task for task in finished if task.exception() is None and is_success(task.result())), finished[-1])
+        if winner is hedge and winner.exception() is None and is_success(winner.result()):
+            _count("hedge_wins")
+            print(f"[对冲请求] {model} 对冲请求先返回")
+        if discard:
+            for task in finished:
+                if task is not winner and task.exception() is None:
+                    discard(task.result())
+        return winner.result()
+    finally:
+        # 取消未完成的请求（另一方已胜出，或调用方被取消），等它们退出后再返回
+        losers = [task for task in pending if not task.done()]
+        for task in losers:
+            task.cancel()
+        results = await asyncio.gather(*losers, return_exceptions=True)
+        if discard:
+            for task, result in zip(losers, results):
+                # 取消前已经完成的请求结果同样需要释放
+                if not isinstance(result, BaseException):
+                    discard(result)
+
+
+def hedge_stats() -> dict:
+    """对冲请求统计：发起次数、对冲请求胜出次数、因限额用完未对冲次数"""
+    with _lock:
+        return {"enabled": HEDGE_ENABLED, "percentile": HEDGE_PERCENTILE, **_stats}
@@ -0,0 +1,56 @@
+"""
+HTTP客户端模块 - 全进程共享的异步连接池
+
+所有 Gemini 调用复用同一个 httpx.AsyncClient，避免每次请求重新建立 TCP+TLS 连接。
+客户端在 FastAPI lifespan 启动时创建、关闭时释放；脚本等场景下首次使用时自动创建。
+"""
+
+from typing import Optional
+
+import httpx
+
+from .config import (
+    HTTP_MAX_CONNECTIONS,
+    HTTP_MAX_KEEPALIVE_CONNECTIONS,
+    HTTP_KEEPALIVE_EXPIRY,
+    HTTP_CONNECT_TIMEOUT,
+    TEXT_REQUEST_TIMEOUT
+)
+
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def request_timeout(read_timeout: float) -> httpx.Timeout:
+    """构建单次调用的超时配置（连接超时统一，读取超时按调用类型设置）"""
+    return httpx.Timeout(read_timeout, connect=HTTP_CONNECT_TIMEOUT)
+
+
+def init_http_client() -> httpx.AsyncClient:
+    """创建共享的异步客户端（重复调用返回同一实例）"""
+    global _client
+    if _client is None or _client.is_closed:
+        limits = httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+        )
+        _client = httpx.AsyncClient(limits=limits, timeout=request_timeout(TEXT_REQUEST_TIMEOUT))
+        print(f"[HTTP] 已创建共享连接池: 最大连接{HTTP_MAX_CONNECTIONS}, 保活连接{HTTP_MAX_KEEPALIVE_CONNECTIONS}")
+    return _client
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """获取共享的异步客户端（未初始化时自动创建）"""
+    if _client is None or _client.is_closed:
+        return init_http_client()
+    return _client
+
+
+async def close_http_client():
+    """关闭共享客户端，释放所有连接"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+        print("[HTTP] 共享连接池已关闭")
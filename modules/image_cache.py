@@ -0,0 +1,112 @@
+"""
+图片编码缓存模块 - Logo、参考图、页面素材的base64编码结果缓存
+
+同一套PPT的每一页都要附带相同的Logo/参考图，缓存后每个文件只编码一次。
+缓存按文件内容哈希存放（内容相同的文件共用一份），文件路径+修改时间+大小映射到内容哈希，
+文件被覆盖后会重新读取；总大小超过 IMAGE_CACHE_MAX_BYTES 时淘汰最久未使用的。
+content_digest 由编码结果反查内容哈希，渲染缓存（见 render_cache）据此计算缓存键，不必再哈希整段base64。
+"""
+
+import os
+import base64
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from .config import IMAGE_CACHE_MAX_BYTES
+
+
+_lock = threading.Lock()
+# {内容哈希: base64字符串}，按最近使用顺序排列
+_entries: "OrderedDict[str, str]" = OrderedDict()
+# {(绝对路径, 修改时间, 文件大小): 内容哈希}
+_file_index: Dict[Tuple[str, int, int], str] = {}
+# {base64字符串: 内容哈希}；字符串会缓存自身的哈希值，字典查找又先比较对象身份，
+# 用缓存返回的同一个字符串查找时不需要遍历数据
+_digests: Dict[str, str] = {}
+_stats = {"hits": 0, "misses": 0, "evictions": 0, "bytes": 0}
+
+
+def _lookup(digest: str) -> str:
+    """命中时返回编码结果并标记为最近使用（需持有锁）"""
+    encoded = _entries.get(digest)
+    if encoded is not None:
+        _entries.move_to_end(digest)
+        _stats["hits"] += 1
+    return encoded
+
+
+def _store(file_key: tuple, digest: str, encoded: str):
+    """写入缓存并按字节预算淘汰（需持有锁）"""
+    _file_index[file_key] = digest
+    if len(encoded) > IMAGE_CACHE_MAX_BYTES or digest in _entries:
+        return
+    _entries[digest] = encoded
+    _digests[encoded] = digest
+    _stats["bytes"] += len(encoded)
+    while _stats["bytes"] > IMAGE_CACHE_MAX_BYTES:
+        old_digest, old_encoded = _entries.popitem(last=False)
+        _digests.pop(old_encoded, None)
+        _stats["bytes"] -= len(old_encoded)
+        _stats["evictions"] += 1
+        for key in [key for key, value in _file_index.items() if value == old_digest]:
+            del _file_index[key]
+
+
+def get_cached_base64(image_path: str) -> str:
+    """读取图片文件的base64编码（带缓存）"""
+    path = os.path.abspath(image_path)
+    stat = os.stat(path)
+    file_key = (path, stat.st_mtime_ns, stat.st_size)
+
+    with _lock:
+        digest = _file_index.get(file_key)
+        if digest is not None:
+            encoded = _lookup(digest)
+            if encoded is not None:
+                return encoded
+
+    with open(path, "rb") as f:
+        data = f.read()
+    digest = hashlib.sha256(data).hexdigest()
+
+    with _lock:
+        # 内容相同的其他文件已编码过
+        encoded = _lookup(digest)
+        if encoded is not None:
+            _file_index[file_key] = digest
+            return encoded
+        _stats["misses"] += 1
+
+    encoded = base64.b64encode(data).decode('utf-8')
+    with _lock:
+        _store(file_key, digest, encoded)
+    return encoded
+
+
+def content_digest(encoded: str) -> Optional[str]:
+    """由缓存中的base64编码结果反查图片内容哈希；不在缓存中（已淘汰或不是缓存返回的）时返回None"""
+    with _lock:
+        return _digests.get(encoded)
+
+
+def image_cache_stats() -> dict:
+    """缓存统计：命中/未命中次数、条目数、占用字节数"""
+    with _lock:
+        total = _stats["hits"] + _stats["misses"]
+        return {
+            **_stats,
+            "entries": len(_entries),
+            "max_bytes": IMAGE_CACHE_MAX_BYTES,
+            "hit_rate": round(_stats["hits"] / total, 3) if total else None
+        }
+
+
+def clear_image_cache():
+    """清空缓存（计数保留）"""
+    with _lock:
+        _entries.clear()
+        _file_index.clear()
+        _digests.clear()
+        _stats["bytes"] = 0
@@ -0,0 +1,177 @@
+"""
+图片解码模块 - 流式解析图片生成响应并保存
+
+图片生成响应是一个内嵌几MB base64 4K PNG 的JSON。原来的做法会同时持有响应原文、解析后的字典、
+base64字符串、解码后的字节、PIL图片和RGB副本，多页同时渲染时内存峰值很高。现在：
+- InlineImageDecoder 边接收响应边找出 inlineData.data，按块把 base64 直接解码进缓冲区，
+  不保留响应原文，也不做整体JSON解析
+- save_decoded_image 把解码出的PNG交给后处理进程池（见 postprocess），只为透明通道单独取一个波段，转换后立即释放原图
+- 每次渲染按阶段记录持有的字节数（接收缓冲 + 解码后的PNG + 后处理中的PIL图像缓冲），统计单次渲染的峰值
+  和所有进行中渲染的合计
+"""
+
+import io
+import re
+import asyncio
+import binascii
+import threading
+from pathlib import Path
+
+from .postprocess import run_postprocess, encode_renditions
+from .image_index import register_image
+
+
+# 匹配 "inlineData": {"mimeType": "...", "data": " （兼容 inline_data 写法）
+_DATA_START = re.compile(rb'"(?:inlineData|inline_data)"\s*:\s*\{[^{}]*?"data"\s*:\s*"')
+# 在块边界处保留的尾部长度，保证被切开的键名能在下一块中匹配上
+_SEARCH_TAIL = 1024
+
+_lock = threading.Lock()
+_stats = {
+    "decoded": 0,
+    "in_flight_bytes": 0,  # 进行中的渲染当前持有的字节数合计
+    "max_in_flight_bytes": 0,
+    "max_peak_bytes": 0,  # 单次渲染的最大峰值
+    "total_peak_bytes": 0,
+    "last_peak_bytes": 0
+}
+
+
+class InlineImageDecoder:
+    """流式提取响应中的第一张 inlineData 图片并解码到内存缓冲"""
+
+    def __init__(self):
+        self.buffer = io.BytesIO()  # 解码后的图片数据（PNG）
+        self.found = False
+        self.finished = False
+        self._in_data = False
+        self._search = b""
+        self._pending = b""  # 不足4个字符、暂不能解码的 base64 尾部
+        self.current = 0
+        self.peak = 0
+
+    # ============ 内存记账 ============
+
+    def hold(self, size: int):
+        self.current += size
+        self.peak = max(self.peak, self.current)
+        with _lock:
+            _stats["in_flight_bytes"] += size
+            _stats["max_in_flight_bytes"] = max(_stats["max_in_flight_bytes"], _stats["in_flight_bytes"])
+
+    def release(self, size: int):
+        self.current -= size
+        with _lock:
+            _stats["in_flight_bytes"] -= size
+
+    def detach(self) -> bytes:
+        """
+        取出解码后的图片数据并清空缓冲
+
+        BytesIO 没有其他引用（未调用过 getbuffer）时，getvalue() 直接交出内部缓冲，不复制；
+        数据仍计入本次渲染持有的内存，直到 close() 释放
+        """
+        image_bytes = self.buffer.getvalue()
+        self.buffer.close()
+        self.buffer = io.BytesIO()
+        return image_bytes
+
+    def close(self):
+        """渲染结束：释放缓冲并计入统计（重复调用无副作用）"""
+        if self.buffer is None:
+            return
+        self.release(self.current)
+        self.buffer = None
+        if not self.finished:
+            return  # 没有图片的响应不计入峰值统计
+        with _lock:
+            _stats["decoded"] += 1
+            _stats["last_peak_bytes"] = self.peak
+            _stats["total_peak_bytes"] += self.peak
+            _stats["max_peak_bytes"] = max(_stats["max_peak_bytes"], self.peak)
+
+    # ============ 流式解析 ============
+
+    def feed(self, chunk: bytes):
+        """输入一块响应数据"""
+        self.hold(len(chunk))
+        try:
+            self._feed(chunk)
+        finally:
+            self.release(len(chunk))
+
+    def _feed(self, chunk: bytes):
+        while chunk and not self.finished:
+            if self._in_data:
+                end = chunk.find(b'"')
+                self._decode(chunk if end < 0 else chunk[:end])
+                if end < 0:
+                    return
+                self._finish_data()
+                chunk = chunk[end + 1:]
+            else:
+                data = self._search + chunk
+                match = _DATA_START.search(data)
+                if not match:
+                    self._search = data[-_SEARCH_TAIL:]
+                    return
+                self._search = b""
+                self._in_data = True
+                self.found = True
+                chunk = data[match.end():]
+
+    def _decode(self, part: bytes):
+        # JSON 可能把 "/" 转义为 "\/"；base64 中不会出现反斜杠
+        data = self._pending + part.replace(b"\\", b"")
+        usable = len(data) // 4 * 4
+        if usable:
+            decoded = binascii.a2b_base64(data[:usable])
+            self.buffer.write(decoded)
+            self.hold(len(decoded))
+        self._pending = data[usable:]
+
+    def _finish_data(self):
+        if self._pending:
+            decoded = binascii.a2b_base64(self._pending + b"=" * (-len(self._pending) % 4))
+            self.buffer.write(decoded)
+            self.hold(len(decoded))
+            self._pending = b""
+        self._in_data = False
+        self.finished = True
+
+
+async def save_decoded_image(decoder: InlineImageDecoder, output_path: Path) -> bool:
+    """
+    把解码出的图片交给后处理进程池，输出原尺寸JPEG和预览、缩略图
+
+    返回: 响应中是否包含图片
+    """
+    if not decoder.finished or decoder.buffer is None:
+        return False  # 响应中没有图片，或图片数据不完整
+
+    # 取出数据（不复制）；这份数据一直持有到后处理和写文件结束，由调用方 close() 时释放
+    image_bytes = decoder.detach()
+
+    output_path_jpg = str(output_path).replace('.png', '.jpg')
+    try:
+        # 发送到后处理进程的副本和子进程中PIL像素缓冲的峰值，与这里持有的数据同时存在，一并计入本次渲染
+        pixel_peak = await run_postprocess(encode_renditions, image_bytes, output_path_jpg)
+        decoder.hold(len(image_bytes) + pixel_peak)
+        decoder.release(len(image_bytes) + pixel_peak)
+        register_image(output_path_jpg)
+        print(f"图片已压缩保存: {output_path_jpg} (原始PNG -> JPEG + 预览/缩略图，解码峰值约 {decoder.peak / 1024 / 1024:.1f}MB)")
+    except Exception as compress_err:
+        print(f"图片压缩失败，使用原始格式: {compress_err}")
+        # 压缩失败则保存原始PNG
+        await asyncio.to_thread(Path(output_path).write_bytes, image_bytes)
+        register_image(output_path)
+        print(f"图片已保存: {output_path}")
+    return True
+
+
+def image_decode_stats() -> dict:
+    """图片解码的内存统计（字节）：单次渲染峰值的最大/平均/最近值，进行中渲染的合计及其最大值"""
+    with _lock:
+        stats = dict(_stats)
+    stats["avg_peak_bytes"] = stats.pop("total_peak_bytes") // stats["decoded"] if stats["decoded"] else None
+    return stats
@@ -0,0 +1,77 @@
+"""
+图片索引模块 - OUTPUT_DIR 中图片的 文件名 -> 路径 内存索引
+
+图片接口原来在精确文件名不存在时遍历 OUTPUT_DIR 做子串匹配，输出目录越积越大，每次请求越来越慢。
+现在启动时扫描一次目录建立索引，之后由写入图片的地方（后处理保存、渲染缓存命中）登记新文件，
+查找只需一次字典查询。其他进程（多 worker 部署）写入的文件不在本进程索引中，
+未命中时再检查一次 OUTPUT_DIR 下的同名文件并补登记。
+"""
+
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Optional
+
+from .config import OUTPUT_DIR
+from .postprocess import RENDITIONS, rendition_path
+
+
+IMAGE_SUFFIXES = (".jpg", ".jpeg", ".png", ".webp")
+
+_index: Dict[str, Path] = {}
+_lock = threading.Lock()
+_stats = {"lookups": 0, "misses": 0, "late_registered": 0}
+
+
+def build_image_index():
+    """扫描 OUTPUT_DIR 建立索引（启动时调用一次）"""
+    entries = {}
+    with os.scandir(OUTPUT_DIR) as it:
+        for entry in it:
+            if entry.is_file() and entry.name.lower().endswith(IMAGE_SUFFIXES):
+                entries[entry.name] = OUTPUT_DIR / entry.name
+    with _lock:
+        _index.update(entries)
+    print(f"[图片索引] 已索引 {len(entries)} 张图片")
+
+
+def register_image(path):
+    """登记新写入的图片及其预览图、缩略图"""
+    path = Path(path)
+    paths = [path] + [rendition_path(path, suffix) for _, suffix, _, _ in RENDITIONS]
+    with _lock:
+        for item in paths:
+            if item.is_file():
+                _index[item.name] = item
+
+
+def unregister_image(filename: str):
+    with _lock:
+        _index.pop(filename, None)
+
+
+def lookup_image(filename: str) -> Optional[Path]:
+    """按文件名查找图片，不存在时返回None（只接受 OUTPUT_DIR 下的文件名，不接受路径）"""
+    if not filename or Path(filename).name != filename or filename in (".", ".."):
+        return None
+    with _lock:
+        _stats["lookups"] += 1
+        path = _index.get(filename)
+    if path is not None:
+        return path
+
+    path = OUTPUT_DIR / filename
+    if not filename.lower().endswith(IMAGE_SUFFIXES) or not path.is_file():
+        with _lock:
+            _stats["misses"] += 1
+        return None
+    with _lock:
+        _index[filename] = path
+        _stats["late_registered"] += 1
+    return path
+
+
+def image_index_stats() -> dict:
+    """索引统计：索引图片数、查找次数、未找到次数、查找时补登记次数"""
+    with _lock:
+        return {"images": len(_index), **_stats}
@@ -0,0 +1,181 @@
+"""
+图片尺寸版本模块 - 图片接口按需缩放与结果缓存
+
+/api/image/{filename}?w=480&fmt=webp 返回缩小并转码后的图片，页面列表不必下载4K原图：
+- 宽度向上取到 IMAGE_VARIANT_WIDTHS 中最近的一档（不超过原图宽度），格式支持 webp / jpeg / png
+- 结果按 (原图内容哈希, 宽度, 格式) 存放在 IMAGE_VARIANT_DIR，原图重新生成后哈希变化，旧结果自然失效；
+  总大小超过 IMAGE_VARIANT_MAX_BYTES 时删除最久未使用的
+- 与后处理输出的预览图、缩略图（见 postprocess）尺寸和格式相同时直接复用
+- 缩放在后处理进程池中执行，查找已有结果和清理缓存的文件操作在线程中执行
+
+原图内容哈希同时作为 ETag 和图片版本号（image_version）：地址带 ?v=版本号 时可以长期缓存。
+"""
+
+import os
+import asyncio
+import mimetypes
+import threading
+from contextlib import suppress
+from pathlib import Path
+from typing import Optional, Tuple
+
+from PIL import Image
+
+from .config import IMAGE_VARIANT_DIR, IMAGE_VARIANT_MAX_BYTES, IMAGE_VARIANT_WIDTHS, IMAGE_VARIANT_QUALITY
+from .postprocess import RENDITIONS, rendition_path, image_version, run_postprocess
+
+
+# 输出格式: (PIL格式名, Content-Type, 扩展名)
+IMAGE_FORMATS = {
+    "webp": ("WEBP", "image/webp", ".webp"),
+    "jpeg": ("JPEG", "image/jpeg", ".jpg"),
+    "jpg": ("JPEG", "image/jpeg", ".jpg"),
+    "png": ("PNG", "image/png", ".png"),
+}
+
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "rendition_hits": 0, "evictions": 0}
+
+
+def media_type(path) -> str:
+    """按扩展名判断图片的 Content-Type"""
+    return mimetypes.guess_type(str(path))[0] or "application/octet-stream"
+
+
+def variant_width(requested: int) -> int:
+    """请求宽度向上取到 IMAGE_VARIANT_WIDTHS 中最近的一档"""
+    return next((w for w in IMAGE_VARIANT_WIDTHS if w >= requested), IMAGE_VARIANT_WIDTHS[-1])
+
+
+# ============ 缩放（在进程池中执行） ============
+
+def encode_variant(source: str, target: str, width: int, pil_format: str, quality: int) -> int:
+    """把原图缩放到指定宽度并按格式保存，返回实际宽度"""
+    with Image.open(source) as img:
+        # JPEG 按目标尺寸的整数倍缩小解码，不必完整解码4K图
+        img.draft("RGB", (width, width))
+        width = min(width, img.width)
+        height = max(1, round(img.height * width / img.width))
+        resized = img.convert("RGB").resize((width, height), Image.LANCZOS)
+    tmp_path = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        if pil_format == "JPEG":
+            resized.save(tmp_path, "JPEG", quality=quality, optimize=True)
+        elif pil_format == "WEBP":
+            resized.save(tmp_path, "WEBP", quality=quality, method=4)
+        else:
+            resized.save(tmp_path, pil_format, optimize=True)
+        os.replace(tmp_path, target)
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+    return width
+
+
+def _matching_rendition(source: Path, width: int, fmt: str) -> Optional[Tuple[Path, os.stat_result]]:
+    """后处理已输出的同尺寸同格式版本（比原图新时才可用），返回路径和文件信息"""
+    if IMAGE_FORMATS[fmt][0] != "WEBP":
+        return None
+    for _, suffix, rendition_width, _ in RENDITIONS:
+        if rendition_width != width:
+            continue
+        path = rendition_path(source, suffix)
+        try:
+            stat = path.stat()
+            if stat.st_mtime_ns >= source.stat().st_mtime_ns:
+                return path, stat
+        except FileNotFoundError:
+            pass
+    return None
+
+
+def _find_variant(source: Path, cache_path: Path, width: int, fmt: str) -> Optional[Tuple[Path, os.stat_result]]:
+    """查找已有的预览图或缓存结果，返回路径和文件信息（在线程中执行）"""
+    rendition = _matching_rendition(source, width, fmt)
+    if rendition is not None:
+        with _lock:
+            _stats["rendition_hits"] += 1
+        return rendition
+    try:
+        os.utime(cache_path)  # 更新修改时间，清理时按最久未使用的顺序删除
+        stat = cache_path.stat()
+    except FileNotFoundError:
+        return None
+    with _lock:
+        _stats["hits"] += 1
+    return cache_path, stat
+
+
+def _store_variant(cache_path: Path) -> Optional[os.stat_result]:
+    """新生成结果的文件信息，随后清理超出上限的缓存（在线程中执行）；文件已被其他请求清理掉时返回None"""
+    try:
+        stat = cache_path.stat()
+    except FileNotFoundError:
+        return None
+    _prune(keep=cache_path)
+    return stat
+
+
+async def get_image_variant(source: Path, requested_width: int, fmt: str) -> Tuple[Path, str, os.stat_result]:
+    """
+    获取原图的缩放版本（没有时生成并缓存）
+
+    返回: (文件路径, 原图版本号, 文件信息)；文件信息与路径一起取得，调用方不必再 stat（期间可能被清理）
+    原图已被删除时抛出 FileNotFoundError
+    """
+    version = await asyncio.to_thread(image_version, source)
+    width = variant_width(requested_width)
+    pil_format, _, ext = IMAGE_FORMATS[fmt]
+    cache_path = IMAGE_VARIANT_DIR / f"{version}_{width}{ext}"
+
+    # 刚生成的文件在取得文件信息前被并发的清理删掉时再生成一次
+    for _ in range(2):
+        found = await asyncio.to_thread(_find_variant, source, cache_path, width, fmt)
+        if found is not None:
+            return found[0], version, found[1]
+
+        IMAGE_VARIANT_DIR.mkdir(parents=True, exist_ok=True)
+        await run_postprocess(encode_variant, str(source), str(cache_path), width, pil_format, IMAGE_VARIANT_QUALITY)
+        with _lock:
+            _stats["misses"] += 1
+        stat = await asyncio.to_thread(_store_variant, cache_path)
+        if stat is not None:
+            return cache_path, version, stat
+    raise FileNotFoundError(cache_path)
+
+
+def _prune(keep: Optional[Path] = None):
+    """总大小超出上限时删除最久未使用的缩放结果（keep: 不删除的文件，即刚生成的结果）"""
+    files = []
+    for path in IMAGE_VARIANT_DIR.iterdir():
+        if path.suffix == ".tmp" or path == keep:
+            continue  # 正在写入的文件
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        files.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in files)
+    if keep is not None:
+        with suppress(FileNotFoundError):
+            total += keep.stat().st_size
+    if total <= IMAGE_VARIANT_MAX_BYTES:
+        return
+    evicted = 0
+    for _, size, path in sorted(files):
+        if total <= IMAGE_VARIANT_MAX_BYTES:
+            break
+        path.unlink(missing_ok=True)
+        total -= size
+        evicted += 1
+    with _lock:
+        _stats["evictions"] += evicted
+    print(f"[图片缩放] 已清理 {evicted} 个缓存文件")
+
+
+def image_variant_stats() -> dict:
+    """缩放缓存统计：命中/生成/复用预览图次数、清理数量"""
+    with _lock:
+        total = _stats["hits"] + _stats["misses"] + _stats["rendition_hits"]
+        hits = _stats["hits"] + _stats["rendition_hits"]
+        return {**_stats, "max_bytes": IMAGE_VARIANT_MAX_BYTES, "hit_rate": round(hits / total, 3) if total else None}
@@ -0,0 +1,573 @@
+"""
+后台任务模块 - 一键生成的后台任务（任务ID + 轮询 + 取消）
+
+创建任务时对设计方案做快照，之后在后台逐页渲染；每页完成即写入session，
+与 /api/image/generate-all 的写入方式一致，下载接口无需改动。
+
+任务队列和每页状态持久化在本地 SQLite（JOB_DB_FILE）中：进程重启后，
+未完成的任务从第一个未完成的页面继续，已生成的页面不会重复调用图片接口。
+多个进程共享同一个数据库时，通过 owner + 心跳租约保证每个任务只有一个进程在执行。
+数据库读写都在线程中执行（asyncio.to_thread），不阻塞事件循环；对外的查询、创建、取消接口都是协程。
+"""
+
+import os
+import json
+import time
+import uuid
+import socket
+import asyncio
+import sqlite3
+from pathlib import Path
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from .config import JOB_DB_FILE, JOB_HISTORY_LIMIT, JOB_HEARTBEAT_INTERVAL, JOB_LEASE_TIMEOUT
+from .session import SessionStage, update_session_async, add_message_async
+from .hedging import HedgeBudget
+from .postprocess import page_renditions
+from .render import build_render_context, build_page_tasks, render_page, store_page_result, finish_deck, leave_generate_stage
+
+
+# ============ 任务状态 ============
+
+class JobStatus:
+    QUEUED = "queued"            # 已创建，等待执行
+    RUNNING = "running"          # 执行中
+    COMPLETED = "completed"      # 全部页面处理完毕（可能有失败页）
+    CANCELLED = "cancelled"      # 已取消
+    FAILED = "failed"            # 任务异常终止
+
+
+class PageStatus:
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+
+ACTIVE_JOB_STATUSES = (JobStatus.QUEUED, JobStatus.RUNNING)
+
+# 当前进程的标识，用于任务租约
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+# ============ SQLite 存储 ============
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    context TEXT NOT NULL,
+    error TEXT,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    owner TEXT,
+    heartbeat_at REAL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_session ON jobs(session_id);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status);
+CREATE TABLE IF NOT EXISTS job_pages (
+    job_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    page INTEGER NOT NULL,
+    theme TEXT,
+    prompt TEXT,
+    page_materials TEXT,
+    output_path TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    retry_info TEXT,
+    error TEXT,
+    PRIMARY KEY (job_id, idx)
+);
+"""
+
+
+@contextmanager
+def _connect():
+    """打开数据库连接（事务在退出时提交）"""
+    conn = sqlite3.connect(JOB_DB_FILE, timeout=10)
+    conn.row_factory = sqlite3.Row
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def init_job_store():
+    """初始化任务数据库"""
+    with _connect() as conn:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+
+
+def _insert_job(job: dict):
+    with _connect() as conn:
+        conn.execute(
+            "INSERT INTO jobs (id, session_id, status, mode, context, error, owner, heartbeat_at, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (job["id"], job["session_id"], job["status"], job["mode"], json.dumps(job["context"], ensure_ascii=False),
+             job["error"], WORKER_ID, time.time(), job["created_at"], job["updated_at"])
+        )
+        conn.executemany(
+            "INSERT INTO job_pages (job_id, idx, page, theme, prompt, page_materials, output_path, status, attempts) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [(job["id"], p["index"], p["page"], p["theme"], p["prompt"], json.dumps(p["page_materials"], ensure_ascii=False),
+              p["output_path"], p["status"], p["attempts"]) for p in job["pages"]]
+        )
+
+
+def _write_job_status(job_id: str, status: str, error: Optional[str], updated_at: float):
+    with _connect() as conn:
+        conn.execute("UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?", (status, error, updated_at, job_id))
+
+
+def _write_page(row: tuple, updated_at: float):
+    job_id = row[-2]
+    with _connect() as conn:
+        conn.execute("UPDATE job_pages SET status = ?, attempts = ?, retry_info = ?, error = ? WHERE job_id = ? AND idx = ?", row)
+        conn.execute("UPDATE jobs SET updated_at = ? WHERE id = ?", (updated_at, job_id))
+
+
+def _clear_owner(job_id: str):
+    with _connect() as conn:
+        conn.execute("UPDATE jobs SET owner = NULL WHERE id = ? AND owner = ?", (job_id, WORKER_ID))
+
+
+# 每个任务最近一次排队的写入 {job_id: task}：新的写入等上一个完成后再执行，保证按调用顺序落盘。
+# 写入是独立的任务，任务协程被取消时已排队的写入照常完成，不会有被取消的旧写入晚于新写入落盘
+_job_writes: Dict[str, asyncio.Task] = {}
+
+
+async def _chained_write(previous: Optional[asyncio.Task], func, args: tuple):
+    if previous is not None:
+        await asyncio.gather(previous, return_exceptions=True)
+    try:
+        await asyncio.to_thread(func, *args)
+    except Exception as e:
+        print(f"[后台任务] 保存任务状态失败: {e}")
+
+
+def _queue_write(job_id: str, func, *args) -> asyncio.Task:
+    """排队执行一次数据库写入（参数需是调用时的快照），返回写入任务"""
+    task = asyncio.create_task(_chained_write(_job_writes.get(job_id), func, args))
+    _job_writes[job_id] = task
+    task.add_done_callback(lambda t: _job_writes.pop(job_id, None) if _job_writes.get(job_id) is t else None)
+    return task
+
+
+def _queue_page_save(job: dict, page: dict) -> asyncio.Task:
+    """排队写入页面状态（可在同步的进度回调中调用，调用时取页面状态的快照）"""
+    job["updated_at"] = time.time()
+    row = (page["status"], page["attempts"], page["retry_info"], page["error"], job["id"], page["index"])
+    return _queue_write(job["id"], _write_page, row, job["updated_at"])
+
+
+async def _save_page(job: dict, page: dict):
+    await asyncio.shield(_queue_page_save(job, page))
+
+
+async def _save_job_status(job: dict):
+    job["updated_at"] = time.time()
+    await asyncio.shield(_queue_write(job["id"], _write_job_status, job["id"], job["status"], job["error"], job["updated_at"]))
+
+
+def _load_job(job_id: str) -> Optional[dict]:
+    with _connect() as conn:
+        row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if not row:
+            return None
+        page_rows = conn.execute("SELECT * FROM job_pages WHERE job_id = ? ORDER BY idx", (job_id,)).fetchall()
+
+    pages = [
+        {
+            "index": p["idx"],
+            "page": p["page"],
+            "theme": p["theme"] or "",
+            "prompt": p["prompt"] or "",
+            "output_path": p["output_path"],
+            "page_materials": json.loads(p["page_materials"] or "[]"),
+            "status": p["status"],
+            "attempts": p["attempts"],
+            "retry_info": p["retry_info"],
+            "error": p["error"]
+        }
+        for p in page_rows
+    ]
+    return {
+        "id": row["id"],
+        "session_id": row["session_id"],
+        "status": row["status"],
+        "mode": row["mode"],
+        "context": json.loads(row["context"]),
+        "pages": pages,
+        "cancel_requested": bool(row["cancel_requested"]),
+        "created_at": row["created_at"],
+        "updated_at": row["updated_at"],
+        "error": row["error"]
+    }
+
+
+def _prune_finished_jobs():
+    """数据库中只保留最近 JOB_HISTORY_LIMIT 个已结束的任务"""
+    with _connect() as conn:
+        stale_ids = [r["id"] for r in conn.execute(
+            "SELECT id FROM jobs WHERE status NOT IN (?, ?) ORDER BY updated_at DESC LIMIT -1 OFFSET ?",
+            (*ACTIVE_JOB_STATUSES, JOB_HISTORY_LIMIT)
+        )]
+        for job_id in stale_ids:
+            conn.execute("DELETE FROM job_pages WHERE job_id = ?", (job_id,))
+            conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+
+# ============ 任务查询 ============
+
+# 本进程正在执行的任务（内存中的状态是最新的）
+jobs: Dict[str, dict] = {}
+_job_tasks: Dict[str, asyncio.Task] = {}
+
+
+async def get_job(job_id: str) -> Optional[dict]:
+    """获取任务（不存在返回None）；本进程执行中的任务读内存，其余读数据库"""
+    return jobs.get(job_id) or await asyncio.to_thread(_load_job, job_id)
+
+
+def _active_job_id(session_id: str) -> Optional[str]:
+    with _connect() as conn:
+        row = conn.execute(
+            "SELECT id FROM jobs WHERE session_id = ? AND status IN (?, ?) ORDER BY created_at DESC LIMIT 1",
+            (session_id, *ACTIVE_JOB_STATUSES)
+        ).fetchone()
+    return row["id"] if row else None
+
+
+async def find_active_job(session_id: str) -> Optional[dict]:
+    """查找会话正在进行中的任务"""
+    job_id = await asyncio.to_thread(_active_job_id, session_id)
+    return await get_job(job_id) if job_id else None
+
+
+def _session_job_ids(session_id: str) -> list[str]:
+    with _connect() as conn:
+        return [r["id"] for r in conn.execute("SELECT id FROM jobs WHERE session_id = ? ORDER BY created_at DESC", (session_id,))]
+
+
+async def list_jobs(session_id: str) -> list[dict]:
+    """列出会话的所有任务（新的在前）"""
+    job_ids = await asyncio.to_thread(_session_job_ids, session_id)
+    return [job for job in [await get_job(job_id) for job_id in job_ids] if job]
+
+
+def job_summary(job: dict) -> dict:
+    """任务的对外展示结构（不包含prompt、素材等内部字段）"""
+    pages = [
+        {
+            "page": p["page"],
+            "theme": p["theme"],
+            "status": p["status"],
+            "attempts": p["attempts"],
+            "image_path": p["output_path"] if p["status"] == PageStatus.DONE else None,
+            "retry_info": p.get("retry_info"),
+            "error": p.get("error")
+        }
+        for p in job["pages"]
+    ]
+    return {
+        "job_id": job["id"],
+        "session_id": job["session_id"],
+        "status": job["status"],
+        "mode": job["mode"],
+        "total": len(pages),
+        "done": sum(1 for p in pages if p["status"] == PageStatus.DONE),
+        "failed": sum(1 for p in pages if p["status"] == PageStatus.FAILED),
+        "pages": pages,
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+        "error": job.get("error")
+    }
+
+
+# ============ 任务执行 ============
+
+async def create_job(session_id: str, session: dict, mode: str, force_regenerate: bool = False) -> dict:
+    """创建任务并对当前设计方案做快照（立即持久化）；force_regenerate 表示跳过渲染结果缓存"""
+    now = time.time()
+    pages = build_page_tasks(session_id, session)
+    for page in pages:
+        page.update({"status": PageStatus.PENDING, "attempts": 0, "retry_info": None, "error": None})
+
+    job = {
+        "id": uuid.uuid4().hex,
+        "session_id": session_id,
+        "status": JobStatus.QUEUED,
+        "mode": mode,
+        "context": build_render_context(session, force_regenerate),
+        "pages": pages,
+        "cancel_requested": False,
+        "created_at": now,
+        "updated_at": now,
+        "error": None
+    }
+    await asyncio.to_thread(_insert_job, job)
+    await asyncio.to_thread(_prune_finished_jobs)
+    return job
+
+
+# 查找进行中任务和创建任务之间会让出事件循环，同一进程内串行执行，避免同一会话重复创建
+_create_lock = asyncio.Lock()
+
+
+async def find_or_create_job(session_id: str, session: dict, mode: str, force_regenerate: bool = False) -> tuple[dict, bool]:
+    """会话已有进行中的任务时返回该任务，否则创建新任务；返回 (任务, 是否新建)"""
+    async with _create_lock:
+        active_job = await find_active_job(session_id)
+        if active_job:
+            return active_job, False
+        return await create_job(session_id, session, mode, force_regenerate), True
+
+
+def start_job(job: dict):
+    """在后台启动任务（调用方需已持有该任务的租约）"""
+    jobs[job["id"]] = job
+    task = asyncio.create_task(_run_job(job))
+    _job_tasks[job["id"]] = task
+
+    def on_done(t):
+        _job_tasks.pop(job["id"], None)
+        jobs.pop(job["id"], None)
+    task.add_done_callback(on_done)
+
+
+def _page_result(page: dict) -> dict:
+    """已完成页面的结果结构（与 render_page 返回一致）"""
+    success = page["status"] == PageStatus.DONE
+    return {
+        "page": page["page"], "theme": page["theme"], "success": success,
+        "image_path": page["output_path"] if success else None,
+        "filename": Path(page["output_path"]).name if success else None, "retry_info": page["retry_info"],
+        **(page_renditions(page["output_path"]) if success else {})
+    }
+
+
+async def _run_page(job: dict, page: dict, hedge_budget: HedgeBudget) -> dict:
+    """渲染任务中的一页，并同步页面状态"""
+    session_id = job["session_id"]
+
+    def on_event(event: dict):
+        if event["type"] == "page_start":
+            page["status"] = PageStatus.RUNNING
+            page["attempts"] += 1
+        elif event["type"] == "page_retry":
+            page["attempts"] += 1
+            page["retry_info"] = event["retry_info"]
+        _queue_page_save(job, page)  # 同步回调中不能等待，排在最终结果之前写入
+
+    result = await render_page(session_id, page, job["context"], on_event=on_event, hedge_budget=hedge_budget)
+
+    if result["success"]:
+        page["status"] = PageStatus.DONE
+    else:
+        page["status"] = PageStatus.CANCELLED if result.get("cancelled") else PageStatus.FAILED
+    page["retry_info"] = result.get("retry_info")
+    page["error"] = result.get("error")
+    await _save_page(job, page)
+
+    if result["success"]:
+        await store_page_result(session_id, page["index"], result)
+    return result
+
+
+async def _run_job(job: dict):
+    session_id = job["session_id"]
+    # 第一次让出事件循环之前标记为执行中：取消接口看到 queued 时，说明协程还没有开始执行
+    job["status"] = JobStatus.RUNNING
+    try:
+        await update_session_async(session_id, stage=SessionStage.GENERATE)
+
+        # 断点续跑：已完成的页面直接复用（并补写回session），只渲染未完成的页面
+        remaining = []
+        for page in job["pages"]:
+            if page["status"] == PageStatus.DONE and Path(page["output_path"]).exists():
+                await store_page_result(session_id, page["index"], _page_result(page))
+            else:
+                page["status"] = PageStatus.PENDING
+                remaining.append(page)
+
+        await _save_job_status(job)
+        print(f"[后台任务] {job['id']} 开始: 会话{session_id}, 共{len(job['pages'])}页, 待渲染{len(remaining)}页, 模式{job['mode']}")
+
+        # 对冲请求限额按本次实际要渲染的页数计算（不在任务快照中持久化）
+        hedge_budget = HedgeBudget(len(remaining))
+        if job["mode"] == "serial":
+            for page in remaining:
+                if (await _run_page(job, page, hedge_budget)).get("cancelled"):
+                    break
+        else:
+            await asyncio.gather(*(_run_page(job, page, hedge_budget) for page in remaining))
+    except asyncio.CancelledError:
+        if job["cancel_requested"]:
+            await _mark_cancelled(job)
+        else:
+            await _release_job(job)
+        raise
+    except Exception as e:
+        job["status"] = JobStatus.FAILED
+        job["error"] = str(e)
+        await _save_job_status(job)
+        print(f"[后台任务] {job['id']} 异常终止: {e}")
+        return
+
+    if any(page["status"] == PageStatus.CANCELLED for page in job["pages"]):
+        # 页面渲染被会话级取消（大纲或设计方案已修改、用户主动取消）
+        await _mark_cancelled(job)
+        return
+
+    job["status"] = JobStatus.COMPLETED
+    await _save_job_status(job)
+    await finish_deck(session_id, [_page_result(page) for page in job["pages"]])
+    print(f"[后台任务] {job['id']} 完成")
+
+
+async def _mark_cancelled(job: dict):
+    """把未完成的页面和任务标记为已取消"""
+    for page in job["pages"]:
+        if page["status"] in (PageStatus.PENDING, PageStatus.RUNNING):
+            page["status"] = PageStatus.CANCELLED
+            await _save_page(job, page)
+    job["status"] = JobStatus.CANCELLED
+    await _save_job_status(job)
+    done = sum(1 for p in job["pages"] if p["status"] == PageStatus.DONE)
+    await leave_generate_stage(job["session_id"])
+    await add_message_async(job["session_id"], "assistant", f"⏹️ 生成任务已取消（已完成{done}页）")
+    print(f"[后台任务] {job['id']} 已取消")
+
+
+async def _release_job(job: dict):
+    """进程关闭时释放任务：执行中的页面退回待渲染，清除租约以便重启后立即续跑"""
+    for page in job["pages"]:
+        if page["status"] == PageStatus.RUNNING:
+            page["status"] = PageStatus.PENDING
+            await _save_page(job, page)
+    await asyncio.shield(_queue_write(job["id"], _clear_owner, job["id"]))
+    print(f"[后台任务] {job['id']} 已中断，等待续跑")
+
+
+def _request_cancel(job_id: str):
+    with _connect() as conn:
+        conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ?", (job_id,))
+
+
+async def cancel_job(job_id: str) -> bool:
+    """取消任务（正在渲染的页面会立即中断）；任务不在执行中时返回False"""
+    job = await get_job(job_id)
+    if not job or job["status"] not in ACTIVE_JOB_STATUSES:
+        return False
+
+    await asyncio.to_thread(_request_cancel, job_id)
+    job["cancel_requested"] = True
+
+    task = _job_tasks.get(job_id)
+    if job["status"] == JobStatus.QUEUED:
+        # 任务尚未开始执行（协程不会再运行），直接标记
+        await _mark_cancelled(job)
+    if task:
+        task.cancel()
+    # 由其他进程执行的任务，会在其下一次心跳时取消
+    return True
+
+
+# ============ 租约与续跑 ============
+
+def _claim_job(job_id: str) -> bool:
+    """尝试获取任务租约（无人持有或租约过期时才能获取）"""
+    now = time.time()
+    with _connect() as conn:
+        cursor = conn.execute(
+            "UPDATE jobs SET owner = ?, heartbeat_at = ? WHERE id = ? AND status IN (?, ?) AND (owner IS NULL OR heartbeat_at < ?)",
+            (WORKER_ID, now, job_id, *ACTIVE_JOB_STATUSES, now - JOB_LEASE_TIMEOUT)
+        )
+        return cursor.rowcount == 1
+
+
+def _unowned_job_ids() -> list[str]:
+    with _connect() as conn:
+        return [r["id"] for r in conn.execute(
+            "SELECT id FROM jobs WHERE status IN (?, ?) AND (owner IS NULL OR heartbeat_at < ?) ORDER BY created_at",
+            (*ACTIVE_JOB_STATUSES, time.time() - JOB_LEASE_TIMEOUT)
+        )]
+
+
+async def recover_jobs() -> int:
+    """接管未完成且无人执行的任务（启动时及每次心跳时调用），返回接管数量"""
+    job_ids = await asyncio.to_thread(_unowned_job_ids)
+
+    recovered = 0
+    for job_id in job_ids:
+        if job_id in _job_tasks or not await asyncio.to_thread(_claim_job, job_id):
+            continue
+        job = await asyncio.to_thread(_load_job, job_id)
+        if job["cancel_requested"]:
+            await _mark_cancelled(job)
+            continue
+        print(f"[后台任务] 续跑任务 {job_id}")
+        start_job(job)
+        recovered += 1
+    return recovered
+
+
+def _renew_leases(job_ids: list[str]) -> list[str]:
+    """续约任务，返回其中被请求取消的任务ID"""
+    placeholders = ",".join("?" * len(job_ids))
+    with _connect() as conn:
+        conn.execute(f"UPDATE jobs SET heartbeat_at = ? WHERE owner = ? AND id IN ({placeholders})", (time.time(), WORKER_ID, *job_ids))
+        return [r["id"] for r in conn.execute(f"SELECT id FROM jobs WHERE cancel_requested = 1 AND id IN ({placeholders})", job_ids)]
+
+
+async def _heartbeat():
+    """续约本进程执行中的任务，并处理其他进程发来的取消请求"""
+    if not _job_tasks:
+        return
+    cancelled = await asyncio.to_thread(_renew_leases, list(_job_tasks))
+    for job_id in cancelled:
+        task = _job_tasks.get(job_id)
+        if task and not task.done() and job_id in jobs:
+            jobs[job_id]["cancel_requested"] = True
+            task.cancel()
+
+
+async def _maintenance_loop():
+    while True:
+        await asyncio.sleep(JOB_HEARTBEAT_INTERVAL)
+        try:
+            await _heartbeat()
+            await recover_jobs()
+        except Exception as e:
+            print(f"[后台任务] 心跳失败: {e}")
+
+
+_maintenance_task: Optional[asyncio.Task] = None
+
+
+async def start_job_workers():
+    """启动时调用：初始化数据库、续跑未完成的任务并启动心跳"""
+    global _maintenance_task
+    await asyncio.to_thread(init_job_store)
+    recovered = await recover_jobs()
+    if recovered:
+        print(f"[后台任务] 已续跑 {recovered} 个未完成的任务")
+    _maintenance_task = asyncio.create_task(_maintenance_loop())
+
+
+async def shutdown_jobs():
+    """服务关闭时中断所有后台任务（状态保留在数据库中，重启后续跑）"""
+    if _maintenance_task:
+        _maintenance_task.cancel()
+    tasks = list(_job_tasks.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    # 等待已排队的状态写入落盘
+    await asyncio.gather(*_job_writes.values(), return_exceptions=True)
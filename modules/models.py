@@ -17,20 +17,25 @@ class UserInputRequest(BaseModel):
     page_instructions: Optional[str] = None  # 逐页说明
     design_principles: Optional[str] = None  # 用户自定义设计原则
     template_settings: Optional[dict] = None  # 模板设置（配色、字体等）
+    regenerate: bool = False  # 重新生成：跳过文本生成缓存
 
 
 class RefineRequest(BaseModel):
     session_id: str
     feedback: str
+    regenerate: bool = False  # 重新生成：跳过文本生成缓存
 
 
 class GenerateImageRequest(BaseModel):
     session_id: str
     page_index: int
+    force_regenerate: bool = False  # 跳过渲染结果缓存，强制重新生成图片
 
 
 class GenerateAllImagesRequest(BaseModel):
     session_id: str
+    mode: str = "parallel"  # 生成模式：parallel（并发渲染）/ serial（逐页渲染）
+    force_regenerate: bool = False  # 跳过渲染结果缓存，强制重新生成所有页面
 
 
 class BaseRequest(BaseModel):
@@ -41,6 +46,7 @@ class RefinePageRequest(BaseModel):
     session_id: str
     page_index: int
     feedback: str
+    regenerate: bool = False  # 重新生成：跳过文本生成缓存
 
 
 class OutlineUpdateRequest(BaseModel):
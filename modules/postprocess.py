@@ -0,0 +1,206 @@
+"""
+图片后处理模块 - 在独立进程池中把生成的图片编码为多种尺寸
+
+4K PNG 转 JPEG（optimize=True）很耗CPU，放在请求线程里会和其他工作争抢GIL。
+后处理放到专用的进程池中执行，一次解码同时输出：
+- 原尺寸 JPEG（下载、导出PDF用），即原来的 {session_id}_第N页.jpg
+- 预览 WebP（宽 PREVIEW_WIDTH，页面展示用）: {session_id}_第N页.preview.webp
+- 缩略图 WebP（宽 THUMBNAIL_WIDTH，页面列表用）: {session_id}_第N页.thumb.webp
+
+进程池不可用时（例如受限环境无法创建子进程）退回到线程池执行。
+"""
+
+import io
+import time
+import asyncio
+import hashlib
+import threading
+import multiprocessing
+from collections import OrderedDict
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Optional, Tuple
+
+from PIL import Image
+
+from .config import POSTPROCESS_WORKERS, PREVIEW_WIDTH, PREVIEW_QUALITY, THUMBNAIL_WIDTH, THUMBNAIL_QUALITY
+
+
+# 各尺寸版本：(名称, 文件后缀, 宽度, WebP质量)
+RENDITIONS = (
+    ("preview", ".preview.webp", PREVIEW_WIDTH, PREVIEW_QUALITY),
+    ("thumbnail", ".thumb.webp", THUMBNAIL_WIDTH, THUMBNAIL_QUALITY),
+)
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+_lock = threading.Lock()
+_stats = {"tasks": 0, "in_process_pool": 0, "in_thread": 0, "failures": 0, "seconds": 0.0}
+
+# 文件内容哈希的缓存 {路径: (修改时间, 大小, 哈希)}，文件未变化时不重复计算
+_HASH_CACHE_SIZE = 4096
+_hashes: "OrderedDict[str, Tuple[int, int, str]]" = OrderedDict()
+
+
+# ============ 文件路径 ============
+
+def rendition_path(image_path, suffix: str) -> Path:
+    """原图对应的某个尺寸版本的路径（{原文件名去扩展名}{后缀}）"""
+    path = Path(image_path)
+    return path.with_name(path.stem + suffix)
+
+
+def image_version(image_path) -> str:
+    """图片内容哈希（前16位），用作图片接口的 ETag 和地址中的版本号（?v=）"""
+    path = Path(image_path)
+    stat = path.stat()
+    key = str(path)
+    with _lock:
+        cached = _hashes.get(key)
+        if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            _hashes.move_to_end(key)
+            return cached[2]
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    version = digest.hexdigest()[:16]
+    with _lock:
+        _hashes[key] = (stat.st_mtime_ns, stat.st_size, version)
+        _hashes.move_to_end(key)
+        while len(_hashes) > _HASH_CACHE_SIZE:
+            _hashes.popitem(last=False)
+    return version
+
+
+def page_renditions(image_path) -> dict:
+    """原图版本号及已生成的各尺寸版本的路径和文件名，写入 session["generated_images"]（不存在的版本不写）"""
+    renditions = {"image_version": image_version(image_path)}
+    for name, suffix, _, _ in RENDITIONS:
+        path = rendition_path(image_path, suffix)
+        if path.exists():
+            renditions[f"{name}_path"] = str(path)
+            renditions[f"{name}_filename"] = path.name
+    return renditions
+
+
+# ============ 子进程中执行的编码 ============
+
+def _pixel_bytes(img: Image.Image) -> int:
+    return img.width * img.height * len(img.getbands())
+
+
+def _save_renditions(img: Image.Image, image_path: str):
+    """从RGB原图依次缩小出各尺寸版本（每一级从上一级缩小，减少计算量）"""
+    source = img
+    for _, suffix, width, quality in RENDITIONS:
+        height = max(1, round(source.height * width / source.width))
+        if width < source.width:
+            resized = source.resize((width, height), Image.LANCZOS)
+        else:
+            resized = source.copy()
+        resized.save(rendition_path(image_path, suffix), "WEBP", quality=quality, method=4)
+        if source is not img:
+            source.close()
+        source = resized
+    if source is not img:
+        source.close()
+
+
+def encode_renditions(image_bytes: bytes, image_path: str) -> int:
+    """
+    把生成的图片编码为原尺寸JPEG和各尺寸WebP（在进程池中执行）
+
+    返回: 编码过程中PIL像素缓冲的峰值字节数（计入渲染的内存统计）
+    """
+    img = Image.open(io.BytesIO(image_bytes))
+    img.load()
+    current = peak = _pixel_bytes(img)
+
+    # 转换为RGB（如果是RGBA，铺白色背景；只单独取出透明通道，不拆分全部波段）
+    if img.mode == 'RGBA':
+        alpha = img.getchannel('A')
+        converted = Image.new('RGB', img.size, (255, 255, 255))
+        converted.paste(img, mask=alpha)
+        peak = max(peak, current + _pixel_bytes(alpha) + _pixel_bytes(converted))
+    elif img.mode != 'RGB':
+        converted = img.convert('RGB')
+        peak = max(peak, current + _pixel_bytes(converted))
+    else:
+        converted = img
+    if converted is not img:
+        img.close()
+        img = converted
+
+    # 保存为JPEG格式，质量85%，文件大小约500KB-1MB
+    img.save(image_path, 'JPEG', quality=85, optimize=True)
+    _save_renditions(img, image_path)
+    return peak
+
+
+def encode_previews(image_path: str) -> int:
+    """从已有的原尺寸JPEG生成各尺寸WebP（渲染缓存命中时使用，在进程池中执行）"""
+    with Image.open(image_path) as img:
+        # JPEG 按目标尺寸的整数倍缩小解码，预览不需要完整解码4K图
+        img.draft('RGB', (PREVIEW_WIDTH, PREVIEW_WIDTH))
+        img = img.convert('RGB')
+        peak = _pixel_bytes(img)
+        _save_renditions(img, image_path)
+    return peak
+
+
+# ============ 进程池 ============
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: 子进程不继承父进程的线程和连接状态
+            _pool = ProcessPoolExecutor(max_workers=POSTPROCESS_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+            print(f"[图片后处理] 已创建进程池: {POSTPROCESS_WORKERS} 个进程")
+        return _pool
+
+
+async def run_postprocess(func: Callable, *args):
+    """在进程池中执行后处理函数；进程池不可用时退回线程池"""
+    global _pool
+    started = time.monotonic()
+    try:
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(_get_pool(), func, *args)
+            mode = "in_process_pool"
+        except (BrokenProcessPool, NotImplementedError, PermissionError) as e:
+            print(f"[图片后处理] 进程池不可用，改用线程执行: {e!r}")
+            with _pool_lock:
+                if isinstance(e, BrokenProcessPool):
+                    _pool = None  # 子进程异常退出，下次重新创建
+            result = await asyncio.to_thread(func, *args)
+            mode = "in_thread"
+    except Exception:
+        with _lock:
+            _stats["failures"] += 1
+        raise
+    with _lock:
+        _stats["tasks"] += 1
+        _stats[mode] += 1
+        _stats["seconds"] += time.monotonic() - started
+    return result
+
+
+def shutdown_postprocess_pool():
+    """关闭进程池（应用关闭时调用）"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def postprocess_stats() -> dict:
+    """后处理统计：任务数、执行方式、平均耗时"""
+    with _lock:
+        stats = dict(_stats)
+    stats["avg_seconds"] = round(stats.pop("seconds") / stats["tasks"], 3) if stats["tasks"] else None
+    return {"workers": POSTPROCESS_WORKERS, **stats}
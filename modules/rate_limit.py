@@ -0,0 +1,155 @@
+"""
+限流模块 - 按模型的令牌桶限流
+
+每个模型一个令牌桶（速率和突发容量见 config.RATE_LIMITS），每次调用接口前取一个令牌，
+令牌不足时排队等待（先到先得），而不是直接调用后收到429。
+
+RATE_LIMIT_BACKEND:
+- memory: 进程内令牌桶（默认，单进程）
+- sqlite: 令牌桶状态存放在 SQLite 文件中，同一台机器上的多个 worker 共享同一份配额
+"""
+
+import time
+import sqlite3
+import asyncio
+from typing import Dict, Optional
+
+from .config import RATE_LIMITS, RATE_LIMIT_BACKEND, RATE_LIMIT_DB_FILE
+
+
+class TokenBucket:
+    """进程内令牌桶"""
+
+    def __init__(self, name: str, rate_per_minute: float, capacity: float):
+        self.name = name
+        self.rate = rate_per_minute / 60.0  # 每秒补充的令牌数
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.time()
+        # 排队锁：等待者按到达顺序依次取令牌
+        self.queue_lock: Optional[asyncio.Lock] = None
+        self.waiting = 0
+        self.stats = {"acquired": 0, "delayed": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0}
+
+    def _take(self) -> float:
+        """尝试取一个令牌：成功返回0，否则返回还需等待的秒数"""
+        now = time.time()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    async def _take_async(self) -> float:
+        return self._take()
+
+    async def acquire(self) -> float:
+        """取一个令牌（不足时排队等待），返回等待的秒数"""
+        if self.queue_lock is None:
+            self.queue_lock = asyncio.Lock()
+        started = time.monotonic()
+        self.waiting += 1
+        try:
+            async with self.queue_lock:
+                while True:
+                    wait = await self._take_async()
+                    if wait <= 0:
+                        break
+                    await asyncio.sleep(wait)
+        finally:
+            self.waiting -= 1
+
+        waited = time.monotonic() - started
+        self.stats["acquired"] += 1
+        if waited > 0.05:
+            self.stats["delayed"] += 1
+            self.stats["wait_seconds"] += waited
+            self.stats["max_wait_seconds"] = max(self.stats["max_wait_seconds"], waited)
+            print(f"[限流] {self.name} 排队等待 {waited:.1f} 秒")
+        return waited
+
+    def snapshot(self) -> dict:
+        return {
+            "rate_per_minute": round(self.rate * 60, 2),
+            "capacity": self.capacity,
+            "tokens": round(min(self.capacity, self.tokens + (time.time() - self.updated_at) * self.rate), 2),
+            "waiting": self.waiting,
+            **self.stats,
+            "wait_seconds": round(self.stats["wait_seconds"], 2),
+            "max_wait_seconds": round(self.stats["max_wait_seconds"], 2)
+        }
+
+
+class SqliteTokenBucket(TokenBucket):
+    """多进程共享的令牌桶：每次取令牌在 SQLite 事务中读取并更新桶状态"""
+
+    def __init__(self, name: str, rate_per_minute: float, capacity: float, db_file):
+        super().__init__(name, rate_per_minute, capacity)
+        self.db_file = db_file
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)")
+                conn.execute("INSERT OR IGNORE INTO buckets (name, tokens, updated_at) VALUES (?, ?, ?)", (name, capacity, time.time()))
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_file, timeout=10, isolation_level=None)
+
+    def _take(self) -> float:
+        conn = self._connect()
+        try:
+            # BEGIN IMMEDIATE 取得写锁，保证读取-更新之间没有其他进程插入
+            conn.execute("BEGIN IMMEDIATE")
+            tokens, updated_at = conn.execute("SELECT tokens, updated_at FROM buckets WHERE name = ?", (self.name,)).fetchone()
+            now = time.time()
+            tokens = min(self.capacity, tokens + max(0.0, now - updated_at) * self.rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+            conn.execute("UPDATE buckets SET tokens = ?, updated_at = ? WHERE name = ?", (tokens, now, self.name))
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        self.tokens, self.updated_at = tokens, now
+        return wait
+
+    async def _take_async(self) -> float:
+        return await asyncio.to_thread(self._take)
+
+
+def _create_buckets() -> Dict[str, TokenBucket]:
+    buckets = {}
+    for model, (rate_per_minute, capacity) in RATE_LIMITS.items():
+        if rate_per_minute <= 0:
+            continue  # 速率为0表示不限流
+        if RATE_LIMIT_BACKEND == "sqlite":
+            buckets[model] = SqliteTokenBucket(model, rate_per_minute, capacity, RATE_LIMIT_DB_FILE)
+        else:
+            buckets[model] = TokenBucket(model, rate_per_minute, capacity)
+    return buckets
+
+
+_buckets: Dict[str, TokenBucket] = _create_buckets()
+
+
+async def acquire_rate_limit(model: str) -> float:
+    """调用模型接口前取令牌（未配置限流的模型直接返回），返回排队等待的秒数"""
+    bucket = _buckets.get(model)
+    if bucket is None:
+        return 0.0
+    return await bucket.acquire()
+
+
+def rate_limit_stats() -> dict:
+    """各模型令牌桶的状态"""
+    return {"backend": RATE_LIMIT_BACKEND, "buckets": {model: bucket.snapshot() for model, bucket in _buckets.items()}}
@@ -0,0 +1,268 @@
+"""
+页面渲染模块 - PPT页面的并发渲染调度
+
+所有图片生成都要先拿到渲染名额：单个会话最多 RENDER_CONCURRENCY_PER_SESSION 页，避免一个大PPT占满所有名额。
+全进程的图片请求并发由图片模型的自适应并发上限控制（见 concurrency，最多 IMAGE_MODEL_MAX_CONCURRENCY），
+这里不再另设全局上限，否则自适应上限超过它的部分永远用不上。
+
+每次页面渲染（包括排队等待名额的）都按会话登记，cancel_renders 可以取消会话所有进行中和排队中的渲染，
+取消会一直传递到图片接口的HTTP请求，不用等它超时。登记只在本进程内，多 worker 部署需要按会话保持。
+同一会话同一页相同提示词的渲染进行中时，重复的渲染请求等待其结果（page_flight_key）。
+"""
+
+import asyncio
+import weakref
+from pathlib import Path
+from contextlib import asynccontextmanager
+from typing import Awaitable, Dict, Optional, Callable, Set, TypeVar
+
+from .config import OUTPUT_DIR, RENDER_CONCURRENCY_PER_SESSION
+from .gemini_api import generate_ppt_image
+from .hedging import HedgeBudget
+from .single_flight import flight_key, single_flight
+from .postprocess import page_renditions
+from .session import SessionStage, update_session_async, add_message_async, next_version, mark_changed
+
+
+RENDER_MODES = ("parallel", "serial")
+
+T = TypeVar("T")
+
+
+# ============ 渲染名额 ============
+
+# 会话级信号量：没有任务引用时自动回收
+_session_semaphores: "weakref.WeakValueDictionary[str, asyncio.Semaphore]" = weakref.WeakValueDictionary()
+
+
+def _get_session_semaphore(session_id: str) -> asyncio.Semaphore:
+    semaphore = _session_semaphores.get(session_id)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(RENDER_CONCURRENCY_PER_SESSION)
+        _session_semaphores[session_id] = semaphore
+    return semaphore
+
+
+@asynccontextmanager
+async def render_slot(session_id: str):
+    """获取一个会话渲染名额（全进程的并发由图片请求的自适应并发名额控制）"""
+    session_semaphore = _get_session_semaphore(session_id)
+    async with session_semaphore:
+        yield
+
+
+# ============ 渲染取消 ============
+
+class RenderCancelled(Exception):
+    """渲染被 cancel_renders 取消"""
+
+
+# 会话进行中和排队中的渲染 {session_id: {task}}
+_session_renders: Dict[str, Set[asyncio.Task]] = {}
+# 被 cancel_renders 取消的渲染（区分调用方自身被取消的情况）
+_cancelled_renders: "weakref.WeakSet[asyncio.Task]" = weakref.WeakSet()
+
+
+async def track_render(session_id: str, render: Awaitable[T]) -> T:
+    """在可取消的任务中执行会话的一次渲染；被 cancel_renders 取消时抛出 RenderCancelled"""
+    task = asyncio.ensure_future(render)
+    renders = _session_renders.setdefault(session_id, set())
+    renders.add(task)
+    try:
+        return await task
+    except asyncio.CancelledError:
+        if task in _cancelled_renders:
+            raise RenderCancelled()
+        raise
+    finally:
+        renders.discard(task)
+        if not renders and _session_renders.get(session_id) is renders:
+            del _session_renders[session_id]
+
+
+def cancel_renders(session_id: str, reason: str = "") -> int:
+    """取消会话所有进行中和排队中的页面渲染，返回取消的数量"""
+    renders = [task for task in _session_renders.get(session_id, ()) if not task.done()]
+    for task in renders:
+        _cancelled_renders.add(task)
+        task.cancel()
+    if renders:
+        print(f"[渲染调度] 会话{session_id} 已取消 {len(renders)} 个页面渲染{f'（{reason}）' if reason else ''}")
+    return len(renders)
+
+
+# ============ 页面渲染 ============
+
+def build_render_context(session: dict, force_regenerate: bool = False) -> dict:
+    """提取整套PPT共用的渲染参数（参考图、Logo、母版分析、是否跳过渲染缓存）"""
+    return {
+        "reference_image_path": session.get("reference_image_path"),
+        "custom_logo_path": session.get("custom_logo_path"),
+        "reference_type": session.get("reference_type", "reference"),
+        "template_analysis": session.get("template_analysis"),
+        "force_regenerate": force_regenerate,
+    }
+
+
+def build_page_tasks(session_id: str, session: dict) -> list[dict]:
+    """根据设计方案构建每一页的渲染任务"""
+    tasks = []
+    for i, page_style in enumerate(session.get("style_json", [])):
+        tasks.append({
+            "index": i,
+            "page": i + 1,
+            "theme": page_style.get("theme", ""),
+            "prompt": page_style.get("prompt", ""),
+            "output_path": str(OUTPUT_DIR / f"{session_id}_第{i + 1}页.jpg"),
+            "page_materials": session.get("page_materials", {}).get(str(i), []),
+        })
+    return tasks
+
+
+async def store_page_result(session_id: str, page_index: int, result: dict):
+    """把生成成功的页面写入 session["generated_images"] 的对应位置（含预览图、缩略图的路径）"""
+    def store(session: dict):
+        while len(session["generated_images"]) <= page_index:
+            session["generated_images"].append(None)
+        session["generated_images"][page_index] = {**result, "version": next_version(session)}
+        mark_changed(session, "generated_images")
+
+    await update_session_async(session_id, store)
+
+
+def page_flight_key(session_id: str, page_index: int, prompt: str, force_regenerate: bool = False) -> tuple:
+    """页面渲染的请求合并键（会话、页码、提示词）"""
+    return flight_key("page", session_id, page_index, prompt, force_regenerate)
+
+
+def _cancelled_result(task: dict) -> dict:
+    """被取消页面的结果结构"""
+    return {
+        "page": task["index"] + 1, "theme": task["theme"], "success": False, "cancelled": True,
+        "image_path": None, "filename": None, "retry_info": None, "error": "生成已取消"
+    }
+
+
+async def render_page(session_id: str, task: dict, context: dict, on_event: Optional[Callable[[dict], None]] = None, hedge_budget: Optional[HedgeBudget] = None) -> dict:
+    """
+    渲染单页，返回与 /api/image/generate-all 一致的结果结构
+
+    on_event: 进度回调，依次收到 page_start / page_retry 事件（结束事件由调用方根据结果发出）
+    hedge_budget: 整套PPT共用的对冲请求限额
+    被 cancel_renders 取消时返回 success=False、cancelled=True 的结果
+    """
+    i = task["index"]
+
+    if not task["prompt"]:
+        return {"page": i + 1, "success": False, "error": "没有生成提示词"}
+
+    if task["page_materials"]:
+        print(f"第{i+1}页有 {len(task['page_materials'])} 个素材")
+
+    def on_progress(progress: dict):
+        if on_event:
+            on_event({"type": "page_retry", "index": i, "page": i + 1, "attempt": progress["attempt"], "retry_info": progress["retry_info"]})
+
+    async def render() -> tuple[bool, str]:
+        async with render_slot(session_id):
+            if on_event:
+                on_event({"type": "page_start", "index": i, "page": i + 1, "theme": task["theme"]})
+            return await generate_ppt_image(
+                prompt=task["prompt"], output_path=Path(task["output_path"]),
+                reference_image_path=context["reference_image_path"],
+                custom_logo_path=context["custom_logo_path"],
+                reference_type=context["reference_type"],
+                template_analysis=context["template_analysis"],
+                page_materials=task["page_materials"],
+                on_progress=on_progress,
+                force_regenerate=context.get("force_regenerate", False),
+                hedge_budget=hedge_budget
+            )
+
+    key = page_flight_key(session_id, i, task["prompt"], context.get("force_regenerate", False))
+    try:
+        success, retry_info = await single_flight(key, lambda: track_render(session_id, render()))
+    except RenderCancelled:
+        return _cancelled_result(task)
+
+    return {
+        "page": i + 1, "theme": task["theme"], "success": success,
+        "image_path": task["output_path"] if success else None,
+        "filename": Path(task["output_path"]).name if success else None, "retry_info": retry_info,
+        **(page_renditions(task["output_path"]) if success else {})
+    }
+
+
+async def render_deck(session_id: str, session: dict, mode: str = "parallel", on_event: Optional[Callable[[dict], None]] = None, force_regenerate: bool = False) -> list[dict]:
+    """
+    渲染整套PPT
+
+    mode: parallel（受并发名额限制同时渲染）/ serial（逐页渲染）
+    force_regenerate: 跳过渲染结果缓存，所有页面重新生成
+    on_event: 进度回调，事件类型 page_start / page_retry / page_success / page_failed / page_cancelled
+    返回: 按页码排序的结果列表；成功的页面在完成时即写入session；
+          被取消时未完成的页面 cancelled=True（逐页模式下后续页面不再渲染）
+    """
+    context = build_render_context(session, force_regenerate)
+    tasks = build_page_tasks(session_id, session)
+    hedge_budget = HedgeBudget(len(tasks))
+
+    async def run(task: dict) -> dict:
+        result = await render_page(session_id, task, context, on_event=on_event, hedge_budget=hedge_budget)
+        if result["success"]:
+            await store_page_result(session_id, task["index"], result)
+        if on_event:
+            event_type = "page_success" if result["success"] else "page_cancelled" if result.get("cancelled") else "page_failed"
+            on_event({"type": event_type, "index": task["index"], **result})
+        return result
+
+    if mode == "serial":
+        results = []
+        for task in tasks:
+            if results and results[-1].get("cancelled"):
+                results.append(_cancelled_result(task))
+            else:
+                results.append(await run(task))
+        return results
+
+    # gather 按传入顺序返回，结果天然按页码排列
+    return list(await asyncio.gather(*(run(task) for task in tasks)))
+
+
+async def leave_generate_stage(session_id: str):
+    """
+    生成被取消后退出生成阶段：所有页面都已有图片时进入完成阶段，否则回到设计方案修改阶段
+
+    取消由修改大纲或设计方案引起时阶段已被改写，不再覆盖
+    """
+    def leave(session: dict):
+        if session["stage"] != SessionStage.GENERATE:
+            return
+        pages = len(session.get("style_json") or [])
+        images = session.get("generated_images") or []
+        all_done = pages > 0 and len(images) >= pages and all(images[:pages])
+        session["stage"] = SessionStage.COMPLETE if all_done else SessionStage.STYLE_REFINE
+        mark_changed(session, "stage")
+
+    await update_session_async(session_id, leave)
+
+
+async def finish_deck(session_id: str, results: list[dict]) -> dict:
+    """整套PPT渲染结束：更新阶段、写入完成消息，返回 /api/image/generate-all 的响应结构"""
+    all_retry_info = [f"第{r['page']}页: {r['retry_info']}" for r in results if r.get("retry_info")]
+
+    cancelled = sum(1 for r in results if r.get("cancelled"))
+    if cancelled:
+        # 被取消（大纲或设计方案已修改、用户主动取消）：退出生成阶段，可以继续修改或重新生成
+        await leave_generate_stage(session_id)
+        await add_message_async(session_id, "assistant", f"⏹️ 生成已取消（已完成{sum(1 for r in results if r['success'])}页，取消{cancelled}页）")
+        return {"success": False, "cancelled": True, "total": len(results), "results": results, "retry_info": all_retry_info if all_retry_info else None}
+
+    await update_session_async(session_id, stage=SessionStage.COMPLETE)
+
+    complete_msg = f"🎉 所有{len(results)}页PPT已生成完成！\n\n成功：{sum(1 for r in results if r['success'])}页\n失败：{sum(1 for r in results if not r['success'])}页\n\n您可以点击'下载PPT'按钮打包下载所有图片。"
+    if all_retry_info:
+        complete_msg = "⚠️ 生成过程中遇到接口不稳定：\n" + "\n".join(all_retry_info) + "\n\n" + complete_msg
+    await add_message_async(session_id, "assistant", complete_msg)
+
+    return {"success": True, "total": len(results), "results": results, "retry_info": all_retry_info if all_retry_info else None}
@@ -0,0 +1,122 @@
+"""
+渲染结果缓存模块 - 按生成输入内容寻址的PPT图片存储
+
+缓存键是图片生成请求体（提示词、Logo/参考图/素材的图片数据、母版分析、图片参数）的哈希，
+输入完全相同时直接复制上次生成的图片，不再调用图片模型。附件图片只取内容哈希参与计算
+（由图片编码缓存提供，见 image_cache），不对几MB的base64整体做序列化和哈希。
+图片存放在 RENDER_CACHE_DIR，总大小超过 RENDER_CACHE_MAX_BYTES 时删除最久未使用的；
+目录总大小在内存中累计估算，超出上限时才扫描目录清理。
+"""
+
+import os
+import json
+import base64
+import shutil
+import hashlib
+import threading
+from pathlib import Path
+
+from .config import RENDER_CACHE_DIR, RENDER_CACHE_MAX_BYTES
+from .image_cache import content_digest
+
+
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+# 缓存目录总大小的估计值（首次写入时扫描得到，之后按写入累加，清理时重新统计）
+_estimated_bytes = None
+
+
+def _part_key(part: dict) -> dict:
+    """附件图片只保留类型和内容哈希"""
+    inline = part.get("inline_data") or part.get("inlineData")
+    if inline is None:
+        return part
+    data = inline.get("data", "")
+    # 不在编码缓存中时解码后计算，与编码缓存的内容哈希（文件内容的sha256）一致
+    digest = content_digest(data) or hashlib.sha256(base64.b64decode(data)).hexdigest()
+    return {"inline_data": {"mime_type": inline.get("mime_type") or inline.get("mimeType"), "sha256": digest}}
+
+
+def render_cache_key(payload: dict) -> str:
+    """计算图片生成请求的缓存键（提示词、模型与图片参数、各附件的内容哈希）"""
+    summary = {
+        **payload,
+        "contents": [{**content, "parts": [_part_key(part) for part in content["parts"]]} for content in payload["contents"]]
+    }
+    data = json.dumps(summary, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+def _cache_path(key: str) -> Path:
+    return RENDER_CACHE_DIR / f"{key}.jpg"
+
+
+def load_rendered_image(key: str, output_path: Path) -> bool:
+    """命中缓存时把图片复制到 output_path，返回是否命中"""
+    cache_path = _cache_path(key)
+    try:
+        shutil.copyfile(cache_path, output_path)
+        # 更新修改时间，清理时按最久未使用的顺序删除
+        os.utime(cache_path)
+    except FileNotFoundError:
+        with _lock:
+            _stats["misses"] += 1
+        return False
+    with _lock:
+        _stats["hits"] += 1
+    return True
+
+
+def store_rendered_image(key: str, output_path: Path):
+    """把生成成功的图片存入缓存（复制而不是硬链接：output_path 之后可能被覆盖写入）"""
+    RENDER_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    cache_path = _cache_path(key)
+    tmp_path = cache_path.with_name(f"{cache_path.name}.{threading.get_ident()}.tmp")
+    global _estimated_bytes
+    try:
+        shutil.copyfile(output_path, tmp_path)
+        size = tmp_path.stat().st_size
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        print(f"[渲染缓存] 写入失败: {e}")
+        tmp_path.unlink(missing_ok=True)
+        return
+    with _lock:
+        _stats["stores"] += 1
+        if _estimated_bytes is not None:
+            _estimated_bytes += size  # 覆盖写入同一个键时会多算，只会让清理提前
+        need_prune = _estimated_bytes is None or _estimated_bytes > RENDER_CACHE_MAX_BYTES
+    if need_prune:
+        _prune()
+
+
+def _prune():
+    """总大小超出上限时删除最久未使用的图片，并重新统计目录总大小"""
+    global _estimated_bytes
+    files = []
+    for path in RENDER_CACHE_DIR.glob("*.jpg"):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        files.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in files)
+    evicted = 0
+    for _, size, path in sorted(files):
+        if total <= RENDER_CACHE_MAX_BYTES:
+            break
+        path.unlink(missing_ok=True)
+        total -= size
+        evicted += 1
+    with _lock:
+        _estimated_bytes = total
+        _stats["evictions"] += evicted
+    if evicted:
+        print(f"[渲染缓存] 已清理 {evicted} 张图片")
+
+
+def render_cache_stats() -> dict:
+    """缓存统计：命中/未命中/写入/清理次数"""
+    with _lock:
+        total = _stats["hits"] + _stats["misses"]
+        return {**_stats, "max_bytes": RENDER_CACHE_MAX_BYTES, "hit_rate": round(_stats["hits"] / total, 3) if total else None}
@@ -0,0 +1,179 @@
+"""
+重试策略模块 - Gemini 与讯飞接口共用的重试策略
+
+- 按状态码区分是否可重试：429/408/5xx 等临时错误重试，400/401/403 等请求错误直接失败
+- 指数退避 + 完全抖动（full jitter），避免大量会话同时失败后整齐地一起重试
+- 服务端返回 Retry-After 时按其等待
+- 每次调用有总时长预算（deadline），超出预算不再重试
+- 按策略统计调用次数、尝试次数与结果
+
+用法:
+    call = TEXT_RETRY_POLICY.begin()
+    for attempt in call.attempts():
+        ...发起请求，成功时 call.succeed() 并返回...
+        delay = call.retry_delay(retryable, retry_after)
+        if delay is None:
+            break
+        await asyncio.sleep(delay)
+    call.fail()
+"""
+
+import time
+import random
+import threading
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, Iterator, Optional
+
+from .config import (
+    MAX_RETRIES,
+    RETRY_BASE_DELAY,
+    RETRY_MAX_DELAY,
+    RETRY_AFTER_MAX,
+    TEXT_RETRY_DEADLINE,
+    IMAGE_RETRY_DEADLINE,
+    TEMPLATE_ANALYSIS_TIMEOUT,
+    ASR_RETRY_DEADLINE
+)
+
+
+# 可重试的HTTP状态码：超时、限流、服务端临时错误
+RETRYABLE_STATUS_CODES = {408, 425, 429, 500, 502, 503, 504}
+
+
+def is_retryable_status(status_code: int) -> bool:
+    return status_code in RETRYABLE_STATUS_CODES
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """解析 Retry-After 响应头（秒数或HTTP日期），无法解析返回None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class RetryPolicy:
+    """一类接口调用的重试策略及其统计"""
+
+    def __init__(self, name: str, max_attempts: int = MAX_RETRIES, base_delay: float = RETRY_BASE_DELAY,
+                 max_delay: float = RETRY_MAX_DELAY, deadline: Optional[float] = None):
+        self.name = name
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.lock = threading.Lock()
+        self.metrics = {
+            "calls": 0,
+            "attempts": 0,
+            "retries": 0,
+            "successes": 0,
+            "failures": 0,
+            "non_retryable": 0,  # 遇到不可重试的错误直接失败
+            "exhausted": 0,  # 用完尝试次数
+            "deadline_exceeded": 0,  # 超出总时长预算
+            "backoff_seconds": 0.0,
+            "status_codes": {}
+        }
+
+    def begin(self) -> "RetryCall":
+        """开始一次调用"""
+        self._count("calls")
+        return RetryCall(self)
+
+    def backoff(self, attempt: int) -> float:
+        """第 attempt 次尝试失败后的退避时间：在 [0, min(max_delay, base*2^(attempt-1))] 内随机"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def _count(self, key: str, amount=1):
+        with self.lock:
+            self.metrics[key] += amount
+
+    def stats(self) -> dict:
+        with self.lock:
+            metrics = dict(self.metrics, status_codes=dict(self.metrics["status_codes"]))
+        metrics["backoff_seconds"] = round(metrics["backoff_seconds"], 2)
+        return {"max_attempts": self.max_attempts, "deadline": self.deadline, **metrics}
+
+
+class RetryCall:
+    """一次调用的重试状态（尝试次数、时长预算）"""
+
+    def __init__(self, policy: RetryPolicy):
+        self.policy = policy
+        self.attempt = 0
+        self.started_at = time.monotonic()
+
+    def attempts(self) -> Iterator[int]:
+        """依次产生尝试序号（从1开始），由 retry_delay 返回None时调用方跳出"""
+        while True:
+            self.attempt += 1
+            self.policy._count("attempts")
+            if self.attempt > 1:
+                self.policy._count("retries")
+            yield self.attempt
+
+    def remaining(self, default: float) -> float:
+        """剩余时长预算（用于限制单次请求的超时），没有预算时返回 default"""
+        if self.policy.deadline is None:
+            return default
+        return max(1.0, min(default, self.policy.deadline - (time.monotonic() - self.started_at)))
+
+    def record_status(self, status_code: int):
+        with self.policy.lock:
+            codes = self.policy.metrics["status_codes"]
+            codes[str(status_code)] = codes.get(str(status_code), 0) + 1
+
+    def retry_delay(self, retryable: bool = True, retry_after: Optional[float] = None) -> Optional[float]:
+        """本次尝试失败后应等待的秒数；不应再重试时返回None"""
+        if not retryable:
+            self.policy._count("non_retryable")
+            return None
+        if self.attempt >= self.policy.max_attempts:
+            self.policy._count("exhausted")
+            return None
+
+        delay = self.policy.backoff(self.attempt)
+        if retry_after is not None:
+            # 按服务端要求等待，另加少量抖动错开各会话的重试时间
+            delay = min(retry_after, RETRY_AFTER_MAX) + random.uniform(0, self.policy.base_delay)
+
+        if self.policy.deadline is not None and time.monotonic() - self.started_at + delay >= self.policy.deadline:
+            self.policy._count("deadline_exceeded")
+            return None
+
+        self.policy._count("backoff_seconds", delay)
+        return delay
+
+    def succeed(self):
+        self.policy._count("successes")
+
+    def fail(self):
+        self.policy._count("failures")
+
+
+# ============ 各接口的重试策略 ============
+
+TEXT_RETRY_POLICY = RetryPolicy("gemini_text", deadline=TEXT_RETRY_DEADLINE)
+IMAGE_RETRY_POLICY = RetryPolicy("gemini_image", deadline=IMAGE_RETRY_DEADLINE)
+TEMPLATE_ANALYSIS_RETRY_POLICY = RetryPolicy("gemini_template_analysis", deadline=TEMPLATE_ANALYSIS_TIMEOUT)
+ASR_RETRY_POLICY = RetryPolicy("xfyun_asr", deadline=ASR_RETRY_DEADLINE)
+
+RETRY_POLICIES: Dict[str, RetryPolicy] = {
+    policy.name: policy for policy in (TEXT_RETRY_POLICY, IMAGE_RETRY_POLICY, TEMPLATE_ANALYSIS_RETRY_POLICY, ASR_RETRY_POLICY)
+}
+
+
+def retry_stats() -> dict:
+    """各重试策略的统计"""
+    return {name: policy.stats() for name, policy in RETRY_POLICIES.items()}
@@ -1,11 +1,55 @@
 """
 会话管理模块 - 会话状态和消息管理
+
+会话数据存放在可替换的存储后端中（SESSION_BACKEND）：
+- memory: 进程内字典（默认，单进程）
+- sqlite: 本地 SQLite 文件，多个 uvicorn worker 可共享，重启不丢失
+  （只共享会话数据：渲染取消、请求合并、母版分析等待仍在进程内，多 worker 部署需要按会话保持）
+异步接口使用 get_session_async / update_session_async / add_message_async，sqlite 后端的读写在线程中执行。
+
+所有写操作都通过 update_session 完成：读取最新状态 -> 修改 -> 按版本号写回，
+版本号不一致（被其他请求/进程抢先写入）时自动重读重试，避免互相覆盖。
+
+会话空闲超过 SESSION_IDLE_TTL 或总数超过 SESSION_MAX_COUNT（清理最久未使用的）时会被清理
+（创建新会话时，以及应用运行期间每 SESSION_EVICT_INTERVAL 秒一次）；
+只读接口使用 get_session(session_id, create=False)，不会为未知ID创建会话。
+
+每次写入版本号加一；session["field_versions"] 记录各字段最后变更时的版本，
+消息和生成的页面也各自带有写入时的版本，用于 session_delta 增量同步；
+会话被清理后重建（或 memory 后端重启）时版本号从0重新计数，session["epoch"] 随之变化，
+ETag 和增量同步的游标都带上 epoch，旧游标不会误配到新会话；
+有 WebSocket 订阅时，每次写入的增量会通过 events 模块推送。
+
+消息历史是固定长度的环形缓冲（MESSAGE_HISTORY_LIMIT）：超长的消息内容按内容哈希存入
+session["payloads"]，消息中只保留摘要和引用，相同内容只存一份。
 """
 
-from typing import Dict
+import json
+import time
+import asyncio
+import uuid
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Callable
 from datetime import datetime
 
+from .config import (
+    SESSION_BACKEND,
+    SESSION_DB_FILE,
+    SESSION_UPDATE_RETRIES,
+    SESSION_IDLE_TTL,
+    SESSION_MAX_COUNT,
+    SESSION_EVICT_INTERVAL,
+    MESSAGE_HISTORY_LIMIT,
+    MESSAGE_INLINE_MAX_CHARS,
+    MESSAGE_PREVIEW_CHARS,
+    MESSAGE_PAYLOAD_LIMIT,
+    MESSAGE_PAGE_SIZE
+)
 from .prompts import DEFAULT_DESIGN_PRINCIPLES
+from .events import publish, has_subscribers
 
 
 # ============ 会话状态枚举 ============
@@ -20,44 +64,448 @@ class SessionStage:
     COMPLETE = "complete"        # 完成
 
 
+# 未知会话的临时状态使用的 epoch：固定值，重复查询时 ETag 不变
+PLACEHOLDER_EPOCH = "none"
+
+
+class SessionConflictError(Exception):
+    """会话写入冲突（多次重试后仍被其他写入者抢先）"""
+
+
+def _new_session_state() -> dict:
+    """新会话的初始状态"""
+    return {
+        "version": 0,  # 每次写入递增
+        "epoch": uuid.uuid4().hex[:12],  # 会话实例标识，会话重建后变化
+        "field_versions": {},  # 各字段最后变更时的版本 {field: version}
+        "stage": SessionStage.INPUT,
+        "user_input": "",
+        "outline_text": "",
+        "outline_json": [],
+        "style_text": "",
+        "style_json": [],
+        "generated_images": [],
+        "reference_image_path": None,
+        "messages": [],  # 最近的消息 [{id, role, content, timestamp, payload_ref?, payload_size?}]
+        "message_seq": 0,  # 消息ID计数（只增不减）
+        "payloads": {},  # 按引用存放的长消息内容 {payload_ref: text}，按写入顺序排列
+        # 用户设置
+        "page_count": None,  # 页数限制
+        "page_instructions": "",  # 逐页说明
+        "design_principles": DEFAULT_DESIGN_PRINCIPLES,  # 设计原则
+        # 录音转写内容
+        "audio_transcript": "",  # 录音转写文本
+        # 支持性文档内容
+        "support_docs_text": "",  # 抽取的文档文本
+        "support_docs_files": [],  # 上传的文档列表 [{filename, path, text_length}]
+        # 页面素材
+        "page_materials": {},  # {page_index_str: [{type, path, filename, description}, ...]}
+    }
+
+
+# ============ 存储后端 ============
+
+class SessionStore:
+    """会话存储接口"""
+
+    # 读写是否有磁盘I/O（为True时协程接口在线程中调用）
+    blocking = False
+
+    def load(self, session_id: str) -> Optional[dict]:
+        """读取会话（不存在返回None）"""
+        raise NotImplementedError
+
+    def create(self, session_id: str, state: dict) -> dict:
+        """会话不存在时写入初始状态，返回存储中的会话"""
+        raise NotImplementedError
+
+    def save(self, session_id: str, session: dict):
+        """按版本号写回会话：存储中的版本与 session["version"] 不一致时抛出 SessionConflictError"""
+        raise NotImplementedError
+
+    def evict(self) -> int:
+        """清理空闲超时的会话，并按最久未使用的顺序清理到能容纳一个新会话，返回清理数量"""
+        raise NotImplementedError
+
+    def sizes(self) -> Dict[str, int]:
+        """每个会话序列化后的大致字节数 {session_id: bytes}"""
+        raise NotImplementedError
+
+
+class MemorySessionStore(SessionStore):
+    """进程内存储：读取返回的就是存储中的对象本身，按最近访问顺序排列（LRU）"""
+
+    def __init__(self, data: "OrderedDict[str, dict]"):
+        self.data = data
+        self.accessed: Dict[str, float] = {}
+        self.lock = threading.Lock()
+        self.evicted = 0
+
+    def load(self, session_id: str) -> Optional[dict]:
+        with self.lock:
+            session = self.data.get(session_id)
+            if session is not None:
+                self.data.move_to_end(session_id)
+                self.accessed[session_id] = time.time()
+            return session
+
+    def create(self, session_id: str, state: dict) -> dict:
+        self.evict()
+        with self.lock:
+            self.accessed[session_id] = time.time()
+            return self.data.setdefault(session_id, state)
+
+    def save(self, session_id: str, session: dict):
+        with self.lock:
+            stored = self.data.get(session_id)
+            if stored is not None and stored is not session and stored["version"] != session["version"]:
+                raise SessionConflictError(session_id)
+            session["version"] += 1
+            self.data[session_id] = session
+            self.data.move_to_end(session_id)
+            self.accessed[session_id] = time.time()
+
+    def evict(self) -> int:
+        evicted = 0
+        expire_before = time.time() - SESSION_IDLE_TTL
+        with self.lock:
+            # 按访问顺序从最旧的开始清理：先清空闲超时的，再清超出数量上限的
+            while self.data:
+                oldest_id = next(iter(self.data))
+                if self.accessed.get(oldest_id, 0) >= expire_before and len(self.data) < SESSION_MAX_COUNT:
+                    break
+                self.data.pop(oldest_id)
+                self.accessed.pop(oldest_id, None)
+                evicted += 1
+        if evicted:
+            self.evicted += evicted
+            print(f"[会话] 已清理 {evicted} 个会话，当前 {len(self.data)} 个")
+        return evicted
+
+    def sizes(self) -> Dict[str, int]:
+        with self.lock:
+            items = list(self.data.items())
+        return {session_id: len(json.dumps(session, ensure_ascii=False).encode("utf-8")) for session_id, session in items}
+
+
+class SqliteSessionStore(SessionStore):
+    """SQLite存储：多个进程共享同一个数据库文件，读取返回独立副本"""
+
+    blocking = True
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self.evicted = 0
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, data TEXT NOT NULL, version INTEGER NOT NULL, updated_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_updated ON sessions(updated_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_file, timeout=10)
+
+    @staticmethod
+    def _dumps(session: dict) -> str:
+        return json.dumps({k: v for k, v in session.items() if k != "version"}, ensure_ascii=False)
+
+    def load(self, session_id: str) -> Optional[dict]:
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT data, version FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        finally:
+            conn.close()
+        if not row:
+            return None
+        session = json.loads(row[0])
+        session["version"] = row[1]
+        return session
+
+    def create(self, session_id: str, state: dict) -> dict:
+        self.evict()
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT OR IGNORE INTO sessions (id, data, version, updated_at) VALUES (?, ?, ?, ?)",
+                    (session_id, self._dumps(state), state["version"], time.time())
+                )
+        finally:
+            conn.close()
+        return self.load(session_id)
+
+    def save(self, session_id: str, session: dict):
+        conn = self._connect()
+        try:
+            with conn:
+                cursor = conn.execute(
+                    "UPDATE sessions SET data = ?, version = version + 1, updated_at = ? WHERE id = ? AND version = ?",
+                    (self._dumps(session), time.time(), session_id, session["version"])
+                )
+                if cursor.rowcount == 0:
+                    exists = conn.execute("SELECT 1 FROM sessions WHERE id = ?", (session_id,)).fetchone()
+                    if exists:
+                        raise SessionConflictError(session_id)
+                    conn.execute(
+                        "INSERT INTO sessions (id, data, version, updated_at) VALUES (?, ?, ?, ?)",
+                        (session_id, self._dumps(session), session["version"] + 1, time.time())
+                    )
+        finally:
+            conn.close()
+        session["version"] += 1
+
+    def evict(self) -> int:
+        # SQLite 后端以最后写入时间作为活跃时间
+        conn = self._connect()
+        try:
+            with conn:
+                evicted = conn.execute("DELETE FROM sessions WHERE updated_at < ?", (time.time() - SESSION_IDLE_TTL,)).rowcount
+                evicted += conn.execute(
+                    "DELETE FROM sessions WHERE id IN (SELECT id FROM sessions ORDER BY updated_at DESC LIMIT -1 OFFSET ?)",
+                    (SESSION_MAX_COUNT - 1,)
+                ).rowcount
+        finally:
+            conn.close()
+        if evicted:
+            self.evicted += evicted
+            print(f"[会话] 已清理 {evicted} 个会话")
+        return evicted
+
+    def sizes(self) -> Dict[str, int]:
+        conn = self._connect()
+        try:
+            return dict(conn.execute("SELECT id, length(CAST(data AS BLOB)) FROM sessions").fetchall())
+        finally:
+            conn.close()
+
+
 # ============ 会话存储 ============
 
-sessions: Dict[str, dict] = {}
-
-
-def get_session(session_id: str) -> dict:
-    """获取或创建会话"""
-    if session_id not in sessions:
-        sessions[session_id] = {
-            "stage": SessionStage.INPUT,
-            "user_input": "",
-            "outline_text": "",
-            "outline_json": [],
-            "style_text": "",
-            "style_json": [],
-            "generated_images": [],
-            "reference_image_path": None,
-            "messages": [],
-            # 用户设置
-            "page_count": None,  # 页数限制
-            "page_instructions": "",  # 逐页说明
-            "design_principles": DEFAULT_DESIGN_PRINCIPLES,  # 设计原则
-            # 录音转写内容
-            "audio_transcript": "",  # 录音转写文本
-            # 支持性文档内容
-            "support_docs_text": "",  # 抽取的文档文本
-            "support_docs_files": [],  # 上传的文档列表 [{filename, path, text_length}]
-            # 页面素材
-            "page_materials": {},  # {page_index_str: [{type, path, filename, description}, ...]}
-        }
-    return sessions[session_id]
+# memory 后端的数据（保留模块级字典，兼容直接访问）
+sessions: "OrderedDict[str, dict]" = OrderedDict()
+
+
+def _create_store() -> SessionStore:
+    if SESSION_BACKEND == "sqlite":
+        print(f"[会话] 使用SQLite存储: {SESSION_DB_FILE}")
+        return SqliteSessionStore(SESSION_DB_FILE)
+    return MemorySessionStore(sessions)
+
+
+session_store: SessionStore = _create_store()
+
+
+def get_session(session_id: str, create: bool = True) -> dict:
+    """
+    获取会话；不存在时创建
+
+    create=False 用于只读接口：不存在时返回初始状态的临时副本（epoch 为 PLACEHOLDER_EPOCH），不写入存储
+    """
+    session = session_store.load(session_id)
+    if session is None:
+        if not create:
+            placeholder = _new_session_state()
+            placeholder["epoch"] = PLACEHOLDER_EPOCH
+            return placeholder
+        session = session_store.create(session_id, _new_session_state())
+    # 加入 epoch 之前创建的会话（sqlite 后端）：版本号未曾重置，使用固定值
+    session.setdefault("epoch", "0")
+    return session
+
+
+async def session_maintenance_loop():
+    """定期清理空闲超时的会话（应用启动时作为后台任务运行）；只在创建会话时清理的话，没有新会话时过期会话不会释放"""
+    while True:
+        await asyncio.sleep(SESSION_EVICT_INTERVAL)
+        try:
+            await asyncio.to_thread(session_store.evict)
+        except Exception as e:
+            print(f"[会话] 定期清理失败: {e}")
+
+
+def session_etag(session: dict) -> str:
+    """会话的 ETag（epoch + 版本号）"""
+    return f'"{session["epoch"]}-{session["version"]}"'
+
+
+def session_stats() -> dict:
+    """会话统计：存活数量、大致内存占用（按序列化后的字节数估算）、清理次数"""
+    sizes = session_store.sizes()
+    total_bytes = sum(sizes.values())
+    largest = sorted(sizes.items(), key=lambda item: item[1], reverse=True)[:10]
+    return {
+        "backend": SESSION_BACKEND,
+        "live_sessions": len(sizes),
+        "approx_total_bytes": total_bytes,
+        "approx_avg_bytes": total_bytes // len(sizes) if sizes else 0,
+        "largest_sessions": [{"session_id": session_id, "approx_bytes": size} for session_id, size in largest],
+        "evicted": session_store.evicted,
+        "max_sessions": SESSION_MAX_COUNT,
+        "idle_ttl_seconds": SESSION_IDLE_TTL
+    }
+
+
+def save_session(session_id: str, session: dict):
+    """写回会话（版本冲突时抛出 SessionConflictError）"""
+    session_store.save(session_id, session)
+
+
+def update_session(session_id: str, updater: Optional[Callable[[dict], None]] = None, **fields) -> dict:
+    """
+    修改并写回会话：先设置 fields，再调用 updater(session) 做复杂修改
+
+    版本冲突时基于最新状态重试（updater 可能被调用多次，不要在里面做有副作用的操作），
+    返回写入后的会话
+    """
+    for _ in range(SESSION_UPDATE_RETRIES):
+        session = get_session(session_id)
+        session.update(fields)
+        mark_changed(session, *fields)
+        if updater:
+            updater(session)
+        try:
+            save_session(session_id, session)
+        except SessionConflictError:
+            continue
+        if has_subscribers(session_id):
+            publish(session_id, session_event(session_id, session, session["version"] - 1))
+        return session
+    raise SessionConflictError(session_id)
+
+
+def next_version(session: dict) -> int:
+    """本次写入成功后会话的版本号（在 update_session 的 updater 中使用）"""
+    return session["version"] + 1
+
+
+def mark_changed(session: dict, *fields: str):
+    """记录字段在本次写入中发生了变更（updater 直接修改字段时需要调用）"""
+    field_versions = session.setdefault("field_versions", {})
+    for field in fields:
+        field_versions[field] = next_version(session)
+
+
+# ============ 消息历史 ============
+
+def _prune_payloads(session: dict):
+    """丢弃不再被消息引用的长内容，并把数量限制在 MESSAGE_PAYLOAD_LIMIT 以内"""
+    payloads = session.get("payloads", {})
+    referenced = {m["payload_ref"] for m in session["messages"] if m.get("payload_ref")}
+    for ref in [ref for ref in payloads if ref not in referenced]:
+        del payloads[ref]
+    while len(payloads) > MESSAGE_PAYLOAD_LIMIT:
+        del payloads[next(iter(payloads))]
 
 
 def add_message(session_id: str, role: str, content: str):
-    """添加消息到会话"""
-    session = get_session(session_id)
-    session["messages"].append({
-        "role": role,
-        "content": content,
-        "timestamp": datetime.now().isoformat()
-    })
+    """添加消息到会话（超长内容按引用存放，超出条数上限时丢弃最早的消息）"""
+    timestamp = datetime.now().isoformat()
+    payload_ref = hashlib.sha1(content.encode("utf-8")).hexdigest()[:16] if len(content) > MESSAGE_INLINE_MAX_CHARS else None
+
+    def append(session: dict):
+        session["message_seq"] = session.get("message_seq", len(session["messages"])) + 1
+        message = {"id": session["message_seq"], "version": next_version(session), "role": role, "content": content, "timestamp": timestamp}
+        if payload_ref:
+            payloads = session.setdefault("payloads", {})
+            # 重复内容移到末尾，避免被当作最早的内容丢弃
+            payloads.pop(payload_ref, None)
+            payloads[payload_ref] = content
+            message.update(content=content[:MESSAGE_PREVIEW_CHARS] + "…", payload_ref=payload_ref, payload_size=len(content))
+        session["messages"].append(message)
+        del session["messages"][:-MESSAGE_HISTORY_LIMIT]
+        _prune_payloads(session)
+        mark_changed(session, "messages")
+
+    update_session(session_id, append)
+
+
+def _expand_message(session: dict, message: dict) -> dict:
+    """把按引用存放的消息还原为完整内容（长内容已被丢弃时保留摘要并标记 truncated）"""
+    if not message.get("payload_ref"):
+        return message
+    payload = session.get("payloads", {}).get(message["payload_ref"])
+    if payload is None:
+        return {**message, "truncated": True}
+    return {**message, "content": payload}
+
+
+def list_messages(session: dict, before: Optional[int] = None, limit: int = MESSAGE_PAGE_SIZE, expand: bool = False) -> dict:
+    """
+    分页读取消息（从新到旧翻页，每页内按时间顺序排列）
+
+    before: 只返回ID小于该值的消息（上一页返回的 next_before）
+    expand: 是否还原按引用存放的完整内容
+    """
+    messages = session["messages"]
+    if before is not None:
+        messages = [m for m in messages if m.get("id", 0) < before]
+    page = messages[-limit:] if limit > 0 else []
+    has_more = len(messages) > len(page)
+    if expand:
+        page = [_expand_message(session, m) for m in page]
+    return {
+        "messages": page,
+        "total": len(session["messages"]),
+        "has_more": has_more,
+        "next_before": page[0].get("id") if has_more and page else None
+    }
+
+
+# ============ 协程接口 ============
+# 供异步接口使用：sqlite 后端的数据库读写和JSON序列化放到线程中执行，不阻塞事件循环；
+# memory 后端没有I/O，直接调用（读取返回的是存储中的对象本身，不能交给其他线程修改）
+
+async def get_session_async(session_id: str, create: bool = True) -> dict:
+    """get_session 的协程版本"""
+    if not session_store.blocking:
+        return get_session(session_id, create)
+    return await asyncio.to_thread(get_session, session_id, create)
+
+
+async def update_session_async(session_id: str, updater: Optional[Callable[[dict], None]] = None, **fields) -> dict:
+    """update_session 的协程版本（sqlite 后端的 updater 在线程中对会话副本执行）"""
+    if not session_store.blocking:
+        return update_session(session_id, updater, **fields)
+    return await asyncio.to_thread(lambda: update_session(session_id, updater, **fields))
+
+
+async def add_message_async(session_id: str, role: str, content: str):
+    """add_message 的协程版本"""
+    if not session_store.blocking:
+        return add_message(session_id, role, content)
+    await asyncio.to_thread(add_message, session_id, role, content)
+
+
+# ============ 增量同步 ============
+
+def session_delta(session: dict, since: int) -> dict:
+    """
+    返回版本 since 之后发生变更的内容
+
+    未变更的字段不出现在结果中；images 只包含变更的页面 [{index, ...}]，
+    messages 只包含新消息（精简形式，长内容需通过消息接口展开）
+    """
+    field_versions = session.get("field_versions", {})
+
+    def changed(field: str) -> bool:
+        return field_versions.get(field, 0) > since
+
+    delta = {"stage": session["stage"]}
+    if changed("outline_json"):
+        delta["outline"] = session["outline_json"]
+    if changed("style_json"):
+        delta["style"] = session["style_json"]
+    if changed("audio_transcript"):
+        delta["audio_transcript"] = session.get("audio_transcript", "")
+    delta["images"] = [
+        {"index": i, **image} for i, image in enumerate(session["generated_images"])
+        if image and image.get("version", 0) > since
+    ]
+    delta["messages"] = [m for m in session["messages"] if m.get("version", 0) > since]
+    return delta
+
+
+def session_event(session_id: str, session: dict, since: int) -> dict:
+    """构建推送给 WebSocket 的增量事件（字段与 /api/session/{id}?since= 的响应一致）"""
+    return {"type": "delta", "session_id": session_id, "epoch": session["epoch"], "version": session["version"], "since": since, "delta": True, **session_delta(session, since)}
@@ -0,0 +1,79 @@
+"""
+请求合并模块 - 相同的生成请求进行中时共用同一个结果（single-flight）
+
+双击按钮或前端重试时会发出两个完全相同的请求（同一会话、同一页、同一提示词），
+第二个请求不再调用模型，而是等待第一个请求的结果。
+共用的任务只在所有等待方都被取消后才取消；任务失败时所有等待方收到同一个异常。
+只合并同一进程内的请求。
+"""
+
+import json
+import asyncio
+import hashlib
+import threading
+from typing import Any, Awaitable, Callable, Dict, TypeVar
+
+
+T = TypeVar("T")
+
+_lock = threading.Lock()
+_stats = {"started": 0, "coalesced": 0}
+
+
+class _Flight:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+# 进行中的请求 {key: flight}
+_flights: Dict[tuple, _Flight] = {}
+
+
+def _count(key: str):
+    with _lock:
+        _stats[key] += 1
+
+
+def flight_key(kind: str, session_id: str, *parts: Any) -> tuple:
+    """请求合并的键：类型 + 会话 + 其余参数（提示词等）的哈希"""
+    digest = hashlib.sha256(json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+    return (kind, session_id, digest[:32])
+
+
+def _on_done(key: tuple, flight: _Flight):
+    if _flights.get(key) is flight:
+        del _flights[key]
+    # 取走异常，避免所有等待方都已取消时出现 "exception was never retrieved"
+    if not flight.task.cancelled():
+        flight.task.exception()
+
+
+async def single_flight(key: tuple, factory: Callable[[], Awaitable[T]]) -> T:
+    """相同 key 的请求进行中时等待其结果，否则调用 factory 发起新请求"""
+    flight = _flights.get(key)
+    if flight is None:
+        flight = _Flight(asyncio.ensure_future(factory()))
+        _flights[key] = flight
+        flight.task.add_done_callback(lambda t: _on_done(key, flight))
+        _count("started")
+    else:
+        _count("coalesced")
+        print(f"[请求合并] {key[0]} 会话{key[1]} 已有相同请求进行中，等待其结果")
+
+    flight.waiters += 1
+    try:
+        # shield: 某个等待方被取消时不影响其他等待方
+        return await asyncio.shield(flight.task)
+    except asyncio.CancelledError:
+        if flight.waiters == 1 and not flight.task.done():
+            flight.task.cancel()  # 最后一个等待方也取消了，不再需要结果
+        raise
+    finally:
+        flight.waiters -= 1
+
+
+def single_flight_stats() -> dict:
+    """请求合并统计：发起的请求数、被合并的重复请求数、进行中的请求数"""
+    with _lock:
+        return {"in_flight": len(_flights), **_stats}
@@ -0,0 +1,160 @@
+"""
+母版分析调度模块 - 后台执行母版分析并按图片内容缓存结果
+
+上传母版后在后台任务中调用 analyze_template_design，进度记录在会话中：
+    session["template_analysis_status"]: running / done / failed
+分析结果按母版图片的内容哈希保存在 TEMPLATE_ANALYSIS_CACHE_DIR，
+不同会话上传同一张母版时直接复用；同一张母版正在分析时共用同一个任务。
+生成图片前最多等待分析 TEMPLATE_ANALYSIS_WAIT_TIMEOUT 秒，超时后本次生成不带分析结果，分析在后台继续。
+分析任务只在启动它的进程内可等待；其他进程只能看到会话中的分析状态。
+"""
+
+import os
+import json
+import asyncio
+import hashlib
+import tempfile
+from pathlib import Path
+from typing import Dict, Optional
+
+from .config import TEMPLATE_ANALYSIS_CACHE_DIR, TEMPLATE_ANALYSIS_WAIT_TIMEOUT
+from .gemini_api import analyze_template_design
+from .session import get_session_async, update_session_async
+
+
+class AnalysisStatus:
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+
+# 进行中的分析任务 {图片哈希: task}
+_analysis_tasks: Dict[str, asyncio.Task] = {}
+# 会话级的等待任务（负责把结果写回会话）{session_id: task}
+_session_tasks: Dict[str, asyncio.Task] = {}
+
+
+# ============ 结果缓存 ============
+
+def _file_digest(image_path: str) -> str:
+    with open(image_path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _cache_path(digest: str) -> Path:
+    return TEMPLATE_ANALYSIS_CACHE_DIR / f"{digest}.json"
+
+
+def _load_cached_analysis(digest: str) -> Optional[dict]:
+    try:
+        with open(_cache_path(digest), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def _save_cached_analysis(digest: str, analysis: dict):
+    TEMPLATE_ANALYSIS_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    # 临时文件名唯一：多个进程同时分析同一母版时各写各的，再原子替换
+    fd, tmp_path = tempfile.mkstemp(dir=TEMPLATE_ANALYSIS_CACHE_DIR, prefix=f"{digest}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(analysis, f, ensure_ascii=False)
+        os.replace(tmp_path, _cache_path(digest))
+    except BaseException:
+        Path(tmp_path).unlink(missing_ok=True)
+        raise
+
+
+# ============ 分析调度 ============
+
+async def _analyze(digest: str, image_path: str) -> Optional[dict]:
+    """执行分析并写入缓存（同一哈希只执行一次）"""
+    try:
+        analysis = await analyze_template_design(image_path)
+        if analysis:
+            await asyncio.to_thread(_save_cached_analysis, digest, analysis)
+        return analysis
+    finally:
+        _analysis_tasks.pop(digest, None)
+
+
+async def _store_result(session_id: str, digest: str, analysis: Optional[dict]):
+    """把分析结果写回会话（会话已换了新母版时忽略）"""
+    def store(session: dict):
+        if session.get("template_analysis_hash") != digest:
+            return
+        if analysis:
+            session.update(template_analysis=analysis, template_analysis_status=AnalysisStatus.DONE, template_analysis_error=None)
+        else:
+            session.update(template_analysis_status=AnalysisStatus.FAILED, template_analysis_error="母版分析失败")
+
+    await update_session_async(session_id, store)
+
+
+async def _run_for_session(session_id: str, digest: str, image_path: str) -> Optional[dict]:
+    task = _analysis_tasks.get(digest)
+    if task is None:
+        task = asyncio.create_task(_analyze(digest, image_path))
+        _analysis_tasks[digest] = task
+    try:
+        # shield: 某个会话的等待被取消时不影响其他会话共用的分析任务
+        analysis = await asyncio.shield(task)
+    except Exception as e:
+        print(f"[母版分析] 分析任务异常: {e}")
+        analysis = None
+    await _store_result(session_id, digest, analysis)
+    return analysis
+
+
+async def start_template_analysis(session_id: str, image_path: str) -> Optional[asyncio.Task]:
+    """
+    为会话启动母版分析
+
+    命中缓存时直接写入会话并返回None；否则返回后台任务（结果为分析字典，失败为None）
+    """
+    digest = await asyncio.to_thread(_file_digest, image_path)
+    cached = await asyncio.to_thread(_load_cached_analysis, digest)
+    if cached:
+        print(f"[母版分析] 命中缓存: {digest[:12]}")
+        await update_session_async(
+            session_id, template_analysis=cached, template_analysis_hash=digest,
+            template_analysis_status=AnalysisStatus.DONE, template_analysis_error=None
+        )
+        return None
+
+    await update_session_async(
+        session_id, template_analysis=None, template_analysis_hash=digest,
+        template_analysis_status=AnalysisStatus.RUNNING, template_analysis_error=None
+    )
+    task = asyncio.create_task(_run_for_session(session_id, digest, image_path))
+    _session_tasks[session_id] = task
+    task.add_done_callback(lambda t: _session_tasks.pop(session_id, None) if _session_tasks.get(session_id) is t else None)
+    return task
+
+
+async def wait_template_analysis(session_id: str) -> bool:
+    """
+    等待会话正在进行的母版分析完成（生成图片前调用，尽量用上分析结果）
+
+    最多等待 TEMPLATE_ANALYSIS_WAIT_TIMEOUT 秒，超时后分析在后台继续，返回False（本次生成不带分析结果）
+    """
+    task = _session_tasks.get(session_id)
+    if task is None:
+        return True
+    try:
+        await asyncio.wait_for(asyncio.shield(task), TEMPLATE_ANALYSIS_WAIT_TIMEOUT)
+    except asyncio.TimeoutError:
+        print(f"[母版分析] 会话 {session_id} 的母版分析超过{TEMPLATE_ANALYSIS_WAIT_TIMEOUT:.0f}秒未完成，本次生成不使用分析结果")
+        return False
+    return True
+
+
+async def template_analysis_status(session_id: str) -> dict:
+    """查询会话的母版分析状态"""
+    session = await get_session_async(session_id, create=False)
+    return {
+        "status": session.get("template_analysis_status"),
+        "template_analysis": session.get("template_analysis"),
+        "error": session.get("template_analysis_error")
+    }
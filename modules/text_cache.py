@@ -0,0 +1,113 @@
+"""
+文本生成缓存模块 - generate_text 结果的磁盘缓存（默认关闭，TEXT_CACHE_ENABLED=1 开启）
+
+相同的模型、提示词和思考等级直接返回上次的生成结果，避免重复调用。
+缓存存放在 SQLite 文件中，多个进程共享（读写是同步的，异步代码中通过 asyncio.to_thread 调用）；超过 TEXT_CACHE_TTL 的条目失效，
+总大小超过 TEXT_CACHE_MAX_BYTES 时清理最久未使用的条目。
+"""
+
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Optional
+from contextlib import contextmanager
+
+from .config import TEXT_CACHE_ENABLED, TEXT_CACHE_DB_FILE, TEXT_CACHE_TTL, TEXT_CACHE_MAX_BYTES
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS text_cache (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    thinking_level TEXT NOT NULL,
+    text TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_text_cache_accessed ON text_cache(accessed_at);
+"""
+
+_initialized = False
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "writes": 0}
+
+
+@contextmanager
+def _connect():
+    """打开数据库连接（首次使用时建表，事务在退出时提交）"""
+    global _initialized
+    conn = sqlite3.connect(TEXT_CACHE_DB_FILE, timeout=10)
+    try:
+        with conn:
+            if not _initialized:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript(_SCHEMA)
+                _initialized = True
+            yield conn
+    finally:
+        conn.close()
+
+
+def text_cache_key(model: str, prompt: str, thinking_level: str) -> str:
+    """缓存键：模型 + 思考等级 + 提示词哈希"""
+    prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+    return f"{model}:{thinking_level}:{prompt_hash}"
+
+
+def get_cached_text(model: str, prompt: str, thinking_level: str) -> Optional[tuple[str, float]]:
+    """读取缓存，返回 (文本, 生成时间)；未开启、未命中或已过期返回None"""
+    if not TEXT_CACHE_ENABLED:
+        return None
+    key = text_cache_key(model, prompt, thinking_level)
+    now = time.time()
+    with _connect() as conn:
+        row = conn.execute("SELECT text, created_at FROM text_cache WHERE key = ? AND created_at >= ?", (key, now - TEXT_CACHE_TTL)).fetchone()
+        if row:
+            conn.execute("UPDATE text_cache SET accessed_at = ? WHERE key = ?", (now, key))
+    with _lock:
+        _stats["hits" if row else "misses"] += 1
+    return (row[0], row[1]) if row else None
+
+
+def set_cached_text(model: str, prompt: str, thinking_level: str, text: str):
+    """写入缓存（覆盖旧结果），并清理过期和超出容量的条目"""
+    if not TEXT_CACHE_ENABLED or not text:
+        return
+    key = text_cache_key(model, prompt, thinking_level)
+    now = time.time()
+    size = len(text.encode("utf-8"))
+    with _connect() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO text_cache (key, model, thinking_level, text, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (key, model, thinking_level, text, size, now, now)
+        )
+        conn.execute("DELETE FROM text_cache WHERE created_at < ?", (now - TEXT_CACHE_TTL,))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM text_cache").fetchone()[0]
+        if total > TEXT_CACHE_MAX_BYTES:
+            # 从最久未使用的开始删除，直到总大小回到上限以内
+            for old_key, old_size in conn.execute("SELECT key, size FROM text_cache ORDER BY accessed_at").fetchall():
+                if total <= TEXT_CACHE_MAX_BYTES:
+                    break
+                conn.execute("DELETE FROM text_cache WHERE key = ?", (old_key,))
+                total -= old_size
+    with _lock:
+        _stats["writes"] += 1
+
+
+def discard_cached_text(model: str, prompt: str, thinking_level: str):
+    """删除一条缓存（例如缓存的结果无法解析时）"""
+    if not TEXT_CACHE_ENABLED:
+        return
+    with _connect() as conn:
+        conn.execute("DELETE FROM text_cache WHERE key = ?", (text_cache_key(model, prompt, thinking_level),))
+
+
+def text_cache_stats() -> dict:
+    """缓存统计：本进程的命中/未命中/写入次数，以及缓存条目数和总大小"""
+    if not TEXT_CACHE_ENABLED:
+        return {"enabled": False}
+    with _connect() as conn:
+        entries, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM text_cache").fetchone()
+    return {"enabled": True, **_stats, "entries": entries, "bytes": total, "max_bytes": TEXT_CACHE_MAX_BYTES, "ttl_seconds": TEXT_CACHE_TTL}
@@ -14,15 +14,21 @@ PPT智能生成器 - 后端API服务
 
 import os
 import re
+import json
 import time
+import asyncio
 import zipfile
+from contextlib import asynccontextmanager
 from pathlib import Path
 from datetime import datetime
+from email.utils import formatdate, parsedate_to_datetime
 from typing import Optional
+from urllib.parse import quote
 
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Request, Response, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import FileResponse, StreamingResponse, JSONResponse
 from fastapi.staticfiles import StaticFiles
 from PIL import Image
 
@@ -36,7 +42,14 @@ from modules.config import (
     MATERIALS_DIR,
     SUPPORT_DOCS_DIR,
     FRONTEND_BUILD_DIR,
-    LOGIN_RECORDS_FILE
+    LOGIN_RECORDS_FILE,
+    SSE_HEARTBEAT_INTERVAL,
+    MESSAGE_PAGE_SIZE,
+    GZIP_MINIMUM_SIZE,
+    WS_POLL_INTERVAL,
+    IMAGE_VARIANT_WIDTHS,
+    IMAGE_CACHE_MAX_AGE,
+    IMAGE_ACCEL_REDIRECT_PREFIX
 )
 from modules.prompts import (
     OUTLINE_PROMPT_TEMPLATE,
@@ -65,22 +78,78 @@ from modules.invite_codes import (
     record_login,
     get_login_records_from_csv
 )
-from modules.session import SessionStage, get_session, add_message
+from modules.session import (
+    SessionStage,
+    SessionConflictError,
+    get_session_async,
+    update_session_async,
+    add_message_async,
+    list_messages,
+    session_stats,
+    mark_changed,
+    session_delta,
+    session_event,
+    session_etag,
+    session_maintenance_loop
+)
 from modules.gemini_api import (
     parse_json_from_text,
     generate_text,
-    generate_ppt_image,
-    analyze_template_design
+    discard_generated_text,
+    generate_ppt_image
+)
+from modules.render import RENDER_MODES, RenderCancelled, render_slot, render_deck, finish_deck, store_page_result, track_render, cancel_renders, page_flight_key
+from modules.single_flight import flight_key, single_flight, single_flight_stats
+from modules.jobs import (
+    get_job,
+    list_jobs,
+    job_summary,
+    find_or_create_job,
+    start_job,
+    cancel_job,
+    start_job_workers,
+    shutdown_jobs
 )
+from modules.http_client import init_http_client, close_http_client
+from modules.events import subscribe, unsubscribe, subscriber_stats
+from modules.image_cache import image_cache_stats
+from modules.text_cache import text_cache_stats
+from modules.render_cache import render_cache_stats
+from modules.retry import retry_stats
+from modules.rate_limit import rate_limit_stats
+from modules.concurrency import concurrency_stats
+from modules.circuit_breaker import CircuitState, circuit_breaker_stats
+from modules.hedging import hedge_stats
+from modules.image_decode import image_decode_stats
+from modules.postprocess import page_renditions, image_version, shutdown_postprocess_pool, postprocess_stats
+from modules.image_variants import IMAGE_FORMATS, media_type, variant_width, get_image_variant, image_variant_stats
+from modules.image_index import build_image_index, lookup_image, unregister_image, image_index_stats
+from modules.template_analysis import AnalysisStatus, start_template_analysis, wait_template_analysis, template_analysis_status
 from modules.visit_counter import get_visit_count, increment_visit_count
 from modules.doc_extract import extract_text_from_document, extract_table_from_file
 
 # ============ FastAPI应用 ============
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期：启动时创建共享连接池、续跑未完成的任务并开始定期清理会话，关闭时释放"""
+    init_http_client()
+    await asyncio.to_thread(build_image_index)
+    await start_job_workers()
+    session_maintenance = asyncio.create_task(session_maintenance_loop())
+    yield
+    session_maintenance.cancel()
+    await asyncio.gather(session_maintenance, return_exceptions=True)
+    await shutdown_jobs()
+    await close_http_client()
+    shutdown_postprocess_pool()
+
+
 app = FastAPI(
     title="PPT智能生成器API",
     description="基于Gemini的PPT智能生成服务",
-    version="2.0.0"
+    version="2.0.0",
+    lifespan=lifespan
 )
 
 # CORS配置
@@ -91,18 +160,36 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# 压缩较大的JSON响应；SSE（text/event-stream，starlette>=0.46）和图片/ZIP等类型不会被压缩
+app.add_middleware(GZipMiddleware, minimum_size=GZIP_MINIMUM_SIZE)
+
+
+@app.exception_handler(SessionConflictError)
+async def session_conflict_handler(request: Request, exc: SessionConflictError):
+    """会话被并发修改且重试后仍冲突"""
+    return JSONResponse(status_code=409, content={"success": False, "message": "会话正在被其他请求修改，请稍后重试"})
 
 # ============ 健康检查和默认配置 ============
 
 @app.get("/api/health")
 async def root():
+    breakers = circuit_breaker_stats()
     return {
         "message": "PPT智能生成器API服务正在运行",
         "version": "2.0.0",
-        "docs": "/docs"
+        "docs": "/docs",
+        # 有模型接口熔断时为 degraded
+        "status": "degraded" if any(b["state"] != CircuitState.CLOSED for b in breakers.values()) else "ok",
+        "circuit_breakers": breakers
     }
 
 
+@app.get("/api/stats")
+async def get_stats():
+    """运行状态统计（会话数量与内存占用、推送连接、各类缓存、接口重试、限流、自适应并发上限、对冲与合并的请求、图片解码内存峰值与后处理等）"""
+    return {"sessions": session_stats(), "websocket": subscriber_stats(), "image_cache": image_cache_stats(), "text_cache": text_cache_stats(), "render_cache": render_cache_stats(), "retry": retry_stats(), "rate_limit": rate_limit_stats(), "concurrency": concurrency_stats(), "hedging": hedge_stats(), "single_flight": single_flight_stats(), "image_decode": image_decode_stats(), "postprocess": postprocess_stats(), "image_variants": image_variant_stats(), "image_index": image_index_stats()}
+
+
 @app.get("/api/defaults")
 async def get_defaults():
     """获取默认配置"""
@@ -152,20 +239,125 @@ async def download_login_records():
 # ============ 会话管理 ============
 
 @app.get("/api/session/{session_id}")
-async def get_session_info(session_id: str):
-    """获取会话信息"""
-    session = get_session(session_id)
+async def get_session_info(session_id: str, request: Request, response: Response, since: Optional[int] = None, epoch: Optional[str] = None):
+    """
+    获取会话信息
+
+    响应带有 ETag（会话 epoch + 版本号），请求头 If-None-Match 与之相同时返回304；
+    since + epoch: 客户端已有的版本号和上次响应中的 epoch，传入时只返回该版本之后变更的内容
+    """
+    session = await get_session_async(session_id, create=False)
+    etag = session_etag(session)
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+
+    # epoch 不一致（会话已被清理重建、服务重启）或版本号比当前还新时返回全量
+    if since is not None and epoch == session["epoch"] and since <= session["version"]:
+        return {"session_id": session_id, "epoch": session["epoch"], "version": session["version"], "since": since, "delta": True, **session_delta(session, since)}
+
+    # 只返回最近一页的精简消息，完整历史通过 /api/session/{session_id}/messages 分页获取
+    history = list_messages(session)
     return {
         "session_id": session_id,
+        "epoch": session["epoch"],
+        "version": session["version"],
+        "delta": False,
         "stage": session["stage"],
         "outline": session["outline_json"],
         "style": session["style_json"],
         "images": session["generated_images"],
-        "messages": session["messages"],
+        "messages": history["messages"],
+        "messages_total": history["total"],
         "audio_transcript": session.get("audio_transcript", "")
     }
 
 
+@app.get("/api/session/{session_id}/messages")
+async def get_session_messages(session_id: str, before: Optional[int] = None, limit: int = MESSAGE_PAGE_SIZE, expand: bool = False):
+    """
+    分页获取会话消息
+
+    before: 上一页返回的 next_before，不传则返回最新一页
+    expand: 是否返回长消息的完整内容（默认只返回摘要和 payload_ref）
+    """
+    if limit < 1 or limit > 200:
+        raise HTTPException(status_code=400, detail="limit 必须在1~200之间")
+    session = await get_session_async(session_id, create=False)
+    return {"success": True, **list_messages(session, before=before, limit=limit, expand=expand)}
+
+
+@app.post("/api/session/{session_id}/cancel")
+async def cancel_session_generation(session_id: str):
+    """取消会话所有进行中和排队中的页面渲染（包括后台任务中的页面）"""
+    cancelled = cancel_renders(session_id, "用户取消")
+    return {"success": True, "cancelled": cancelled, "message": f"已取消{cancelled}个页面的生成" if cancelled else "没有进行中的生成"}
+
+
+@app.websocket("/ws/session/{session_id}")
+async def session_websocket(websocket: WebSocket, session_id: str, since: int = 0, epoch: Optional[str] = None):
+    """
+    会话变更推送
+
+    连接后先推送 since 之后的增量（epoch 与会话不一致时从头推送），之后每次会话写入都推送一条 delta 事件
+    （格式与 /api/session/{session_id}?since= 的响应一致，另带 type 字段）。
+    版本号不连续（事件丢失、其他进程写入）时按已推送的版本重新计算增量；会话被清理重建时从头推送；
+    空闲时发送 heartbeat。
+    """
+    await websocket.accept()
+    queue = subscribe(session_id)
+
+    async def wait_disconnect():
+        # 客户端不需要发送消息，这里只用来感知断开
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+
+    receiver = asyncio.create_task(wait_disconnect())
+    last_version = since
+    last_sent = time.time()
+    try:
+        session = await get_session_async(session_id, create=False)
+        current_epoch = session["epoch"]
+        if epoch != current_epoch or last_version > session["version"]:
+            # 客户端的游标属于已被清理的会话（或服务已重启），从头推送
+            last_version = 0
+        if session["version"] > last_version:
+            await websocket.send_json(session_event(session_id, session, last_version))
+            last_version = session["version"]
+
+        while not receiver.done():
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=WS_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                event = None
+
+            if event is not None and event.get("epoch") != current_epoch:
+                event = None  # 会话已被清理重建，按最新状态重新计算
+            if event is None or event["version"] != last_version + 1:
+                if event is not None and event["version"] <= last_version:
+                    continue
+                session = await get_session_async(session_id, create=False)
+                if session["epoch"] != current_epoch:
+                    current_epoch, last_version = session["epoch"], 0
+                if session["version"] > last_version:
+                    event = session_event(session_id, session, last_version)
+                elif time.time() - last_sent >= SSE_HEARTBEAT_INTERVAL:
+                    event = {"type": "heartbeat", "version": last_version}
+                else:
+                    continue
+
+            await websocket.send_json(event)
+            last_version = max(last_version, event["version"])
+            last_sent = time.time()
+    except (WebSocketDisconnect, RuntimeError, OSError):
+        pass  # 客户端已断开（发送途中断开时 ASGI 服务器可能抛出 RuntimeError/OSError）
+    finally:
+        unsubscribe(session_id, queue)
+        receiver.cancel()
+        # 等待接收任务结束并取走其异常（客户端关闭后仍发送数据时 receive 会抛出），本协程被取消时照常传出
+        await asyncio.gather(receiver, return_exceptions=True)
+
+
 # ============ 录音上传和ASR转写 ============
 
 @app.post("/api/audio/upload")
@@ -175,7 +367,6 @@ async def upload_audio(
     file: UploadFile = File(...)
 ):
     """上传录音文件并进行ASR转写"""
-    session = get_session(session_id)
     file_ext = Path(file.filename).suffix or '.mp3'
     audio_path = AUDIO_DIR / f"{session_id}_audio{file_ext}"
 
@@ -188,13 +379,14 @@ async def upload_audio(
 
     try:
         asr = XfyunASR(appid=XFYUN_APPID, secret_key=XFYUN_SECRET_KEY, upload_file_path=str(audio_path))
-        result = asr.get_result(num_speaker)
+        # 讯飞接口是同步调用（含轮询和重试等待），放到线程池中执行，避免阻塞事件循环
+        result = await asyncio.to_thread(asr.get_result, num_speaker)
         dialogue_list = parse_xfyun_result(result)
 
         if dialogue_list:
             transcript_text = format_dialogue_as_text(dialogue_list)
-            session["audio_transcript"] = transcript_text
-            add_message(session_id, "assistant", f"✅ 录音转写完成！\n\n{transcript_text}")
+            await update_session_async(session_id, audio_transcript=transcript_text)
+            await add_message_async(session_id, "assistant", f"✅ 录音转写完成！\n\n{transcript_text}")
             return {"success": True, "message": "录音转写完成", "transcript": transcript_text, "dialogue_count": len(dialogue_list)}
         else:
             return {"success": False, "message": "转写结果为空，请检查音频文件", "transcript": ""}
@@ -206,7 +398,7 @@ async def upload_audio(
 @app.get("/api/audio/transcript/{session_id}")
 async def get_audio_transcript(session_id: str):
     """获取录音转写内容"""
-    session = get_session(session_id)
+    session = await get_session_async(session_id, create=False)
     return {"success": True, "transcript": session.get("audio_transcript", "")}
 
 
@@ -221,7 +413,7 @@ async def upload_support_document(
     上传支持性文档并抽取文本
     支持：PDF、Word、PPT、Excel、TXT
     """
-    session = get_session(session_id)
+    session = await get_session_async(session_id)
     
     # 检查文件类型
     allowed_extensions = ['.pdf', '.docx', '.doc', '.pptx', '.ppt', '.xlsx', '.xls', '.txt']
@@ -256,19 +448,22 @@ async def upload_support_document(
         extracted_text = extracted_text[:10000] + "\n...(内容过长，已截取前10000字)"
     
     # 保存到session
-    session["support_docs_files"].append({
-        "filename": file.filename,
-        "path": str(file_path),
-        "text_length": len(extracted_text)
-    })
-    
-    # 累加文本
-    if session["support_docs_text"]:
-        session["support_docs_text"] += f"\n\n--- {file.filename} ---\n{extracted_text}"
-    else:
-        session["support_docs_text"] = f"--- {file.filename} ---\n{extracted_text}"
+    def add_document(session: dict):
+        session["support_docs_files"].append({
+            "filename": file.filename,
+            "path": str(file_path),
+            "text_length": len(extracted_text)
+        })
+        
+        # 累加文本
+        if session["support_docs_text"]:
+            session["support_docs_text"] += f"\n\n--- {file.filename} ---\n{extracted_text}"
+        else:
+            session["support_docs_text"] = f"--- {file.filename} ---\n{extracted_text}"
+
+    await update_session_async(session_id, add_document)
     
-    add_message(session_id, "assistant", f"✅ 文档 \"{file.filename}\" 已上传并抽取文本（{len(extracted_text)}字）")
+    await add_message_async(session_id, "assistant", f"✅ 文档 \"{file.filename}\" 已上传并抽取文本（{len(extracted_text)}字）")
     
     return {
         "success": True,
@@ -282,9 +477,7 @@ async def upload_support_document(
 @app.delete("/api/support-doc/clear")
 async def clear_support_documents(session_id: str):
     """清除所有支持性文档"""
-    session = get_session(session_id)
-    session["support_docs_text"] = ""
-    session["support_docs_files"] = []
+    await update_session_async(session_id, support_docs_text="", support_docs_files=[])
     
     return {"success": True, "message": "已清除所有支持性文档"}
 
@@ -292,7 +485,7 @@ async def clear_support_documents(session_id: str):
 @app.get("/api/support-doc/list/{session_id}")
 async def list_support_documents(session_id: str):
     """获取已上传的支持性文档列表"""
-    session = get_session(session_id)
+    session = await get_session_async(session_id, create=False)
     return {
         "success": True,
         "files": session.get("support_docs_files", []),
@@ -313,7 +506,7 @@ async def upload_page_material(
     上传页面素材（图片或Excel表格）
     这些素材会直接参与对应页面的PPT图片生成
     """
-    session = get_session(session_id)
+    session = await get_session_async(session_id)
     
     # 检查文件类型（支持图片和Excel）
     image_extensions = ['.png', '.jpg', '.jpeg', '.gif', '.webp']
@@ -354,14 +547,6 @@ async def upload_page_material(
         # 抽取表格内容为文本
         table_text = extract_table_from_file(str(material_path), file.filename)
     
-    # 存入session
-    if "page_materials" not in session:
-        session["page_materials"] = {}
-    
-    page_key = str(page_index)
-    if page_key not in session["page_materials"]:
-        session["page_materials"][page_key] = []
-    
     material_data = {
         "filename": file.filename,
         "path": str(material_path),
@@ -371,11 +556,13 @@ async def upload_page_material(
     if table_text:
         material_data["table_text"] = table_text
     
-    session["page_materials"][page_key].append(material_data)
+    # 存入session
+    page_key = str(page_index)
+    session = await update_session_async(session_id, lambda s: s.setdefault("page_materials", {}).setdefault(page_key, []).append(material_data))
     
     page_title = outline[page_index].get("title", f"第{page_index + 1}页")
     type_label = "表格" if material_type == "table" else "图片"
-    add_message(session_id, "assistant", f"✅ {type_label} \"{file.filename}\" 已添加到第 {page_index + 1} 页（{page_title}）")
+    await add_message_async(session_id, "assistant", f"✅ {type_label} \"{file.filename}\" 已添加到第 {page_index + 1} 页（{page_title}）")
     
     return {
         "success": True,
@@ -399,7 +586,7 @@ async def add_table_text_material(
     """
     添加粘贴的表格文本到指定页面
     """
-    session = get_session(session_id)
+    session = await get_session_async(session_id)
     
     # 检查页码是否有效
     outline = session.get("outline_json", [])
@@ -415,27 +602,22 @@ async def add_table_text_material(
             "message": "表格内容不能为空"
         }
     
-    # 存入session
-    if "page_materials" not in session:
-        session["page_materials"] = {}
-    
-    page_key = str(page_index)
-    if page_key not in session["page_materials"]:
-        session["page_materials"][page_key] = []
-    
     # 生成一个标识名
     table_id = f"粘贴的表格_{int(time.time())}"
-    
-    session["page_materials"][page_key].append({
+    material_data = {
         "filename": table_id,
         "path": None,
         "type": "table_text",
         "table_text": table_text.strip(),
         "description": description.strip()
-    })
+    }
+    
+    # 存入session
+    page_key = str(page_index)
+    session = await update_session_async(session_id, lambda s: s.setdefault("page_materials", {}).setdefault(page_key, []).append(material_data))
     
     page_title = outline[page_index].get("title", f"第{page_index + 1}页")
-    add_message(session_id, "assistant", f"✅ 表格内容已添加到第 {page_index + 1} 页（{page_title}）")
+    await add_message_async(session_id, "assistant", f"✅ 表格内容已添加到第 {page_index + 1} 页（{page_title}）")
     
     return {
         "success": True,
@@ -455,15 +637,21 @@ async def remove_page_material(
     material_index: int
 ):
     """移除指定页面的某个素材"""
-    session = get_session(session_id)
-    
     page_key = str(page_index)
-    materials = session.get("page_materials", {}).get(page_key, [])
+    removed_items = []
+
+    def remove_material(session: dict):
+        removed_items.clear()
+        materials = session.get("page_materials", {}).get(page_key, [])
+        if 0 <= material_index < len(materials):
+            removed_items.append(materials.pop(material_index))
+
+    await update_session_async(session_id, remove_material)
     
-    if material_index < 0 or material_index >= len(materials):
+    if not removed_items:
         return {"success": False, "message": "素材索引无效"}
     
-    removed = materials.pop(material_index)
+    removed = removed_items[0]
     
     # 删除文件
     if removed.get("path"):
@@ -481,7 +669,7 @@ async def remove_page_material(
 @app.get("/api/page-material/list/{session_id}")
 async def list_page_materials(session_id: str):
     """获取所有页面的素材列表"""
-    session = get_session(session_id)
+    session = await get_session_async(session_id, create=False)
     return {
         "success": True,
         "materials": session.get("page_materials", {})
@@ -491,7 +679,7 @@ async def list_page_materials(session_id: str):
 @app.get("/api/page-material/list/{session_id}/{page_index}")
 async def list_page_materials_by_page(session_id: str, page_index: int):
     """获取指定页面的素材列表"""
-    session = get_session(session_id)
+    session = await get_session_async(session_id, create=False)
     page_key = str(page_index)
     materials = session.get("page_materials", {}).get(page_key, [])
     return {
@@ -506,10 +694,8 @@ async def list_page_materials_by_page(session_id: str, page_index: int):
 @app.post("/api/input")
 async def submit_user_input(request: UserInputRequest):
     """提交用户输入的PPT想法"""
-    session = get_session(request.session_id)
-    session["user_input"] = request.content
-    session["stage"] = SessionStage.OUTLINE
-    add_message(request.session_id, "user", request.content)
+    await update_session_async(request.session_id, user_input=request.content, stage=SessionStage.OUTLINE)
+    await add_message_async(request.session_id, "user", request.content)
     return {"success": True, "message": "已收到您的想法，正在生成大纲...", "next_step": "generate_outline"}
 
 
@@ -518,16 +704,16 @@ async def submit_user_input(request: UserInputRequest):
 @app.post("/api/outline/generate")
 async def generate_outline(request: UserInputRequest):
     """生成PPT大纲"""
-    session = get_session(request.session_id)
-
+    settings = {}
     if request.page_count:
-        session["page_count"] = request.page_count
+        settings["page_count"] = request.page_count
     if request.page_instructions:
-        session["page_instructions"] = request.page_instructions
+        settings["page_instructions"] = request.page_instructions
     if request.design_principles:
-        session["design_principles"] = request.design_principles
+        settings["design_principles"] = request.design_principles
     if request.template_settings:
-        session["template_settings"] = request.template_settings
+        settings["template_settings"] = request.template_settings
+    session = await update_session_async(request.session_id, **settings)
 
     page_constraint = f"【页数要求】请严格生成{request.page_count}页PPT。" if request.page_count else ""
     page_instructions = f"【逐页说明】\n{request.page_instructions}" if request.page_instructions else ""
@@ -548,27 +734,33 @@ async def generate_outline(request: UserInputRequest):
     user_input = combined_input
 
     prompt = OUTLINE_PROMPT_TEMPLATE.format(user_input=user_input, page_constraint=page_constraint, page_instructions=page_instructions)
-    response_text, retry_info = await generate_text(prompt)
+    # 重复请求（双击、前端重试）等待进行中的相同请求，不再重复调用模型和写入消息
+    async def generate() -> dict:
+        response_text, retry_info = await generate_text(prompt, use_cache=not request.regenerate)
 
-    if not response_text:
-        return {"success": False, "message": f"大纲生成失败，{retry_info}", "retry_info": retry_info}
+        if not response_text:
+            return {"success": False, "message": f"大纲生成失败，{retry_info}", "retry_info": retry_info}
 
-    json_data = parse_json_from_text(response_text)
+        json_data = parse_json_from_text(response_text)
 
-    if json_data and "pages" in json_data:
-        session["outline_text"] = response_text
-        session["outline_json"] = json_data["pages"]
-        session["user_input"] = request.content
-        session["stage"] = SessionStage.OUTLINE_REFINE
+        if json_data and "pages" in json_data:
+            await update_session_async(
+                request.session_id,
+                outline_text=response_text, outline_json=json_data["pages"],
+                user_input=request.content, stage=SessionStage.OUTLINE_REFINE
+            )
 
-        assistant_msg = f"已为您生成PPT大纲：\n\n{response_text}\n\n如果您对大纲满意，请输入'确认'继续生成设计风格；如果需要修改，请告诉我您的调整意见。"
-        if retry_info:
-            assistant_msg = f"{retry_info}\n\n{assistant_msg}"
-        add_message(request.session_id, "assistant", assistant_msg)
+            assistant_msg = f"已为您生成PPT大纲：\n\n{response_text}\n\n如果您对大纲满意，请输入'确认'继续生成设计风格；如果需要修改，请告诉我您的调整意见。"
+            if retry_info:
+                assistant_msg = f"{retry_info}\n\n{assistant_msg}"
+            await add_message_async(request.session_id, "assistant", assistant_msg)
 
-        return {"success": True, "outline_text": response_text, "outline_json": json_data["pages"], "message": "大纲生成完成，请确认或提出修改意见", "retry_info": retry_info}
-    else:
-        return {"success": False, "message": f"大纲生成失败，请重试。{retry_info}" if retry_info else "大纲生成失败，请重试", "raw_response": response_text, "retry_info": retry_info}
+            return {"success": True, "outline_text": response_text, "outline_json": json_data["pages"], "message": "大纲生成完成，请确认或提出修改意见", "retry_info": retry_info}
+        else:
+            await discard_generated_text(prompt)
+            return {"success": False, "message": f"大纲生成失败，请重试。{retry_info}" if retry_info else "大纲生成失败，请重试", "raw_response": response_text, "retry_info": retry_info}
+
+    return await single_flight(flight_key("outline", request.session_id, prompt, request.regenerate), generate)
 
 
 # ============ 步骤3: 大纲迭代修改 ============
@@ -576,16 +768,16 @@ async def generate_outline(request: UserInputRequest):
 @app.post("/api/outline/refine")
 async def refine_outline(request: RefineRequest):
     """修改大纲"""
-    session = get_session(request.session_id)
-    add_message(request.session_id, "user", request.feedback)
+    session = await get_session_async(request.session_id)
+    await add_message_async(request.session_id, "user", request.feedback)
 
     if any(keyword in request.feedback.lower() for keyword in ["确认", "ok", "满意", "可以", "没问题", "通过"]):
-        session["stage"] = SessionStage.STYLE
-        add_message(request.session_id, "assistant", "好的，大纲已确认！正在为您生成设计风格和绘图方案...")
+        await update_session_async(request.session_id, stage=SessionStage.STYLE)
+        await add_message_async(request.session_id, "assistant", "好的，大纲已确认！正在为您生成设计风格和绘图方案...")
         return {"success": True, "confirmed": True, "message": "大纲已确认，请继续生成设计风格", "next_step": "generate_style"}
 
     prompt = REFINE_OUTLINE_PROMPT.format(current_outline=session["outline_text"], user_feedback=request.feedback)
-    response_text, retry_info = await generate_text(prompt)
+    response_text, retry_info = await generate_text(prompt, use_cache=not request.regenerate)
 
     if not response_text:
         return {"success": False, "message": f"修改失败，{retry_info}", "retry_info": retry_info}
@@ -593,40 +785,39 @@ async def refine_outline(request: RefineRequest):
     json_data = parse_json_from_text(response_text)
 
     if json_data and "pages" in json_data:
-        session["outline_text"] = response_text
-        session["outline_json"] = json_data["pages"]
+        await update_session_async(request.session_id, outline_text=response_text, outline_json=json_data["pages"])
         assistant_msg = f"已根据您的反馈修改大纲：\n\n{response_text}\n\n请确认是否满意，或继续提出调整意见。"
         if retry_info:
             assistant_msg = f"{retry_info}\n\n{assistant_msg}"
-        add_message(request.session_id, "assistant", assistant_msg)
+        await add_message_async(request.session_id, "assistant", assistant_msg)
         return {"success": True, "confirmed": False, "outline_text": response_text, "outline_json": json_data["pages"], "message": "大纲已修改，请确认或继续调整", "retry_info": retry_info}
     else:
+        await discard_generated_text(prompt)
         return {"success": False, "message": f"修改失败，请重试。{retry_info}" if retry_info else "修改失败，请重试", "retry_info": retry_info}
 
 
 @app.post("/api/outline/confirm")
 async def confirm_outline(request: BaseRequest):
     """显式确认大纲（按钮确认）"""
-    session = get_session(request.session_id)
-    session["stage"] = SessionStage.STYLE
-    add_message(request.session_id, "assistant", "大纲已确认！正在为您生成设计风格和绘图方案...")
+    await update_session_async(request.session_id, stage=SessionStage.STYLE)
+    await add_message_async(request.session_id, "assistant", "大纲已确认！正在为您生成设计风格和绘图方案...")
     return {"success": True, "confirmed": True, "message": "大纲已确认，请继续生成设计风格", "next_step": "generate_style"}
 
 
 @app.post("/api/outline/update")
 async def update_outline(request: OutlineUpdateRequest):
     """直接更新大纲JSON（用于前端编辑后同步）"""
-    session = get_session(request.session_id)
-    
-    # 更新大纲
-    session["outline_json"] = request.outline_json
-    
     # 重新生成大纲文本
     outline_text = "\n\n".join([
         f"【第{i+1}页】{page.get('title', page.get('theme', ''))}\n{page.get('content', '')}"
         for i, page in enumerate(request.outline_json)
     ])
-    session["outline_text"] = outline_text
+    
+    # 大纲已变化，正在渲染的页面已过时
+    cancel_renders(request.session_id, "大纲已修改")
+
+    # 更新大纲
+    await update_session_async(request.session_id, outline_json=request.outline_json, outline_text=outline_text)
     
     print(f"大纲已更新: {len(request.outline_json)} 页")
     
@@ -642,7 +833,9 @@ async def update_outline(request: OutlineUpdateRequest):
 @app.post("/api/style/generate")
 async def generate_style(request: UserInputRequest):
     """生成设计风格和绘图Prompt"""
-    session = get_session(request.session_id)
+    session = await get_session_async(request.session_id)
+    # 设计方案将整体重新生成，正在渲染的页面已过时
+    cancel_renders(request.session_id, "重新生成设计方案")
 
     outline_text = "\n\n".join([
         f"第{p['page']}页：{p.get('theme', p.get('title', ''))}\n页面标题：{p.get('title', '')}\n核心要点：\n{p.get('content', '')}"
@@ -686,28 +879,31 @@ async def generate_style(request: UserInputRequest):
         example_accent=example_accent, example_gray=example_gray
     )
 
-    response_text, retry_info = await generate_text(prompt)
+    # 重复请求（双击、前端重试）等待进行中的相同请求，不再重复调用模型和写入消息
+    async def generate() -> dict:
+        response_text, retry_info = await generate_text(prompt, use_cache=not request.regenerate)
 
-    if not response_text:
-        return {"success": False, "message": f"设计方案生成失败，{retry_info}", "retry_info": retry_info}
+        if not response_text:
+            return {"success": False, "message": f"设计方案生成失败，{retry_info}", "retry_info": retry_info}
 
-    json_data = parse_json_from_text(response_text)
+        json_data = parse_json_from_text(response_text)
 
-    if json_data and "pages" in json_data:
-        session["style_text"] = response_text
-        session["style_json"] = json_data["pages"]
-        session["stage"] = SessionStage.STYLE_REFINE
+        if json_data and "pages" in json_data:
+            await update_session_async(request.session_id, style_text=response_text, style_json=json_data["pages"], stage=SessionStage.STYLE_REFINE)
 
-        style_summary = "\n\n".join([f"**第{p['page']}页：{p.get('theme', '')}**\n设计理念：{p.get('design_concept', '')}\n" for p in json_data["pages"]])
-        assistant_msg = f"已为您生成设计方案：\n\n{style_summary}\n\n如果您对设计方案满意，请输入'生成'开始生成PPT图片；如果需要调整风格，请告诉我您的意见。"
-        if retry_info:
-            assistant_msg = f"{retry_info}\n\n{assistant_msg}"
-        add_message(request.session_id, "assistant", assistant_msg)
+            style_summary = "\n\n".join([f"**第{p['page']}页：{p.get('theme', '')}**\n设计理念：{p.get('design_concept', '')}\n" for p in json_data["pages"]])
+            assistant_msg = f"已为您生成设计方案：\n\n{style_summary}\n\n如果您对设计方案满意，请输入'生成'开始生成PPT图片；如果需要调整风格，请告诉我您的意见。"
+            if retry_info:
+                assistant_msg = f"{retry_info}\n\n{assistant_msg}"
+            await add_message_async(request.session_id, "assistant", assistant_msg)
 
-        style_json_without_prompt = [{"page": p["page"], "theme": p.get("theme", ""), "design_concept": p.get("design_concept", "")} for p in json_data["pages"]]
-        return {"success": True, "style_text": response_text, "style_json": style_json_without_prompt, "message": "设计方案生成完成，请确认或提出修改意见", "retry_info": retry_info}
-    else:
-        return {"success": False, "message": f"设计方案生成失败，请重试。{retry_info}" if retry_info else "设计方案生成失败，请重试", "raw_response": response_text, "retry_info": retry_info}
+            style_json_without_prompt = [{"page": p["page"], "theme": p.get("theme", ""), "design_concept": p.get("design_concept", "")} for p in json_data["pages"]]
+            return {"success": True, "style_text": response_text, "style_json": style_json_without_prompt, "message": "设计方案生成完成，请确认或提出修改意见", "retry_info": retry_info}
+        else:
+            await discard_generated_text(prompt)
+            return {"success": False, "message": f"设计方案生成失败，请重试。{retry_info}" if retry_info else "设计方案生成失败，请重试", "raw_response": response_text, "retry_info": retry_info}
+
+    return await single_flight(flight_key("style", request.session_id, prompt, request.regenerate), generate)
 
 
 # ============ 步骤5: 设计风格迭代修改 ============
@@ -715,16 +911,19 @@ async def generate_style(request: UserInputRequest):
 @app.post("/api/style/refine")
 async def refine_style(request: RefineRequest):
     """修改设计风格"""
-    session = get_session(request.session_id)
-    add_message(request.session_id, "user", request.feedback)
+    session = await get_session_async(request.session_id)
+    await add_message_async(request.session_id, "user", request.feedback)
 
     if any(keyword in request.feedback.lower() for keyword in ["生成", "开始", "确认", "ok", "可以"]):
-        session["stage"] = SessionStage.GENERATE
-        add_message(request.session_id, "assistant", "好的，设计方案已确认！开始逐页生成PPT图片...")
+        await update_session_async(request.session_id, stage=SessionStage.GENERATE)
+        await add_message_async(request.session_id, "assistant", "好的，设计方案已确认！开始逐页生成PPT图片...")
         return {"success": True, "confirmed": True, "message": "设计方案已确认，开始生成图片", "next_step": "generate_images"}
 
+    # 设计方案将被修改，正在渲染的页面已过时
+    cancel_renders(request.session_id, "设计方案修改")
+
     prompt = REFINE_STYLE_PROMPT.format(current_style=session["style_text"], user_feedback=request.feedback)
-    response_text, retry_info = await generate_text(prompt)
+    response_text, retry_info = await generate_text(prompt, use_cache=not request.regenerate)
 
     if not response_text:
         return {"success": False, "message": f"修改失败，{retry_info}", "retry_info": retry_info}
@@ -732,25 +931,24 @@ async def refine_style(request: RefineRequest):
     json_data = parse_json_from_text(response_text)
 
     if json_data and "pages" in json_data:
-        session["style_text"] = response_text
-        session["style_json"] = json_data["pages"]
+        await update_session_async(request.session_id, style_text=response_text, style_json=json_data["pages"])
         assistant_msg = f"已根据您的反馈修改设计方案。请输入'生成'开始生成PPT图片，或继续调整。"
         if retry_info:
             assistant_msg = f"{retry_info}\n\n{assistant_msg}"
-        add_message(request.session_id, "assistant", assistant_msg)
+        await add_message_async(request.session_id, "assistant", assistant_msg)
 
         style_json_without_prompt = [{"page": p["page"], "theme": p.get("theme", ""), "design_concept": p.get("design_concept", "")} for p in json_data["pages"]]
         return {"success": True, "confirmed": False, "style_json": style_json_without_prompt, "message": "设计方案已修改，请确认或继续调整", "retry_info": retry_info}
     else:
+        await discard_generated_text(prompt)
         return {"success": False, "message": f"修改失败，请重试。{retry_info}" if retry_info else "修改失败，请重试", "retry_info": retry_info}
 
 
 @app.post("/api/style/confirm")
 async def confirm_style(request: BaseRequest):
     """显式确认设计风格（按钮确认）"""
-    session = get_session(request.session_id)
-    session["stage"] = SessionStage.GENERATE
-    add_message(request.session_id, "assistant", "设计方案已确认！开始逐页生成PPT图片...")
+    await update_session_async(request.session_id, stage=SessionStage.GENERATE)
+    await add_message_async(request.session_id, "assistant", "设计方案已确认！开始逐页生成PPT图片...")
     return {"success": True, "confirmed": True, "message": "设计方案已确认，开始生成图片", "next_step": "generate_images"}
 
 
@@ -760,10 +958,13 @@ async def confirm_style(request: BaseRequest):
 SUPPORTED_IMAGE_FORMATS = {'.png', '.jpg', '.jpeg', '.webp', '.gif'}
 
 @app.post("/api/reference/upload")
-async def upload_reference_image(session_id: str, file: UploadFile = File(...), type: str = "reference"):
-    """上传参考图片/母版（用于保持风格一致）"""
-    session = get_session(session_id)
+async def upload_reference_image(session_id: str, file: UploadFile = File(...), type: str = "reference", wait: bool = True):
+    """
+    上传参考图片/母版（用于保持风格一致）
 
+    母版会在后台分析（同一张母版复用之前的分析结果）；
+    wait=False 时立即返回，通过 /api/reference/analysis/{session_id} 查询分析状态
+    """
     # 校验文件格式
     original_ext = Path(file.filename).suffix.lower() or '.png'
     if original_ext not in SUPPORTED_IMAGE_FORMATS:
@@ -778,31 +979,49 @@ async def upload_reference_image(session_id: str, file: UploadFile = File(...),
         content = await file.read()
         f.write(content)
 
-    session["reference_image_path"] = str(file_path)
-    session["reference_type"] = type
+    await update_session_async(session_id, reference_image_path=str(file_path), reference_type=type)
     print(f"[上传] 参考图/母版已保存: {file_path}, 类型: {type}")
 
     template_analysis = None
+    analysis_status = None
     if type == "template":
-        template_analysis = analyze_template_design(str(file_path))
+        task = await start_template_analysis(session_id, str(file_path))
+        if task is not None and wait:
+            # shield: 客户端断开时分析仍在后台完成
+            await asyncio.shield(task)
+        analysis = await template_analysis_status(session_id)
+        template_analysis, analysis_status = analysis["template_analysis"], analysis["status"]
         if template_analysis:
-            session["template_analysis"] = template_analysis
             print(f"[上传] 母版分析完成并保存到session")
 
+    if type != "template":
+        message = "参考图上传成功"
+    elif template_analysis:
+        message = "母版上传并分析成功"
+    elif analysis_status == AnalysisStatus.RUNNING:
+        message = "母版上传成功，正在后台分析"
+    else:
+        message = "母版上传成功"
+
     return {
         "success": True,
-        "message": "母版上传并分析成功" if type == "template" and template_analysis else ("母版上传成功" if type == "template" else "参考图上传成功"),
+        "message": message,
         "file_path": str(file_path),
         "type": type,
-        "template_analysis": template_analysis
+        "template_analysis": template_analysis,
+        "analysis_status": analysis_status
     }
 
 
+@app.get("/api/reference/analysis/{session_id}")
+async def get_template_analysis(session_id: str):
+    """查询母版分析状态：running / done / failed（未上传母版时为null）"""
+    return {"success": True, **await template_analysis_status(session_id)}
+
+
 @app.post("/api/logo/upload")
 async def upload_logo(session_id: str, file: UploadFile = File(...)):
     """上传用户自定义Logo"""
-    session = get_session(session_id)
-    
     # 校验文件格式
     original_ext = Path(file.filename).suffix.lower()
     if original_ext not in SUPPORTED_IMAGE_FORMATS:
@@ -818,7 +1037,7 @@ async def upload_logo(session_id: str, file: UploadFile = File(...)):
         content = await file.read()
         f.write(content)
 
-    session["custom_logo_path"] = str(logo_path)
+    await update_session_async(session_id, custom_logo_path=str(logo_path))
     return {"success": True, "message": "Logo上传成功", "logo_path": str(logo_path)}
 
 
@@ -827,7 +1046,8 @@ async def upload_logo(session_id: str, file: UploadFile = File(...)):
 @app.post("/api/page/refine-and-regenerate")
 async def refine_page_and_regenerate(request: RefinePageRequest):
     """微调单页设计并重新生成图片 - 基于当前已生成的图片进行微调"""
-    session = get_session(request.session_id)
+    await wait_template_analysis(request.session_id)
+    session = await get_session_async(request.session_id)
     style_pages = session.get("style_json", [])
 
     if request.page_index >= len(style_pages):
@@ -851,7 +1071,7 @@ async def refine_page_and_regenerate(request: RefinePageRequest):
         current_prompt=current_page.get("prompt", ""), user_feedback=request.feedback
     )
 
-    response_text, text_retry_info = await generate_text(prompt)
+    response_text, text_retry_info = await generate_text(prompt, use_cache=not request.regenerate)
 
     if not response_text:
         return {"success": False, "message": f"设计方案修改失败，{text_retry_info}", "retry_info": text_retry_info}
@@ -865,7 +1085,11 @@ async def refine_page_and_regenerate(request: RefinePageRequest):
             "design_concept": json_data.get("design_concept", ""),
             "prompt": json_data.get("prompt", "")
         }
-        session["style_json"][request.page_index] = updated_page
+        def replace_page_style(session: dict):
+            session["style_json"][request.page_index] = updated_page
+            mark_changed(session, "style_json")
+
+        await update_session_async(request.session_id, replace_page_style)
 
         # 构建微调增强的prompt
         refine_prompt = updated_page["prompt"]
@@ -879,13 +1103,22 @@ async def refine_page_and_regenerate(request: RefinePageRequest):
 {updated_page["prompt"]}"""
 
         output_path = OUTPUT_DIR / f"{request.session_id}_第{page_num}页.jpg"
-        success, image_retry_info = await generate_ppt_image(
-            prompt=refine_prompt, output_path=output_path,
-            reference_image_path=current_image_path if current_image_path else session.get("reference_image_path"),
-            custom_logo_path=session.get("custom_logo_path"),
-            reference_type="refine" if current_image_path else session.get("reference_type", "reference"),
-            template_analysis=session.get("template_analysis")
-        )
+
+        async def render():
+            async with render_slot(request.session_id):
+                return await generate_ppt_image(
+                    prompt=refine_prompt, output_path=output_path,
+                    reference_image_path=current_image_path if current_image_path else session.get("reference_image_path"),
+                    custom_logo_path=session.get("custom_logo_path"),
+                    reference_type="refine" if current_image_path else session.get("reference_type", "reference"),
+                    template_analysis=session.get("template_analysis"),
+                    force_regenerate=request.regenerate
+                )
+
+        try:
+            success, image_retry_info = await track_render(request.session_id, render())
+        except RenderCancelled:
+            return {"success": False, "cancelled": True, "message": f"第{page_num}页的生成已取消"}
 
         combined_retry_info = ""
         if text_retry_info:
@@ -895,26 +1128,25 @@ async def refine_page_and_regenerate(request: RefinePageRequest):
 
         if success:
             full_filename = f"{request.session_id}_第{page_num}页.jpg"
-            image_info = {"page": page_num, "theme": updated_page.get("theme", ""), "image_path": str(output_path), "filename": full_filename}
+            image_info = {"page": page_num, "theme": updated_page.get("theme", ""), "image_path": str(output_path), "filename": full_filename, **page_renditions(output_path)}
 
-            while len(session["generated_images"]) <= request.page_index:
-                session["generated_images"].append(None)
-            session["generated_images"][request.page_index] = image_info
+            await store_page_result(request.session_id, request.page_index, image_info)
 
             assistant_msg = f"✅ 第{page_num}页已根据您的意见微调完成"
             if combined_retry_info:
                 assistant_msg = f"{combined_retry_info}\n\n{assistant_msg}"
-            add_message(request.session_id, "assistant", assistant_msg)
+            await add_message_async(request.session_id, "assistant", assistant_msg)
 
             return {
                 "success": True,
                 "updated_style": {"page": updated_page["page"], "theme": updated_page["theme"], "design_concept": updated_page["design_concept"]},
-                "image_path": str(output_path), "image_filename": full_filename,
+                "image_path": str(output_path), "image_filename": full_filename, "image_version": image_info["image_version"],
                 "message": f"第{page_num}页已微调完成", "retry_info": combined_retry_info
             }
         else:
             return {"success": False, "message": f"图片重新生成失败。{image_retry_info}" if image_retry_info else "图片重新生成失败", "retry_info": image_retry_info}
     else:
+        await discard_generated_text(prompt)
         return {"success": False, "message": f"设计方案修改失败，请重试。{text_retry_info}" if text_retry_info else "设计方案修改失败，请重试", "retry_info": text_retry_info}
 
 
@@ -923,7 +1155,8 @@ async def refine_page_and_regenerate(request: RefinePageRequest):
 @app.post("/api/image/generate")
 async def generate_single_image(request: GenerateImageRequest):
     """生成单页PPT图片"""
-    session = get_session(request.session_id)
+    await wait_template_analysis(request.session_id)
+    session = await get_session_async(request.session_id)
     style_pages = session.get("style_json", [])
 
     if request.page_index >= len(style_pages):
@@ -935,6 +1168,13 @@ async def generate_single_image(request: GenerateImageRequest):
     if not prompt:
         raise HTTPException(status_code=400, detail="该页没有生成提示词")
 
+    # 重复请求（双击、前端重试）等待进行中的相同请求，不再重复生成和写入消息
+    key = flight_key("image", request.session_id, request.page_index, prompt, request.force_regenerate)
+    return await single_flight(key, lambda: _generate_single_image(request, session, page_style, prompt))
+
+
+async def _generate_single_image(request: GenerateImageRequest, session: dict, page_style: dict, prompt: str) -> dict:
+    """生成单页图片并写入会话（由 generate_single_image 合并重复请求后调用）"""
     output_path = OUTPUT_DIR / f"{request.session_id}_第{request.page_index + 1}页.jpg"
 
     # 获取该页的素材
@@ -942,93 +1182,164 @@ async def generate_single_image(request: GenerateImageRequest):
     if page_materials:
         print(f"第{request.page_index + 1}页有 {len(page_materials)} 个素材")
 
-    success, retry_info = await generate_ppt_image(
-        prompt=prompt, output_path=output_path,
-        reference_image_path=session.get("reference_image_path"),
-        custom_logo_path=session.get("custom_logo_path"),
-        reference_type=session.get("reference_type", "reference"),
-        template_analysis=session.get("template_analysis"),
-        page_materials=page_materials  # 新增：传入页面素材
-    )
+    async def render():
+        async with render_slot(request.session_id):
+            return await generate_ppt_image(
+                prompt=prompt, output_path=output_path,
+                reference_image_path=session.get("reference_image_path"),
+                custom_logo_path=session.get("custom_logo_path"),
+                reference_type=session.get("reference_type", "reference"),
+                template_analysis=session.get("template_analysis"),
+                page_materials=page_materials,  # 新增：传入页面素材
+                force_regenerate=request.force_regenerate
+            )
+
+    key = page_flight_key(request.session_id, request.page_index, prompt, request.force_regenerate)
+    try:
+        success, retry_info = await single_flight(key, lambda: track_render(request.session_id, render()))
+    except RenderCancelled:
+        return {"success": False, "cancelled": True, "page_index": request.page_index, "message": f"第{request.page_index + 1}页的生成已取消"}
 
     if success:
         full_filename = f"{request.session_id}_第{request.page_index + 1}页.jpg"
-        image_info = {"page": request.page_index + 1, "theme": page_style.get("theme", ""), "image_path": str(output_path), "filename": full_filename}
+        image_info = {"page": request.page_index + 1, "theme": page_style.get("theme", ""), "image_path": str(output_path), "filename": full_filename, **page_renditions(output_path)}
 
-        while len(session["generated_images"]) <= request.page_index:
-            session["generated_images"].append(None)
-        session["generated_images"][request.page_index] = image_info
+        await store_page_result(request.session_id, request.page_index, image_info)
 
         assistant_msg = f"✅ 第{request.page_index + 1}页生成完成"
         if retry_info:
             assistant_msg = f"{retry_info}\n\n{assistant_msg}"
-        add_message(request.session_id, "assistant", assistant_msg)
+        await add_message_async(request.session_id, "assistant", assistant_msg)
 
-        return {"success": True, "page_index": request.page_index, "image_path": str(output_path), "filename": full_filename, "retry_info": retry_info}
+        return {"success": True, "page_index": request.page_index, "image_path": str(output_path), "filename": full_filename, "image_version": image_info["image_version"], "retry_info": retry_info}
     else:
-        add_message(request.session_id, "assistant", f"⚠️ 第{request.page_index + 1}页生成失败。{retry_info}" if retry_info else f"⚠️ 第{request.page_index + 1}页生成失败")
+        await add_message_async(request.session_id, "assistant", f"⚠️ 第{request.page_index + 1}页生成失败。{retry_info}" if retry_info else f"⚠️ 第{request.page_index + 1}页生成失败")
         raise HTTPException(status_code=500, detail=f"图片生成失败。{retry_info}" if retry_info else "图片生成失败")
 
 
+async def _run_generate_all(session_id: str, session: dict, mode: str, on_event=None, force_regenerate: bool = False) -> dict:
+    """执行一键生成：渲染所有页面并写入完成消息，返回 generate-all 的响应结构"""
+    await update_session_async(session_id, stage=SessionStage.GENERATE)
+    results = await render_deck(session_id, session, mode=mode, on_event=on_event, force_regenerate=force_regenerate)
+    return await finish_deck(session_id, results)
+
+
+async def _check_generate_all_request(request: GenerateAllImagesRequest) -> dict:
+    """校验一键生成请求，返回会话"""
+    session = await get_session_async(request.session_id)
+
+    if not session.get("style_json"):
+        raise HTTPException(status_code=400, detail="请先生成设计方案")
+
+    if request.mode not in RENDER_MODES:
+        raise HTTPException(status_code=400, detail=f"不支持的生成模式: {request.mode}，可选: {', '.join(RENDER_MODES)}")
+
+    return session
+
+
 @app.post("/api/image/generate-all")
 async def generate_all_images(request: GenerateAllImagesRequest):
     """生成所有PPT图片"""
-    session = get_session(request.session_id)
-    style_pages = session.get("style_json", [])
+    await wait_template_analysis(request.session_id)
+    session = await _check_generate_all_request(request)
+    return await _run_generate_all(request.session_id, session, request.mode, force_regenerate=request.force_regenerate)
 
-    if not style_pages:
-        raise HTTPException(status_code=400, detail="请先生成设计方案")
 
-    session["stage"] = SessionStage.GENERATE
-    results = []
-    all_retry_info = []
-
-    for i, page_style in enumerate(style_pages):
-        prompt = page_style.get("prompt", "")
-
-        if not prompt:
-            results.append({"page": i + 1, "success": False, "error": "没有生成提示词"})
-            continue
-
-        output_path = OUTPUT_DIR / f"{request.session_id}_第{i + 1}页.jpg"
-
-        # 获取该页的素材
-        page_materials = session.get("page_materials", {}).get(str(i), [])
-        if page_materials:
-            print(f"第{i+1}页有 {len(page_materials)} 个素材")
-
-        success, retry_info = await generate_ppt_image(
-            prompt=prompt, output_path=output_path,
-            reference_image_path=session.get("reference_image_path"),
-            custom_logo_path=session.get("custom_logo_path"),
-            reference_type=session.get("reference_type", "reference"),
-            template_analysis=session.get("template_analysis"),
-            page_materials=page_materials  # 新增：传入页面素材
-        )
-
-        result = {
-            "page": i + 1, "theme": page_style.get("theme", ""), "success": success,
-            "image_path": str(output_path) if success else None,
-            "filename": f"第{i + 1}页.jpg" if success else None, "retry_info": retry_info
-        }
-        results.append(result)
+def _sse_event(event: str, data: dict) -> str:
+    """格式化一条 Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
 
-        if retry_info:
-            all_retry_info.append(f"第{i + 1}页: {retry_info}")
 
-        if success:
-            while len(session["generated_images"]) <= i:
-                session["generated_images"].append(None)
-            session["generated_images"][i] = result
+# 流式生成在后台任务中执行，客户端断开后仍会完成并写入session
+_background_tasks: set = set()
+
+
+@app.post("/api/image/generate-all/stream")
+async def generate_all_images_stream(request: GenerateAllImagesRequest):
+    """
+    生成所有PPT图片（Server-Sent Events 流式返回进度）
+
+    事件: page_start / page_retry / page_success / page_failed / page_cancelled，
+    最后一条 complete 事件的数据与 /api/image/generate-all 的响应一致
+    """
+    await wait_template_analysis(request.session_id)
+    session = await _check_generate_all_request(request)
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def run():
+        try:
+            response = await _run_generate_all(request.session_id, session, request.mode, on_event=queue.put_nowait, force_regenerate=request.force_regenerate)
+            queue.put_nowait({"type": "complete", **response})
+        except Exception as e:
+            print(f"[流式生成] 生成失败: {e}")
+            queue.put_nowait({"type": "error", "message": str(e)})
+
+    task = asyncio.create_task(run())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+    async def event_stream():
+        yield _sse_event("start", {"session_id": request.session_id, "total": len(session["style_json"]), "mode": request.mode})
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=SSE_HEARTBEAT_INTERVAL)
+            except asyncio.TimeoutError:
+                # 心跳注释行，防止代理因空闲断开连接
+                yield ": keep-alive\n\n"
+                continue
+            yield _sse_event(event["type"], event)
+            if event["type"] in ("complete", "error"):
+                break
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+# ============ 后台生成任务 ============
+
+@app.post("/api/jobs/generate-all")
+async def create_generate_all_job(request: GenerateAllImagesRequest):
+    """创建一键生成后台任务，立即返回任务ID（母版仍在分析时先等待分析完成，最多等待 TEMPLATE_ANALYSIS_WAIT_TIMEOUT 秒）"""
+    await wait_template_analysis(request.session_id)
+    session = await _check_generate_all_request(request)
+
+    # 同一会话已有进行中的任务时直接返回该任务，避免重复渲染
+    job, created = await find_or_create_job(request.session_id, session, request.mode, force_regenerate=request.force_regenerate)
+    if not created:
+        return {"success": True, "message": "该会话已有进行中的生成任务", **job_summary(job)}
 
-    session["stage"] = SessionStage.COMPLETE
+    start_job(job)
+    await add_message_async(request.session_id, "assistant", f"已创建后台生成任务，共{len(job['pages'])}页")
+    return {"success": True, "message": "生成任务已创建", **job_summary(job)}
 
-    complete_msg = f"🎉 所有{len(style_pages)}页PPT已生成完成！\n\n成功：{sum(1 for r in results if r['success'])}页\n失败：{sum(1 for r in results if not r['success'])}页\n\n您可以点击'下载PPT'按钮打包下载所有图片。"
-    if all_retry_info:
-        complete_msg = "⚠️ 生成过程中遇到接口不稳定：\n" + "\n".join(all_retry_info) + "\n\n" + complete_msg
-    add_message(request.session_id, "assistant", complete_msg)
 
-    return {"success": True, "total": len(style_pages), "results": results, "retry_info": all_retry_info if all_retry_info else None}
+@app.get("/api/jobs/{job_id}")
+async def get_job_status(job_id: str):
+    """查询后台任务进度（含每页状态）"""
+    job = await get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return {"success": True, **job_summary(job)}
+
+
+@app.post("/api/jobs/{job_id}/cancel")
+async def cancel_generate_job(job_id: str):
+    """取消后台任务"""
+    job = await get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    if not await cancel_job(job_id):
+        return {"success": False, "message": f"任务已结束，无法取消（状态: {job['status']}）"}
+    return {"success": True, "message": "任务已取消", "job_id": job_id}
+
+
+@app.get("/api/jobs/session/{session_id}")
+async def list_session_jobs(session_id: str):
+    """列出会话的所有后台任务"""
+    return {"success": True, "jobs": [job_summary(job) for job in await list_jobs(session_id)]}
 
 
 # ============ 步骤8: 下载打包 ============
@@ -1036,7 +1347,7 @@ async def generate_all_images(request: GenerateAllImagesRequest):
 @app.get("/api/download/{session_id}")
 async def download_ppt_package(session_id: str):
     """下载PPT图片包（ZIP格式）"""
-    session = get_session(session_id)
+    session = await get_session_async(session_id, create=False)
     images = session.get("generated_images", [])
 
     if not images:
@@ -1047,7 +1358,8 @@ async def download_ppt_package(session_id: str):
     with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
         for img in images:
             if img and img.get("image_path") and os.path.exists(img["image_path"]):
-                zipf.write(img["image_path"], img["filename"])
+                # 压缩包内不带会话ID前缀
+                zipf.write(img["image_path"], f"第{img['page']}页.jpg")
 
     return FileResponse(zip_path, media_type="application/zip", filename=f"PPT_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip")
 
@@ -1055,7 +1367,7 @@ async def download_ppt_package(session_id: str):
 @app.get("/api/download/{session_id}/pdf")
 async def download_ppt_pdf(session_id: str):
     """下载PPT图片合并为PDF"""
-    session = get_session(session_id)
+    session = await get_session_async(session_id, create=False)
     images = session.get("generated_images", [])
 
     if not images:
@@ -1087,18 +1399,80 @@ async def download_ppt_pdf(session_id: str):
     return FileResponse(pdf_path, media_type="application/pdf", filename=f"PPT_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf")
 
 
-@app.get("/api/image/{filename}")
-async def get_image(filename: str):
-    """获取单张图片"""
-    exact_path = OUTPUT_DIR / filename
-    if exact_path.exists():
-        return FileResponse(exact_path, media_type="image/png")
+def _not_modified(request: Request, etag: str, mtime: float) -> bool:
+    """条件请求：If-None-Match 优先，没有时比较 If-Modified-Since"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def _image_response(path: Path, stat: os.stat_result, headers: dict) -> Response:
+    """发送图片文件：配置了 X-Accel-Redirect 时交给 Nginx 发送，否则由 FileResponse 发送（支持 Range）"""
+    if IMAGE_ACCEL_REDIRECT_PREFIX:
+        try:
+            relative = path.relative_to(OUTPUT_DIR).as_posix()
+        except ValueError:
+            relative = None
+        if relative is not None:
+            headers = {**headers, "X-Accel-Redirect": IMAGE_ACCEL_REDIRECT_PREFIX.rstrip("/") + "/" + quote(relative)}
+            return Response(media_type=media_type(path), headers=headers)
+    return FileResponse(path, media_type=media_type(path), headers=headers, stat_result=stat)
 
-    for file_path in OUTPUT_DIR.glob("*"):
-        if filename in file_path.name:
-            return FileResponse(file_path, media_type="image/png")
 
-    raise HTTPException(status_code=404, detail="图片不存在")
+@app.get("/api/image/{filename}")
+async def get_image(filename: str, request: Request, w: Optional[int] = None, fmt: Optional[str] = None, v: Optional[str] = None):
+    """
+    获取单张图片
+
+    w: 缩小到指定宽度（向上取档，见 IMAGE_VARIANT_WIDTHS）；fmt: 输出格式 webp / jpeg / png
+    只指定 fmt 时按最大一档宽度输出；都不指定时返回原图
+    v: 图片版本号（生成结果中的 image_version），与当前图片一致时响应可被长期缓存，否则每次向服务端确认（ETag）
+    """
+    if fmt is not None:
+        fmt = fmt.lower()
+        if fmt not in IMAGE_FORMATS:
+            raise HTTPException(status_code=400, detail=f"不支持的图片格式: {fmt}")
+    if w is not None and w <= 0:
+        raise HTTPException(status_code=400, detail="图片宽度必须大于0")
+
+    path = lookup_image(filename)
+    try:
+        stat = path.stat() if path is not None else None
+    except FileNotFoundError:
+        unregister_image(filename)  # 索引中的文件已被删除
+        stat = None
+    if stat is None:
+        raise HTTPException(status_code=404, detail="图片不存在")
+
+    if w is None and fmt is None:
+        version = await asyncio.to_thread(image_version, path)
+        etag = f'"{version}"'
+    else:
+        fmt = fmt or "jpeg"
+        width = variant_width(w) if w else IMAGE_VARIANT_WIDTHS[-1]
+        try:
+            path, version, stat = await get_image_variant(path, width, fmt)
+        except FileNotFoundError:
+            unregister_image(filename)  # 原图在处理过程中被删除
+            raise HTTPException(status_code=404, detail="图片不存在")
+        etag = f'"{version}-{width}-{fmt}"'
+
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
+        "Cache-Control": f"public, max-age={IMAGE_CACHE_MAX_AGE}, immutable" if v == version else "no-cache"
+    }
+    if _not_modified(request, etag, stat.st_mtime):
+        return Response(status_code=304, headers=headers)
+    return _image_response(path, stat, headers)
 
 
 # ============ 对话接口（统一入口）============
@@ -1106,10 +1480,10 @@ async def get_image(filename: str):
 @app.post("/api/chat")
 async def chat(request: UserInputRequest):
     """统一的对话接口，根据当前阶段自动处理"""
-    session = get_session(request.session_id)
+    session = await get_session_async(request.session_id)
     stage = session["stage"]
 
-    add_message(request.session_id, "user", request.content)
+    await add_message_async(request.session_id, "user", request.content)
 
     if stage == SessionStage.INPUT:
         return await generate_outline(request)
@@ -1130,7 +1504,7 @@ async def chat(request: UserInputRequest):
         return result
 
     elif stage == SessionStage.GENERATE:
-        add_message(request.session_id, "assistant", "正在生成图片中，请稍候...")
+        await add_message_async(request.session_id, "assistant", "正在生成图片中，请稍候...")
         return {"success": True, "message": "正在生成图片中"}
 
     elif stage == SessionStage.COMPLETE:
@@ -1138,10 +1512,10 @@ async def chat(request: UserInputRequest):
             match = re.search(r'修改第\s*(\d+)\s*页', request.content)
             if match:
                 page_num = int(match.group(1))
-                add_message(request.session_id, "assistant", f"请告诉我您希望如何修改第{page_num}页的设计。")
+                await add_message_async(request.session_id, "assistant", f"请告诉我您希望如何修改第{page_num}页的设计。")
                 return {"success": True, "message": f"请描述第{page_num}页的修改要求", "editing_page": page_num}
 
-        add_message(request.session_id, "assistant", "您的PPT已生成完成。\n- 如需修改某页，请说'修改第X页'\n- 如需下载，请点击'下载PPT'按钮")
+        await add_message_async(request.session_id, "assistant", "您的PPT已生成完成。\n- 如需修改某页，请说'修改第X页'\n- 如需下载，请点击'下载PPT'按钮")
         return {"success": True, "message": "PPT已完成，可以下载或修改"}
 
     return {"success": False, "message": "未知状态"}
@@ -0,0 +1,87 @@
+"""
+测试公共配置
+
+- 在临时目录中运行（outputs、records 等目录都建在临时目录下，不影响项目目录）
+- Gemini 接口由 httpx.MockTransport 模拟，不发出真实请求
+"""
+
+import io
+import os
+import sys
+import json
+import base64
+import asyncio
+import tempfile
+from pathlib import Path
+
+# 配置模块在导入时创建目录、读取环境变量，必须在导入项目模块之前设置
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+os.chdir(tempfile.mkdtemp(prefix="slideflow-test-"))
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+os.environ["RETRY_BASE_DELAY"] = "0"
+os.environ["POSTPROCESS_WORKERS"] = "1"
+os.environ["TEXT_MODEL_RPM"] = "0"  # 不限流
+os.environ["IMAGE_MODEL_RPM"] = "0"
+
+import httpx
+import pytest
+from PIL import Image
+
+import modules.http_client as http_client
+
+
+def _png_base64(width: int = 64, height: int = 36) -> str:
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), (28, 38, 98)).save(buffer, "PNG")
+    return base64.b64encode(buffer.getvalue()).decode()
+
+
+class FakeGemini:
+    """模拟的 Gemini 接口：图片请求返回一张PNG，可设置每次请求的延迟"""
+
+    def __init__(self):
+        self.calls = 0
+        self.delay = 0.0
+
+    async def handler(self, request: httpx.Request) -> httpx.Response:
+        self.calls += 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if "image" in str(request.url):
+            parts = [{"text": "ok"}, {"inlineData": {"mimeType": "image/png", "data": _png_base64()}}]
+        else:
+            parts = [{"text": json.dumps({"pages": []})}]
+        return httpx.Response(200, json={"candidates": [{"content": {"parts": parts}}]})
+
+
+_fake_gemini = FakeGemini()
+
+
+@pytest.fixture
+def gemini():
+    """模拟的 Gemini 接口（每个测试重置调用次数和延迟）"""
+    _fake_gemini.calls = 0
+    _fake_gemini.delay = 0.0
+    return _fake_gemini
+
+
+@pytest.fixture(scope="session")
+def app_client():
+    """
+    启动应用（含 lifespan）的测试客户端
+
+    整个测试过程共用一个：限流、并发控制等模块级的 asyncio 锁绑定在首次使用的事件循环上，
+    与生产环境一样只使用一个事件循环
+    """
+    from fastapi.testclient import TestClient
+    import server
+
+    http_client._client = httpx.AsyncClient(transport=httpx.MockTransport(_fake_gemini.handler))
+    with TestClient(server.app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def client(app_client, gemini):
+    return app_client
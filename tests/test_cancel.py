@@ -0,0 +1,72 @@
+"""取消生成后会话退出生成阶段"""
+
+import sys
+import asyncio
+
+import server
+from modules.session import SessionStage, get_session, update_session
+
+
+def _prepare_session(session_id: str, pages: int = 4, generated: int = 0):
+    update_session(
+        session_id,
+        style_json=[{"page": i + 1, "theme": f"主题{i + 1}", "prompt": f"{session_id} 第{i + 1}页"} for i in range(pages)],
+        generated_images=[{"page": i + 1, "filename": f"{session_id}_第{i + 1}页.jpg"} for i in range(generated)]
+    )
+
+
+def _cancel_deck(client, session_id: str, cancel):
+    async def scenario():
+        deck = asyncio.create_task(server._run_generate_all(session_id, get_session(session_id), "parallel", force_regenerate=True))
+        await asyncio.sleep(0.2)
+        await cancel()
+        return await deck
+
+    return client.portal.call(scenario)
+
+
+def test_cancel_returns_to_style_refine(client, gemini):
+    gemini.delay = 1.0
+    _prepare_session("test-cancel")
+    result = _cancel_deck(client, "test-cancel", lambda: server.cancel_session_generation("test-cancel"))
+    assert result["cancelled"] is True
+    assert get_session("test-cancel")["stage"] == SessionStage.STYLE_REFINE
+
+    # 阶段已恢复，对话接口不再回复“正在生成图片中”
+    assert "正在生成" not in str(client.post("/api/chat", json={"session_id": "test-cancel", "content": "标题字号再大一些"}).json())
+
+
+def test_cancel_with_all_pages_generated_completes(client, gemini):
+    gemini.delay = 1.0
+    _prepare_session("test-cancel-complete", generated=4)
+    result = _cancel_deck(client, "test-cancel-complete", lambda: server.cancel_session_generation("test-cancel-complete"))
+    assert result["cancelled"] is True
+    assert get_session("test-cancel-complete")["stage"] == SessionStage.COMPLETE
+
+
+def test_outline_edit_cancel_leaves_generate_stage(client, gemini):
+    gemini.delay = 1.0
+    _prepare_session("test-cancel-outline")
+    request = server.OutlineUpdateRequest(session_id="test-cancel-outline", outline_json=[{"title": "新大纲"}])
+    result = _cancel_deck(client, "test-cancel-outline", lambda: server.update_outline(request))
+    assert result["cancelled"] is True
+    assert get_session("test-cancel-outline")["stage"] == SessionStage.STYLE_REFINE
+
+
+def test_cancel_job_returns_to_style_refine(client, gemini):
+    jobs = sys.modules["modules.jobs"]
+    gemini.delay = 1.0
+    _prepare_session("test-cancel-job")
+    job_id = client.post("/api/jobs/generate-all", json={"session_id": "test-cancel-job", "force_regenerate": True}).json()["job_id"]
+
+    async def scenario():
+        await asyncio.sleep(0.2)
+        await server.cancel_session_generation("test-cancel-job")
+        for _ in range(50):
+            if (await jobs.get_job(job_id))["status"] == jobs.JobStatus.CANCELLED:
+                break
+            await asyncio.sleep(0.05)
+
+    client.portal.call(scenario)
+    assert client.portal.call(jobs.get_job, job_id)["status"] == jobs.JobStatus.CANCELLED
+    assert get_session("test-cancel-job")["stage"] == SessionStage.STYLE_REFINE
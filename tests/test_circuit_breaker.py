@@ -0,0 +1,87 @@
+"""熔断器：失败率达到阈值后熔断，到期半开只放行一个探测请求，探测成功恢复、失败重新熔断"""
+
+import pytest
+
+import modules.circuit_breaker as circuit_breaker
+from modules.circuit_breaker import CircuitBreaker, CircuitOpenError, CircuitState
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(circuit_breaker, "time", fake)
+    monkeypatch.setattr(circuit_breaker, "CIRCUIT_MIN_CALLS", 4)
+    monkeypatch.setattr(circuit_breaker, "CIRCUIT_FAILURE_RATE", 0.5)
+    monkeypatch.setattr(circuit_breaker, "CIRCUIT_WINDOW_SECONDS", 120)
+    monkeypatch.setattr(circuit_breaker, "CIRCUIT_OPEN_SECONDS", 30)
+    return fake
+
+
+def _trip(breaker):
+    for ok in (True, True, False, False):
+        breaker.before_call()
+        breaker.record(ok)
+    assert breaker.state == CircuitState.OPEN
+
+
+def test_open_half_open_closed(clock):
+    breaker = CircuitBreaker("test-recover")
+    _trip(breaker)
+    with pytest.raises(CircuitOpenError) as error:
+        breaker.before_call()
+    assert error.value.retry_in == pytest.approx(30)
+
+    clock.now += 30
+    breaker.before_call()
+    assert breaker.state == CircuitState.HALF_OPEN
+    # 探测进行中，其他请求继续被拒绝
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record(True)
+    assert breaker.state == CircuitState.CLOSED
+    assert breaker.stats == {"rejected": 2, "opened": 1, "closed": 1}
+    breaker.before_call()
+
+
+def test_failed_probe_reopens(clock):
+    breaker = CircuitBreaker("test-reopen")
+    _trip(breaker)
+    clock.now += 30
+    breaker.before_call()
+    breaker.record(False)
+    assert breaker.state == CircuitState.OPEN
+    # 重新计时
+    clock.now += 29
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_cancelled_probe_allows_next_probe(clock):
+    breaker = CircuitBreaker("test-cancelled-probe")
+    _trip(breaker)
+    clock.now += 30
+    breaker.before_call()
+    breaker.record(None)
+    assert breaker.state == CircuitState.HALF_OPEN
+    breaker.before_call()
+    breaker.record(True)
+    assert breaker.state == CircuitState.CLOSED
+
+
+def test_old_failures_leave_window(clock):
+    breaker = CircuitBreaker("test-window")
+    for _ in range(3):
+        breaker.record(False)
+    clock.now += 121
+    breaker.record(True)
+    breaker.record(False)
+    # 窗口内只剩 2 次调用，不足最少调用次数
+    assert breaker.state == CircuitState.CLOSED
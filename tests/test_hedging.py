@@ -0,0 +1,76 @@
+"""对冲请求：发出后才计时、限额用完不再对冲、落选请求被取消"""
+
+import asyncio
+
+import pytest
+
+import modules.hedging as hedging
+from modules.hedging import HedgeBudget, hedged_post
+
+
+@pytest.fixture(autouse=True)
+def short_delay(monkeypatch):
+    monkeypatch.setattr(hedging, "hedge_delay", lambda model: 0.05)
+
+
+class FakeSend:
+    """按调用顺序给每个请求指定（排队时长, 响应时长, 结果）"""
+
+    def __init__(self, *plans):
+        self.plans = list(plans)
+        self.started = 0
+        self.cancelled = []
+        self.discarded = []
+
+    async def __call__(self, sent):
+        index = self.started
+        self.started += 1
+        queue_time, response_time, result = self.plans[index]
+        try:
+            await asyncio.sleep(queue_time)
+            if sent is not None:
+                sent.set()
+            await asyncio.sleep(response_time)
+            return result
+        except asyncio.CancelledError:
+            self.cancelled.append(index)
+            raise
+
+
+def _run(send, budget):
+    return asyncio.run(hedged_post("image-model", send, budget, is_success=lambda result: result == "ok",
+                                   discard=send.discarded.append))
+
+
+def test_hedge_wins_and_loser_cancelled():
+    send = FakeSend((0, 1.0, "ok"), (0, 0, "ok"))
+    budget = HedgeBudget(pages=10)
+    assert _run(send, budget) == "ok"
+    assert send.started == 2 and budget.used == 1
+    # 主请求已被取消并等待结束，不会在返回后继续运行
+    assert send.cancelled == [0]
+    assert send.discarded == []
+
+
+def test_no_hedge_when_budget_exhausted():
+    send = FakeSend((0, 0.2, "ok"), (0, 0, "ok"))
+    budget = HedgeBudget(pages=1)
+    budget.take()
+    assert _run(send, budget) == "ok"
+    assert send.started == 1
+    assert hedging.hedge_stats()["budget_exhausted"] >= 1
+
+
+def test_no_hedge_while_primary_is_queued():
+    # 主请求排队（等令牌/并发名额）远超对冲延迟，但发出后很快返回
+    send = FakeSend((0.3, 0.01, "ok"), (0, 0, "ok"))
+    budget = HedgeBudget(pages=10)
+    assert _run(send, budget) == "ok"
+    assert send.started == 1 and budget.used == 0
+
+
+def test_failed_primary_waits_for_hedge():
+    send = FakeSend((0, 0.1, "error"), (0, 0.2, "ok"))
+    assert _run(send, HedgeBudget(pages=10)) == "ok"
+    # 先失败的主请求结果被释放
+    assert send.discarded == ["error"]
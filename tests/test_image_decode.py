@@ -0,0 +1,65 @@
+"""流式图片解码：块边界、转义的斜杠、内存记账"""
+
+import io
+import json
+import base64
+import asyncio
+
+from PIL import Image
+
+from modules.image_decode import InlineImageDecoder, save_decoded_image
+
+
+def _png_bytes() -> bytes:
+    buffer = io.BytesIO()
+    Image.effect_noise((96, 64), 64).convert("RGB").save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def _response_body(data: str) -> bytes:
+    parts = [{"text": "说明文字 inlineData"}, {"inlineData": {"mimeType": "image/png", "data": "__DATA__"}}]
+    body = json.dumps({"candidates": [{"content": {"parts": parts}}]}, ensure_ascii=False)
+    return body.replace("__DATA__", data).encode()
+
+
+def _feed(body: bytes, chunk_size: int) -> InlineImageDecoder:
+    decoder = InlineImageDecoder()
+    for start in range(0, len(body), chunk_size):
+        decoder.feed(body[start:start + chunk_size])
+    return decoder
+
+
+def test_decode_across_chunk_boundaries():
+    image = _png_bytes()
+    body = _response_body(base64.b64encode(image).decode())
+    # 块大小覆盖键名、base64 四字符组、结尾引号被切开的各种位置
+    for chunk_size in (1, 3, 7, 64, 1021, len(body)):
+        decoder = _feed(body, chunk_size)
+        assert decoder.finished, chunk_size
+        assert decoder.buffer.getvalue() == image, chunk_size
+        decoder.close()
+
+
+def test_decode_escaped_slashes():
+    image = _png_bytes()
+    encoded = base64.b64encode(image).decode()
+    assert "/" in encoded
+    decoder = _feed(_response_body(encoded.replace("/", "\\/")), 5)
+    assert decoder.finished
+    assert decoder.buffer.getvalue() == image
+
+
+def test_response_without_image():
+    decoder = _feed(json.dumps({"candidates": [{"content": {"parts": [{"text": "无图片"}]}}]}).encode(), 8)
+    assert not decoder.found and not decoder.finished
+
+
+def test_save_holds_image_until_postprocess_done(tmp_path):
+    image = _png_bytes()
+    decoder = _feed(_response_body(base64.b64encode(image).decode()), 1024)
+    assert asyncio.run(save_decoded_image(decoder, tmp_path / "page.jpg"))
+    assert (tmp_path / "page.jpg").is_file()
+    # 持有的解码数据 + 发送到后处理的副本 + 像素缓冲同时计入峰值
+    assert decoder.peak >= 2 * len(image) + 96 * 64 * 3
+    decoder.close()
+    assert decoder.current == 0
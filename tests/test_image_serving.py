@@ -0,0 +1,70 @@
+"""图片接口：生成结果中的文件名可以直接用于 /api/image/{filename}"""
+
+from modules.session import get_session, update_session
+
+
+def _prepare_session(session_id: str, pages: int = 2):
+    update_session(session_id, style_json=[{"page": i + 1, "theme": f"主题{i + 1}", "prompt": f"第{i + 1}页提示词"} for i in range(pages)])
+
+
+def test_generate_all_filenames_are_servable(client):
+    _prepare_session("test-serve")
+    response = client.post("/api/image/generate-all", json={"session_id": "test-serve", "force_regenerate": True})
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [r["success"] for r in results] == [True, True]
+
+    for result in results:
+        image = client.get(f"/api/image/{result['filename']}")
+        assert image.status_code == 200
+        assert image.headers["content-type"] == "image/jpeg"
+        thumbnail = client.get(f"/api/image/{result['thumbnail_filename']}")
+        assert thumbnail.status_code == 200
+        assert thumbnail.headers["content-type"] == "image/webp"
+
+
+def test_session_generated_images_filenames_are_servable(client):
+    _prepare_session("test-serve-session", pages=1)
+    client.post("/api/image/generate-all", json={"session_id": "test-serve-session", "force_regenerate": True})
+    images = get_session("test-serve-session")["generated_images"]
+    assert client.get(f"/api/image/{images[0]['filename']}").status_code == 200
+
+
+def test_short_and_path_like_names_are_not_found(client):
+    _prepare_session("test-serve-short", pages=1)
+    client.post("/api/image/generate-all", json={"session_id": "test-serve-short", "force_regenerate": True})
+    assert client.get("/api/image/第1页.jpg").status_code == 404
+    assert client.get("/api/image/..%2Fserver.py").status_code == 404
+
+
+def test_job_page_result_filename_is_servable(client):
+    import sys
+    jobs = sys.modules["modules.jobs"]
+
+    _prepare_session("test-serve-job", pages=1)
+    output_path = client.post("/api/image/generate-all", json={"session_id": "test-serve-job"}).json()["results"][0]["image_path"]
+    page = {"page": 1, "theme": "主题1", "status": jobs.PageStatus.DONE, "output_path": output_path, "retry_info": ""}
+    assert client.get(f"/api/image/{jobs._page_result(page)['filename']}").status_code == 200
+
+
+def test_variant_pruned_concurrently_is_regenerated(client, monkeypatch):
+    import modules.image_variants as image_variants
+
+    _prepare_session("test-serve-variant", pages=1)
+    filename = client.post("/api/image/generate-all", json={"session_id": "test-serve-variant", "force_regenerate": True}).json()["results"][0]["filename"]
+
+    # 模拟并发的清理在生成后、取文件信息前删掉了第一次的结果
+    store_variant = image_variants._store_variant
+    deleted = []
+
+    def racing_store(cache_path):
+        if not deleted:
+            deleted.append(cache_path)
+            cache_path.unlink()
+        return store_variant(cache_path)
+
+    monkeypatch.setattr(image_variants, "_store_variant", racing_store)
+    response = client.get(f"/api/image/{filename}?w=480&fmt=png")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/png"
+    assert deleted
@@ -0,0 +1,58 @@
+"""后台任务：重启后续跑只渲染未完成的页面；任务接口不阻塞事件循环"""
+
+import sys
+import asyncio
+
+from PIL import Image
+
+from modules.session import get_session, update_session
+
+
+jobs = sys.modules["modules.jobs"]  # modules 包导出的 jobs 是任务字典，与模块同名
+
+
+def _prepare_session(session_id: str, pages: int = 3):
+    update_session(session_id, style_json=[{"page": i + 1, "theme": f"主题{i + 1}", "prompt": f"{session_id} 第{i + 1}页"} for i in range(pages)])
+
+
+def test_recover_resumes_only_unfinished_pages(client, gemini):
+    _prepare_session("test-jobs-recover")
+
+    async def scenario():
+        job = await jobs.create_job("test-jobs-recover", get_session("test-jobs-recover"), "parallel", force_regenerate=True)
+        # 模拟上一个进程：第1页已完成，第2页渲染到一半进程退出，租约早已过期
+        Image.new("RGB", (64, 36)).save(job["pages"][0]["output_path"], "JPEG")
+        with jobs._connect() as conn:
+            conn.execute("UPDATE job_pages SET status = ?, attempts = 1 WHERE job_id = ? AND idx = 0", (jobs.PageStatus.DONE, job["id"]))
+            conn.execute("UPDATE job_pages SET status = ?, attempts = 1 WHERE job_id = ? AND idx = 1", (jobs.PageStatus.RUNNING, job["id"]))
+            conn.execute("UPDATE jobs SET status = ?, owner = 'old-worker', heartbeat_at = 0 WHERE id = ?", (jobs.JobStatus.RUNNING, job["id"]))
+
+        assert await jobs.recover_jobs() == 1
+        await asyncio.gather(*jobs._job_tasks.values())
+        return await jobs.get_job(job["id"])
+
+    job = client.portal.call(scenario)
+    assert gemini.calls == 2
+    assert job["status"] == jobs.JobStatus.COMPLETED
+    assert [p["status"] for p in job["pages"]] == [jobs.PageStatus.DONE] * 3
+    assert [p["attempts"] for p in job["pages"]] == [1, 2, 1]
+    assert len(get_session("test-jobs-recover")["generated_images"]) == 3
+
+
+def test_job_routes(client, gemini):
+    _prepare_session("test-jobs-routes", pages=2)
+    gemini.delay = 0.5
+    created = client.post("/api/jobs/generate-all", json={"session_id": "test-jobs-routes", "force_regenerate": True}).json()
+    # 进行中的任务不会重复创建
+    again = client.post("/api/jobs/generate-all", json={"session_id": "test-jobs-routes", "force_regenerate": True}).json()
+    assert again["job_id"] == created["job_id"]
+
+    assert client.post(f"/api/jobs/{created['job_id']}/cancel").json()["success"] is True
+    async def wait_jobs():
+        await asyncio.gather(*jobs._job_tasks.values(), return_exceptions=True)
+
+    client.portal.call(wait_jobs)
+    status = client.get(f"/api/jobs/{created['job_id']}").json()
+    assert status["status"] == jobs.JobStatus.CANCELLED
+    assert [job["job_id"] for job in client.get("/api/jobs/session/test-jobs-routes").json()["jobs"]] == [created["job_id"]]
+    assert client.get("/api/jobs/unknown-job").status_code == 404
@@ -0,0 +1,74 @@
+"""令牌桶：按速率补充、不超过容量；SQLite 后端在多个实例间共享额度"""
+
+import asyncio
+
+import pytest
+
+import modules.rate_limit as rate_limit
+from modules.rate_limit import TokenBucket, SqliteTokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self) -> float:
+        return self.now
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(rate_limit, "time", fake)
+    return fake
+
+
+def _check_refill(bucket, clock):
+    # 每分钟 60 个 = 每秒 1 个，容量 2
+    assert bucket._take() == 0
+    assert bucket._take() == 0
+    assert bucket._take() == pytest.approx(1.0)
+    clock.now += 0.5
+    assert bucket._take() == pytest.approx(0.5)
+    clock.now += 0.5
+    assert bucket._take() == 0
+    # 空闲很久也只补充到容量上限
+    clock.now += 60
+    assert bucket._take() == 0
+    assert bucket._take() == 0
+    assert bucket._take() == pytest.approx(1.0)
+
+
+def test_memory_bucket_refill(clock):
+    _check_refill(TokenBucket("test-memory", 60, 2), clock)
+
+
+def test_sqlite_bucket_refill(clock, tmp_path):
+    _check_refill(SqliteTokenBucket("test-sqlite", 60, 2, tmp_path / "rate_limit.db"), clock)
+
+
+def test_sqlite_bucket_shared_between_workers(clock, tmp_path):
+    db_file = tmp_path / "rate_limit.db"
+    first = SqliteTokenBucket("test-shared", 60, 2, db_file)
+    second = SqliteTokenBucket("test-shared", 60, 2, db_file)
+    assert first._take() == 0
+    assert second._take() == 0
+    # 另一个 worker 已经用掉了剩下的令牌
+    assert first._take() == pytest.approx(1.0)
+    clock.now += 1
+    assert second._take() == 0
+
+
+def test_acquire_waits_for_refill():
+    # 每秒 10 个，容量 1：第二次获取需要等约 0.1 秒
+    bucket = TokenBucket("test-acquire", 600, 1)
+
+    async def acquire_twice():
+        return await bucket.acquire(), await bucket.acquire()
+
+    first, second = asyncio.run(acquire_twice())
+    assert first < 0.05
+    assert 0.05 < second < 0.5
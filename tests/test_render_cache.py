@@ -0,0 +1,28 @@
+"""渲染缓存键：附件按内容哈希参与计算"""
+
+import base64
+
+from modules.image_cache import clear_image_cache, get_cached_base64
+from modules.render_cache import render_cache_key
+
+
+def _payload(prompt: str, data: str) -> dict:
+    parts = [{"text": prompt}, {"inline_data": {"mime_type": "image/png", "data": data}}]
+    return {"model": "image-model", "contents": [{"parts": parts}], "generationConfig": {"imageConfig": {"imageSize": "4K"}}}
+
+
+def test_key_uses_attachment_content(tmp_path):
+    logo = tmp_path / "logo.png"
+    logo.write_bytes(b"logo-v1" * 1000)
+    cached = get_cached_base64(str(logo))
+    key = render_cache_key(_payload("第1页", cached))
+
+    # 编码缓存被清空（或附件不是缓存返回的）时，键不变
+    clear_image_cache()
+    assert render_cache_key(_payload("第1页", base64.b64encode(b"logo-v1" * 1000).decode())) == key
+
+    assert render_cache_key(_payload("第2页", cached)) != key
+    assert render_cache_key(_payload("第1页", base64.b64encode(b"logo-v2" * 1000).decode())) != key
+    other = _payload("第1页", cached)
+    other["generationConfig"]["imageConfig"]["imageSize"] = "2K"
+    assert render_cache_key(other) != key
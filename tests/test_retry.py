@@ -0,0 +1,106 @@
+"""重试策略：Retry-After、时长预算；讯飞上传只在请求确定未被处理时重试"""
+
+import json
+
+import pytest
+import requests
+from urllib3.exceptions import MaxRetryError, NewConnectionError
+
+import modules.asr as asr
+from modules.config import RETRY_AFTER_MAX
+from modules.retry import RetryPolicy, parse_retry_after
+
+
+def test_retry_after_overrides_backoff():
+    call = RetryPolicy("test-retry-after", base_delay=0).begin()
+    next(call.attempts())
+    assert call.retry_delay(True, 2.5) == 2.5
+    # 服务端要求的等待时间有上限
+    assert call.retry_delay(True, RETRY_AFTER_MAX * 10) == RETRY_AFTER_MAX
+    assert parse_retry_after("3") == 3.0
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+    assert parse_retry_after("soon") is None
+
+
+def test_deadline_stops_retries():
+    policy = RetryPolicy("test-deadline", base_delay=0, max_attempts=10, deadline=1.0)
+    call = policy.begin()
+    next(call.attempts())
+    assert call.retry_delay(True, 0.2) is not None
+    # 按 Retry-After 等待会超出时长预算
+    assert call.retry_delay(True, 5) is None
+    assert policy.stats()["deadline_exceeded"] == 1
+    assert call.remaining(180) <= 1.0
+
+
+def test_non_retryable_and_exhausted():
+    policy = RetryPolicy("test-exhausted", base_delay=0, max_attempts=2)
+    call = policy.begin()
+    attempts = call.attempts()
+    next(attempts)
+    assert call.retry_delay(False) is None
+    next(attempts)
+    assert call.retry_delay(True) is None
+    assert policy.stats()["non_retryable"] == 1 and policy.stats()["exhausted"] == 1
+
+
+class FakeResponse:
+    def __init__(self, status_code: int, headers: dict = None, body: dict = None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.text = json.dumps(body or {"code": "000000"})
+
+
+def _connect_error():
+    return requests.ConnectionError(MaxRetryError(None, "/upload", NewConnectionError(None, "connection refused")))
+
+
+@pytest.fixture
+def xfyun(monkeypatch):
+    """按顺序返回预设的响应或异常，记录调用次数"""
+    outcomes = []
+    calls = []
+
+    def post(url, timeout=None, **kwargs):
+        calls.append(url)
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    monkeypatch.setattr(asr.requests, "post", post)
+    return outcomes, calls
+
+
+@pytest.mark.parametrize("failure", [
+    FakeResponse(500),
+    FakeResponse(503),  # 没有 Retry-After
+    requests.ReadTimeout("read timed out"),
+    requests.ConnectionError("connection reset by peer"),
+])
+def test_upload_not_retried_when_possibly_processed(xfyun, failure):
+    outcomes, calls = xfyun
+    outcomes.extend([failure, FakeResponse(200)])
+    with pytest.raises(RuntimeError):
+        asr._post_with_retry("/upload", idempotent=False)
+    assert len(calls) == 1
+
+
+@pytest.mark.parametrize("failure", [
+    FakeResponse(429, {"Retry-After": "0"}),
+    FakeResponse(503, {"Retry-After": "0"}),
+    _connect_error(),
+    requests.ConnectTimeout("connect timed out"),
+])
+def test_upload_retried_when_not_processed(xfyun, failure):
+    outcomes, calls = xfyun
+    outcomes.extend([failure, FakeResponse(200)])
+    assert asr._post_with_retry("/upload", idempotent=False) == {"code": "000000"}
+    assert len(calls) == 2
+
+
+def test_result_query_keeps_full_retries(xfyun):
+    outcomes, calls = xfyun
+    outcomes.extend([FakeResponse(500), requests.ReadTimeout("read timed out"), FakeResponse(200)])
+    assert asr._post_with_retry("/getResult") == {"code": "000000"}
+    assert len(calls) == 3
@@ -0,0 +1,118 @@
+"""会话 ETag 与增量同步游标：会话被清理重建后旧的 ETag / since 不会误配"""
+
+from modules import session as session_module
+from modules.session import update_session
+
+
+def _recreate(session_id: str):
+    """模拟会话被清理后重建（memory 后端），写入次数与之前相同"""
+    session_module.session_store.data.pop(session_id)
+    update_session(session_id, user_input="重建后的内容")
+
+
+def test_etag_and_delta_cursor_round_trip(client):
+    update_session("test-sync", user_input="内容")
+    first = client.get("/api/session/test-sync")
+    etag, body = first.headers["etag"], first.json()
+    assert body["epoch"] in etag
+
+    assert client.get("/api/session/test-sync", headers={"If-None-Match": etag}).status_code == 304
+    delta = client.get("/api/session/test-sync", params={"since": body["version"], "epoch": body["epoch"]}).json()
+    assert delta["delta"] is True
+
+
+def test_recreated_session_does_not_match_old_etag_or_cursor(client):
+    update_session("test-sync-recreate", user_input="内容")
+    first = client.get("/api/session/test-sync-recreate")
+    etag, body = first.headers["etag"], first.json()
+
+    _recreate("test-sync-recreate")
+    again = client.get("/api/session/test-sync-recreate", headers={"If-None-Match": etag})
+    assert again.status_code == 200
+    assert again.json()["version"] == body["version"]
+    assert again.headers["etag"] != etag
+
+    stale = client.get("/api/session/test-sync-recreate", params={"since": body["version"], "epoch": body["epoch"]}).json()
+    assert stale["delta"] is False
+
+
+def test_delta_cursor_without_epoch_returns_full_state(client):
+    update_session("test-sync-legacy", user_input="内容")
+    assert client.get("/api/session/test-sync-legacy", params={"since": 0}).json()["delta"] is False
+
+
+def test_websocket_resends_from_start_for_stale_epoch(client):
+    update_session("test-sync-ws", outline_json=[{"title": "第一页"}])
+    body = client.get("/api/session/test-sync-ws").json()
+
+    with client.websocket_connect(f"/ws/session/test-sync-ws?since={body['version']}&epoch=stale") as websocket:
+        event = websocket.receive_json()
+    assert event["since"] == 0
+    assert event["outline"] == [{"title": "第一页"}]
+
+
+def test_websocket_close_leaves_no_pending_receiver(client):
+    import gc
+    import warnings
+
+    update_session("test-sync-ws-close", user_input="内容")
+    body = client.get("/api/session/test-sync-ws-close").json()
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        with client.websocket_connect(f"/ws/session/test-sync-ws-close?since={body['version']}&epoch={body['epoch']}") as websocket:
+            websocket.send_text("客户端发送的多余数据")
+        gc.collect()
+    # 连接关闭后会话仍可正常读取
+    assert client.get("/api/session/test-sync-ws-close").status_code == 200
+
+
+def test_unknown_session_etag_is_stable(client):
+    first = client.get("/api/session/test-sync-unknown")
+    second = client.get("/api/session/test-sync-unknown")
+    assert first.headers["ETag"] == second.headers["ETag"]
+    assert client.get("/api/session/test-sync-unknown", headers={"If-None-Match": first.headers["ETag"]}).status_code == 304
+
+    # 会话创建后 epoch 改变，旧 ETag 不再匹配
+    update_session("test-sync-unknown", user_input="内容")
+    assert client.get("/api/session/test-sync-unknown", headers={"If-None-Match": first.headers["ETag"]}).status_code == 200
+
+
+def test_idle_sessions_evicted_without_new_sessions(client, monkeypatch):
+    update_session("test-sync-idle", user_input="内容")
+    monkeypatch.setattr(session_module, "SESSION_IDLE_TTL", -1)
+    monkeypatch.setattr(session_module, "SESSION_EVICT_INTERVAL", 0.01)
+
+    async def run_once():
+        import asyncio
+        task = asyncio.create_task(session_module.session_maintenance_loop())
+        await asyncio.sleep(0.2)
+        task.cancel()
+
+    client.portal.call(run_once)
+    assert session_module.session_store.load("test-sync-idle") is None
+
+
+def test_sqlite_store_io_runs_off_event_loop(monkeypatch, tmp_path):
+    import asyncio
+    import threading
+
+    store = session_module.SqliteSessionStore(tmp_path / "sessions.db")
+    monkeypatch.setattr(session_module, "session_store", store)
+    io_threads = set()
+    load = store.load
+
+    def tracking_load(session_id):
+        io_threads.add(threading.get_ident())
+        return load(session_id)
+
+    monkeypatch.setattr(store, "load", tracking_load)
+
+    async def scenario():
+        await session_module.update_session_async("test-sync-sqlite", user_input="内容")
+        await session_module.add_message_async("test-sync-sqlite", "user", "你好")
+        session = await session_module.get_session_async("test-sync-sqlite")
+        return threading.get_ident(), session
+
+    loop_thread, session = asyncio.run(scenario())
+    assert session["user_input"] == "内容" and session["messages"][-1]["content"] == "你好"
+    assert io_threads and loop_thread not in io_threads
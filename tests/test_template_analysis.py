@@ -0,0 +1,21 @@
+"""母版分析：生成图片前的等待有上限"""
+
+import asyncio
+
+import modules.template_analysis as template_analysis
+
+
+def test_wait_is_bounded(monkeypatch):
+    monkeypatch.setattr(template_analysis, "TEMPLATE_ANALYSIS_WAIT_TIMEOUT", 0.05)
+
+    async def scenario():
+        analysis = asyncio.create_task(asyncio.sleep(1))
+        monkeypatch.setitem(template_analysis._session_tasks, "test-analysis-wait", analysis)
+        ready = await template_analysis.wait_template_analysis("test-analysis-wait")
+        # 超时后分析任务不被取消，继续在后台执行
+        running = not analysis.done()
+        analysis.cancel()
+        return ready, running
+
+    assert asyncio.run(scenario()) == (False, True)
+    assert asyncio.run(template_analysis.wait_template_analysis("test-analysis-none")) is True